@@ -1,125 +1,79 @@
 import os
-import json
-import re
+import logging
 import random
-import urllib.parse
+from concurrent.futures import TimeoutError as WaitTimeout
 from datetime import date
 from dotenv import load_dotenv
-from PIL import Image
-import fitz  # PyMuPDF
 import streamlit as st
-import google.generativeai as genai
+from klagehjelpen.admission import QUEUE_TIMEOUT, AdmissionController, FlightAbandoned, QueueTimeout, SingleFlight
+from klagehjelpen.budget import estimate_tokens
+from klagehjelpen.cache import ResultCache, make_cache_key
+from klagehjelpen.contacts import ContactDirectory
+from klagehjelpen.core import ComplaintInputs, build_letter_prompt, finalize_facts, prepare_facts_request
+from klagehjelpen.images import format_bytes
+from klagehjelpen.ingest import MemoryLimitExceeded
+from klagehjelpen.json_stream import IncrementalJSONParser
+from klagehjelpen.llm import (
+    ATTEMPT_TIMEOUT, FACTS_CONFIG, LETTER_CONFIG, PRIMARY_MODEL, generate_complaint_stream, run_generation,
+)
+from klagehjelpen.metrics import inc, span, start_metrics_server
+from klagehjelpen.response import ParsedResponse, parse_complaint, parse_facts
+from result_view import show_result_view
 
 # ==========================================
 # 1. SETUP & CONFIG
 # ==========================================
 load_dotenv()
+logging.basicConfig(level=os.getenv("KLAGE_LOG_LEVEL", "INFO"), format="%(asctime)s %(name)s %(levelname)s %(message)s")
 ENV_API_KEY = os.getenv("GOOGLE_API_KEY", "")
-
-if ENV_API_KEY:
-    genai.configure(api_key=ENV_API_KEY)
+# Strømming viser brevet fortløpende. Sett KLAGE_STREAMING=0 for å vente på hele svaret.
+STREAMING = os.getenv("KLAGE_STREAMING", "1") != "0"
+# Hvor lenge en identisk forespørsel venter på den som kjører: to steg, hver med kø og opptil to modellforsøk
+COALESCE_TIMEOUT = 2 * (QUEUE_TIMEOUT + 2 * ATTEMPT_TIMEOUT)
 
 st.set_page_config(page_title="KlageHjelpen", page_icon="⚖️", layout="wide")
 
+@st.cache_resource
+def get_result_cache():
+    # Én cache per prosess, delt mellom alle økter. Sett KLAGE_CACHE_DIR for disk-backend.
+    return ResultCache(
+        max_entries=int(os.getenv("KLAGE_CACHE_MAX", "128")),
+        ttl_seconds=int(os.getenv("KLAGE_CACHE_TTL", "3600")),
+        disk_dir=os.getenv("KLAGE_CACHE_DIR") or None,
+    )
+
+@st.cache_resource
+def configure_genai():
+    # google.generativeai er tungt å importere; lastes og konfigureres én gang per prosess, ved første AI-kall
+    import google.generativeai as genai
+    if ENV_API_KEY:
+        genai.configure(api_key=ENV_API_KEY)
+    return genai
+
+@st.cache_resource
+def get_admission_controller():
+    # Felles kø og kvote for alle økter i prosessen (KLAGE_MODEL_RPM, KLAGE_ADMISSION_FILE m.fl.)
+    return AdmissionController()
+
+@st.cache_resource
+def get_inflight():
+    return SingleFlight()
+
+@st.cache_resource
+def get_metrics_server():
+    # Prometheus-endepunkt på egen port (Streamlit har ikke egne ruter). Sett KLAGE_METRICS_PORT.
+    port = os.getenv("KLAGE_METRICS_PORT")
+    return start_metrics_server(int(port)) if port else None
+
+get_metrics_server()
+
 # ==========================================
-# 2. VERIFISERT KONTAKTDATABASE (50+ SELSKAPER)
+# 2. VERIFISERT KONTAKTDATABASE (klagehjelpen/data/contacts.json)
 # ==========================================
-VERIFIED_CONTACTS = {
-    # --- ELEKTRONIKK & HVITEVARER ---
-    "elkjop": {"email": "hello@elkjop.no", "navn": "Elkjøp"},
-    "elkjøp": {"email": "hello@elkjop.no", "navn": "Elkjøp"},
-    "power": {"email": "kundeservice@power.no", "navn": "Power"},
-    "komplett": {"email": "kundeservice@komplett.no", "navn": "Komplett.no"},
-    "netonnet": {"email": "kundeservice@netonnet.no", "navn": "NetOnNet"},
-    "apple": {"email": "contactus.no@euro.apple.com", "navn": "Apple Store"},
-    "dustin": {"email": "kundeservice@dustinhome.no", "navn": "Dustin Home"},
-    "fjellsport": {"email": "kundeservice@fjellsport.no", "navn": "Fjellsport"},
-
-    # --- MØBLER, INTERIØR & BYGG ---
-    "ikea": {
-        "web": "https://www.ikea.com/no/no/customer-service/contact-us/",
-        "navn": "IKEA",
-        "advarsel": "IKEA krever ofte chat/tlf, men bruk dette kontaktskjemaet for reklamasjoner."
-    },
-    "jysk": {"email": "kundeservice@jysk.no", "navn": "JYSK"},
-    "bohus": {"email": "kundeservice@bohus.no", "navn": "Bohus"},
-    "skeidar": {"email": "netthandel@skeidar.no", "navn": "Skeidar"},
-    "møbelringen": {"email": "kundeservice@mobelringen.no", "navn": "Møbelringen"},
-    "kid": {"email": "kundeservice@kid.no", "navn": "Kid Interiør"},
-    "princess": {"email": "kundeservice@princessgruppen.no", "navn": "Princess"},
-    "clas ohlson": {"email": "kundesenter@clasohlson.no", "navn": "Clas Ohlson"},
-    "biltema": {"email": "kundeservice@biltema.no", "navn": "Biltema"},
-    "jula": {"web": "https://www.jula.no/kundeservice/kontakt-oss/", "navn": "Jula"},
-    "megaflis": {"email": "kundeservice@megaflis.no", "navn": "Megaflis"},
-    "thansen": {"email": "thansen@thansen.no", "navn": "Thansen"},
-    "europris": {"email": "kundeservice@europris.no", "navn": "Europris"},
-    "maxbo": {"web": "https://www.maxbo.no/kundeservice/kontakt-oss/", "navn": "Maxbo", "advarsel": "Bruk skjemaet for netthandel. Kjøp i butikk må tas i varehus."},
-
-    # --- KLÆR & SPORT ---
-    "zalando": {"email": "service@zalando.no", "navn": "Zalando"},
-    "xxl": {"email": "kundeservice@xxl.no", "navn": "XXL"},
-    "sport 1": {"email": "kundeservice@sport1.no", "navn": "Sport 1"},
-    "intersport": {"email": "kundeservice@intersport.no", "navn": "Intersport"},
-    "hm": {"web": "https://www2.hm.com/no_no/customer-service/contact.html", "navn": "H&M"},
-    "h&m": {"web": "https://www2.hm.com/no_no/customer-service/contact.html", "navn": "H&M"},
-
-    # --- MAT, LEVERING & DAGLIGVARE ---
-    "oda": {"email": "hei@oda.com", "navn": "Oda"},
-    "foodora": {"email": "support@foodora.no", "navn": "Foodora"},
-    "wolt": {"email": "support@wolt.com", "navn": "Wolt"},
-    "meny": {
-        "web": "https://meny.no/kundeservice/reklamasjon/",
-        "email": "nettbutikk@meny.no", 
-        "navn": "Meny",
-        "advarsel": "Bruk reklamasjonsskjemaet for raskest behandling."
-    },
-    "kiwi": {"web": "https://kiwi.no/kundeservice/kontakt-oss/", "navn": "Kiwi", "advarsel": "Kiwi håndterer klager via skjema."},
-    "rema": {"web": "https://www.rema.no/kundeservice/", "navn": "Rema 1000"},
-
-    # --- FLYSELSKAP (Mange krever webskjema!) ---
-    "sas": {"web": "https://www.sas.no/kundeservice/kontakt/skjemaer/sertifikat-forsinket-innstilt-fly", "navn": "SAS", "advarsel": "Bruk dette skjemaet for EU261-kompensasjon."},
-    "norwegian": {"web": "https://www.norwegian.com/no/reiseinformasjon/forsinkelser-og-kanselleringer/forsinkelser/", "navn": "Norwegian", "advarsel": "Norwegian krever at du velger refusjon/krav via denne portalen."},
-    "widerøe": {"web": "https://www.wideroe.no/hjelp-og-kontakt/flight-claim", "navn": "Widerøe", "advarsel": "Bruk Widerøes eget skjema for refusjon og erstatning."},
-    "ryanair": {"web": "https://onlineform.ryanair.com/no/no/eu-261", "navn": "Ryanair", "advarsel": "Ryanair godtar KUN sitt eget skjema."},
-    "wizz": {"web": "https://wizzair.com/en-gb/information-and-services/prices-discounts/refunds-and-compensations", "navn": "Wizz Air"},
-    "klm": {"web": "https://www.klm.no/en/information/refund-compensation", "navn": "KLM"},
-    "lufthansa": {"web": "https://www.lufthansa.com/no/en/feedback", "navn": "Lufthansa"},
-    "air france": {"web": "https://wwws.airfrance.no/en/claim", "navn": "Air France"},
-    "british airways": {"web": "https://www.britishairways.com/content/information/delayed-or-cancelled-flights/compensation", "navn": "British Airways"},
-    "finnair": {"web": "https://www.finnair.com/no-en/customer-care/feedback-and-claims", "navn": "Finnair"},
-    "icelandair": {"web": "https://www.icelandair.com/support/contact-us/claims/", "navn": "Icelandair"},
-    "qatar": {"web": "https://www.qatarairways.com/en/help.html", "navn": "Qatar Airways"},
-    "emirates": {"web": "https://www.emirates.com/no/english/help/forms/complaint/", "navn": "Emirates"},
-
-    # --- REISE & KOLLEKTIV (Tog, Buss, Ferge) ---
-    "vy": {"web": "https://www.vy.no/kundeservice/klage-og-erstatning", "navn": "Vy", "advarsel": "Vy krever bruk av skjema for refusjon."},
-    "ruter": {"web": "https://ruter.no/fa-hjelp-og-kontakt/kontaktskjema/", "navn": "Ruter", "advarsel": "Ruter behandler kun klager via skjema (ikke e-post)."},
-    "flytoget": {"email": "flytoget@flytoget.no", "navn": "Flytoget"},
-    "skyss": {"web": "https://www.skyss.no/hjelp-og-kontakt/kundesenter/kontaktskjema/", "navn": "Skyss (Bergen)"},
-    "atb": {"web": "https://www.atb.no/kontakt/", "navn": "AtB (Trondheim)"},
-    "kolumbus": {"web": "https://www.kolumbus.no/hjelp-og-kontakt/kontaktskjema/", "navn": "Kolumbus (Stavanger)"},
-    "color line": {"web": "https://www.colorline.no/kundeservice/tilbakemelding", "navn": "Color Line"},
-    "fjord line": {"email": "info@fjordline.com", "navn": "Fjord Line"},
-    "dfds": {"email": "kundeservice@dfds.com", "navn": "DFDS"},
-
-    # --- PARKERING ---
-    "apcoa": {"web": "https://www.kontrollavgift.no/", "navn": "Apcoa / EuroPark"},
-    "europark": {"web": "https://www.kontrollavgift.no/", "navn": "Apcoa / EuroPark"},
-    "aimo": {"web": "https://www.aimopark.no/kontakt-oss/kontrollsanksjon/", "navn": "Aimo Park"},
-    "onepark": {"web": "https://onepark.no/klage/", "navn": "ONEPARK"},
-    "easypark": {"email": "kundeservice@easypark.no", "navn": "EasyPark"},
-    "riverty": {"web": "https://www.riverty.com/no-no/kundeservice/", "navn": "Riverty (Faktura)"},
-
-    # --- TELEKOM & BANK ---
-    "telenor": {"web": "https://www.telenor.no/kundeservice/kontakt-oss/", "navn": "Telenor"},
-    "telia": {"email": "kundekontakt-privat@telia.no", "navn": "Telia", "advarsel": "Denne e-posten gjelder primært formelle klager."},
-    "onecall": {"email": "kundeservice@onecall.no", "navn": "OneCall"},
-    "talkmore": {"email": "kundeservice@talkmore.no", "navn": "Talkmore"},
-    "ice": {"web": "https://www.ice.no/kundeservice/kontakt-oss/", "navn": "Ice"},
-    "vipps": {"web": "https://vipps.no/kontakt-oss/", "navn": "Vipps"},
-    "klarna": {"web": "https://www.klarna.com/no/kundeservice/", "navn": "Klarna"},
-    "dnb": {"web": "https://www.dnb.no/kundeservice", "navn": "DNB"}
-}
+@st.cache_resource
+def get_contact_directory():
+    # Én katalog per prosess; filen leses ved første oppslag og lastes på nytt når den endres
+    return ContactDirectory()
 
 # ==========================================
 # 3. HJELPEFUNKSJONER
@@ -127,74 +81,165 @@ VERIFIED_CONTACTS = {
 
 def get_best_contact_method(company_name_from_ai):
     if not company_name_from_ai: return None
-    search_term = company_name_from_ai.lower().strip()
-    for key, info in VERIFIED_CONTACTS.items():
-        if key in search_term: return info
-    return None
-
-def extract_pdf_data(uploaded_file):
-    doc = fitz.open(stream=uploaded_file.read(), filetype="pdf")
-    full_text = ""
-    first_page_img = None
-    for page in doc: 
-        full_text += page.get_text() + "\n"
-    if len(doc) > 0:
-        page = doc.load_page(0)
-        pix = page.get_pixmap()
-        first_page_img = Image.frombytes("RGB", [pix.width, pix.height], pix.samples)
-    return full_text, first_page_img
-
-def check_name_similarity(name_on_doc, user_name):
-    # Hvis en av dem mangler, antar vi det er greit (f.eks manuell inntasting)
-    if not name_on_doc or not user_name: return True
-    if name_on_doc.lower() == "null" or name_on_doc.lower() == "none": return True
-    
-    doc_clean = re.sub(r'[^\w\s]', '', name_on_doc.lower()).split()
-    user_clean = re.sub(r'[^\w\s]', '', user_name.lower()).split()
-    match_found = False
-    for part in user_clean:
-        if part in doc_clean and len(part) > 2:
-            match_found = True
-            break
-    return match_found
-
-def clean_json_text(text):
-    """Fjerner markdown code blocks hvis AI legger det til."""
-    text = text.strip()
-    if text.startswith("```json"):
-        text = text[7:]
-    if text.startswith("```"):
-        text = text[3:]
-    if text.endswith("```"):
-        text = text[:-3]
-    return text.strip()
-
-def generate_complaint(prompt: str, images=None) -> dict:
-    model_name = "gemini-2.0-flash"
-    generation_config = {"response_mime_type": "application/json"}
-    
-    inputs = [prompt]
-    if images:
-        if isinstance(images, list):
-            inputs.extend(images)
-        else:
-            inputs.append(images)
+    with span("contact_lookup"):
+        return get_contact_directory().match(company_name_from_ai)
+
+def stream_complaint_to_ui(prompt: str, images=None, models=None, generation_config=None,
+                           defaults=None, allow=None) -> ParsedResponse:
+    """Viser selskap, emne og brødtekst fortløpende mens modellen skriver.
+
+    `defaults` er faktaene fra dokumentanalysen; de fyller feltene brevsvaret ikke har.
+    Et brev fra en strøm som brøt, kommer tilbake med `repaired=True`.
+    """
+    defaults = defaults or {}
+    header_box = st.empty()
+    body_box = st.empty()
+    header_box.info("⏳ Skriver klagebrevet ..." if defaults else "⏳ Analyserer dokumentene ...")
+
+    parser = IncrementalJSONParser()
+    chunks = []
+    try:
+        for text in generate_complaint_stream(prompt, images, models, generation_config=generation_config,
+                                              allow=allow):
+            chunks.append(text)
+            completed = parser.feed(text)
+
+            if "selskapsnavn_funnet" in completed or "emne" in completed:
+                company = parser.fields.get("selskapsnavn_funnet") or defaults.get("selskapsnavn_funnet") or ""
+                # Kontaktoppslaget kan starte før brevet er ferdig skrevet
+                contact = get_best_contact_method(company)
+                st.session_state.detected_company = company
+                line = f"🏢 **{contact['navn'] if contact else company or '...'}**"
+                if parser.fields.get("emne"):
+                    line += f" — {parser.fields['emne']}"
+                header_box.info(line)
+
+            body = parser.partial("brødtekst")
+            if body:
+                body_box.text(body)
+    except Exception:
+        # Strømmen brøt midt i brevet: behold det vi har fått i stedet for å starte på nytt
+        if not parser.partial("brødtekst"):
+            raise
+
+    header_box.empty()
+    body_box.empty()
+
+    # Avkortet/ugyldig JSON repareres lokalt; bare et svar uten brødtekst gir feil
+    parsed = parse_complaint("".join(chunks), defaults=defaults)
+    show_repair_notice(parsed.problems)
+    return parsed
+
+def privacy_text(cache) -> str:
+    # Teksten skal stemme med hva cachen faktisk gjør (KLAGE_CACHE_TTL, KLAGE_CACHE_DIR)
+    where = "i minnet og på disken til serveren" if cache.disk_dir else "i minnet på serveren"
+    minutes = max(1, round(cache.ttl_seconds / 60))
+    return (
+        "Vi lagrer ingen filer. Dokumentene sendes kryptert til AI for analyse. "
+        "Ferdige utkast og fakta hentet fra dokumentene – som kan inneholde navn og e-post – "
+        f"holdes {where} i inntil {minutes} min, slik at samme forespørsel ikke må sendes til AI på nytt. "
+        "Et utkast gis bare tilbake til den som sender nøyaktig de samme filene og valgene, inkludert navn og e-post."
+    )
 
+def show_repair_notice(problems):
+    if problems:
+        st.warning(f"🛠️ Svaret fra AI ble rettet automatisk ({', '.join(problems)}). Les gjennom brevet før du sender.")
+
+def admit_to_queue():
+    """Venter på tur i den felles kvoten og viser plass i køen underveis."""
+    # Felles kvote for alle økter: vent på tur i stedet for å få 429 og prøve på nytt samtidig
+    queue_box = st.empty()
+    admission = get_admission_controller().admit(
+        on_wait=lambda position, eta: queue_box.info(
+            f"⏳ Stor pågang: du er nummer {position} i køen (ca. {max(1, round(eta))} s ventetid)"
+        )
+    )
+    queue_box.empty()
+    if admission.model != PRIMARY_MODEL:
+        st.caption(f"🔀 Lang kø – sendt til {admission.model} for raskere svar")
+    return admission
+
+def extract_facts(files, facts_key):
+    """Steg 1: leser dokumentene (med bilder) og henter ut fakta. Caches per filsett."""
+    result_cache = get_result_cache()
+    facts = result_cache.get(facts_key, stage="fakta")
+    if facts is not None:
+        st.caption("⚡ Dokumentene er analysert før – bruker faktaene fra cache")
+        return facts
+
+    contact_matcher = get_contact_directory().matcher()
+    configure_genai()
+    request = prepare_facts_request(files, contact_matcher)
+    text_report, image_report = request.text_report, request.image_report
+
+    if request.local_facts and request.local_facts.company:
+        st.session_state.detected_company = request.local_facts.company
+        st.caption(f"🧾 Funnet lokalt i kvitteringen: **{request.local_facts.company}**")
+    st.caption(
+        f"🖼️ {image_report.images_out} bilde(r) sendes: "
+        f"{format_bytes(image_report.bytes_before)} rå piksler → {format_bytes(image_report.bytes_after)}"
+        + (f" ({image_report.duplicates_dropped} duplikat fjernet)" if image_report.duplicates_dropped else "")
+    )
+    st.caption(
+        f"📄 Dokumenttekst: {text_report.line_tokens_out} av {text_report.tokens_in} tokens "
+        f"({text_report.lines_out} linjer) · prompt ≈ {estimate_tokens(request.prompt)} tokens"
+        + (f" · leste {request.pages_read} av {request.pages_total} PDF-sider"
+           if request.pages_read < request.pages_total else "")
+        + f" · minne ≈ {format_bytes(request.peak_memory)}"
+    )
+
+    admission = admit_to_queue()
     try:
-        model = genai.GenerativeModel(model_name, generation_config=generation_config)
-        response = model.generate_content(inputs)
-        cleaned_text = clean_json_text(response.text)
-        return json.loads(cleaned_text)
+        with st.spinner("Analyserer dokumentene ..."):
+            generation = run_generation(request.prompt, request.images, models=admission.models,
+                                        parse=parse_facts, generation_config=FACTS_CONFIG,
+                                        allow=admission.allow)
     except Exception as e:
-        # Fallback
-        try:
-            fallback = "gemini-1.5-flash"
-            model = genai.GenerativeModel(fallback, generation_config=generation_config)
-            response = model.generate_content(inputs)
-            cleaned_text = clean_json_text(response.text)
-            return json.loads(cleaned_text)
-        except:
-            raise e
+        get_admission_controller().report_failure(e)
+        raise
+    finally:
+        request.release()
+    st.caption(f"🔎 Dokumentene analysert av {generation.model} på {generation.seconds:.1f} s")
+    show_repair_notice(generation.problems)
+
+    facts = finalize_facts(generation.data, request, contact_matcher)
+    # Avkortede svar caches ikke; et nytt forsøk skal få en ny sjanse
+    if not generation.repaired:
+        result_cache.put(facts_key, facts)
+    return facts
+
+def write_complaint(facts, complaint_inputs) -> ParsedResponse:
+    """Steg 2: skriver brevet ut fra faktaene. Ren tekstprompt, ingen bilder."""
+    configure_genai()
+    prompt = build_letter_prompt(complaint_inputs, facts)
+    admission = admit_to_queue()
+    try:
+        if STREAMING:
+            return stream_complaint_to_ui(prompt, None, admission.models, LETTER_CONFIG, defaults=facts,
+                                          allow=admission.allow)
+        with st.spinner("Skriver klagebrevet ..."):
+            generation = run_generation(
+                prompt, models=admission.models, generation_config=LETTER_CONFIG, allow=admission.allow,
+                parse=lambda text, model=None: parse_complaint(text, model, defaults=facts),
+            )
+    except Exception as e:
+        get_admission_controller().report_failure(e)
+        raise
+    st.caption(
+        f"🤖 Svar fra {generation.model} på {generation.seconds:.1f} s"
+        + (f" · {generation.prompt_tokens} prompt-tokens" if generation.prompt_tokens else "")
+    )
+    show_repair_notice(generation.problems)
+    return ParsedResponse(generation.data, generation.repaired, generation.problems)
+
+def create_complaint(files, complaint_inputs, facts_key) -> ParsedResponse:
+    """Fakta fra dokumentene (cachet per filsett), deretter selve brevet."""
+    facts = extract_facts(files, facts_key)
+    st.session_state.complaint_facts = facts
+    if facts.get("selskapsnavn_funnet"):
+        st.session_state.detected_company = facts["selskapsnavn_funnet"]
+    return write_complaint(facts, complaint_inputs)
+
 
 # ==========================================
 # 4. SIDEBAR
@@ -208,7 +253,7 @@ with st.sidebar:
     mitt_navn = st.text_input("Ditt navn", placeholder="Ola Nordmann")
     min_epost = st.text_input("Din e-post", placeholder="ola@mail.no")
     with st.expander("🔒 Personvern", expanded=False):
-        st.markdown("Vi lagrer ingen filer. Data sendes kryptert til AI for analyse og slettes fra minnet etterpå.")
+        st.markdown(privacy_text(get_result_cache()))
     st.markdown("---")
     st.link_button("☕ Spander en kaffe", "[https://buymeacoffee.com/klagehjelpen](https://buymeacoffee.com/klagehjelpen)")
 
@@ -224,6 +269,8 @@ if "detected_company" not in st.session_state:
     st.session_state.detected_company = None
 if "uploaded_filenames" not in st.session_state: 
     st.session_state.uploaded_filenames = []
+if "complaint_facts" not in st.session_state:
+    st.session_state.complaint_facts = None
 
 # Random placeholder logic
 if "random_placeholder" not in st.session_state:
@@ -263,6 +310,11 @@ with col_info:
 
 tone = st.radio("Tonefall:", ["Saklig (Anbefalt)", "Vennlig", "Veldig formell"], horizontal=True)
 
+complaint_inputs = ComplaintInputs(
+    feil_beskrivelse=feil_beskrivelse, losning=losning, tone=tone, rolle=rolle,
+    hendelsesdato=hendelsesdato, mitt_navn=mitt_navn, min_epost=min_epost,
+)
+
 if st.button("Generer klageutkast 🚀", type="primary"):
     if not uploaded_files:
         st.error("⚠️ Du må laste opp minst én fil.")
@@ -274,173 +326,92 @@ if st.button("Generer klageutkast 🚀", type="primary"):
         # Lagre filnavn for senere påminnelse
         st.session_state.uploaded_filenames = [f.name for f in uploaded_files]
 
-        all_images = []
-        combined_text = ""
-
-        for uploaded_file in uploaded_files:
-            if uploaded_file.type == "application/pdf":
-                text, img = extract_pdf_data(uploaded_file)
-                combined_text += f"\n--- TEKST FRA {uploaded_file.name} ---\n{text}"
-                if img: all_images.append(img)
-            else:
-                img = Image.open(uploaded_file)
-                all_images.append(img)
-        
-        # --- PROMPT ---
-        prompt_auto = f"""
-        Du er en profesjonell, norsk klagehjelper.
-        
-        DOKUMENT-TEKST: {combined_text[:6000]}
-        
-        OPPGAVE:
-        1. Analyser vedlagte bilder/dokumenter.
-        2. Identifiser hvilket bilde som er KVITTERING (hent kjøpsinfo) og hvilket som er SKADEBEVIS (beskriv feilen).
-        3. Skriv en reklamasjon basert på NORSK LOV.
-        
-        VIKTIG OM SPRÅK:
-        - Hele klagebrevet SKAL skrives på NORSK (Bokmål).
-        - Oversett all info fra dokumentene til norsk.
-        
-        VIKTIG OM SIGNATUR (UNNGÅ DOBBEL TEKST):
-        - Avslutt brevet kun én gang slik: "Med vennlig hilsen, [Ditt Navn]".
-        - IKKE legg til navn, adresse eller e-post på nytt under signaturen hvis det allerede står der.
-        
-        DATA:
-        - DATO: {hendelsesdato}
-        - PROBLEM: "{feil_beskrivelse}"
-        - KRAV: {losning}
-        - KLAGER: {mitt_navn} ({min_epost})
-        - ROLLE: {rolle}
-        - TONE: {tone}
-        
-        JURIDISK HUKOMMELSE:
-        - Elektronikk/møbler = 5 års frist (Forbrukerkjøpsloven § 27).
-        - Fly = EU261.
-        - P-bot = Parkeringsforskriften.
-        - Svarfrist: 14 dager.
-        
-        OUTPUT FORMAT (JSON):
-        {{
-            "selskapsnavn_funnet": "string",
-            "navn_paa_kvittering": "string (eller null)",
-            "emne": "string (På Norsk)",
-            "mottaker_epost_gjetning": "string",
-            "brødtekst": "string (Kun på Norsk)"
-        }}
-        """
-        
-        with st.spinner(f"Analyserer {len(uploaded_files)} dokument(er) og skriver klage..."):
-            result_json = generate_complaint(prompt_auto, all_images)
+        with span("file_read", files=len(uploaded_files)):
+            file_bytes = [f.getvalue() for f in uploaded_files]
+
+        # Identisk forespørsel (samme filer og valg) hentes fra cache uten nytt AI-kall
+        result_cache = get_result_cache()
+        cache_key = make_cache_key(file_bytes, **complaint_inputs.as_dict())
+        cached_result = result_cache.get(cache_key)
+        # Faktaene avhenger bare av filene, så ny tone eller nytt krav gjenbruker dokumentanalysen
+        facts_key = make_cache_key(file_bytes, stage="fakta")
+        if cached_result is not None:
+            st.session_state.generated_complaint = cached_result
+            st.session_state.detected_company = cached_result.get("selskapsnavn_funnet", "")
+            st.session_state.complaint_facts = result_cache.get(facts_key, stage="fakta")
+            st.toast("⚡ Hentet fra cache")
+        else:
+            # Identisk forespørsel som allerede kjøres i en annen økt: vent på samme svar
+            inflight = get_inflight()
+            result_json = None
+            while True:
+                flight = inflight.join(cache_key)
+                if flight.leader:
+                    break
+                try:
+                    with st.spinner("⏳ Den samme forespørselen behandles allerede – venter på svaret ..."):
+                        result_json = flight.future.result(timeout=COALESCE_TIMEOUT)
+                    # Faktaene hører til disse dokumentene, ikke til en tidligere forespørsel i økten
+                    st.session_state.complaint_facts = result_cache.get(facts_key, stage="fakta")
+                    break
+                except FlightAbandoned:
+                    # Den andre økten ble avbrutt: prøv selv (eller vent på den som rakk først)
+                    continue
+            if flight.leader:
+                try:
+                    parsed = create_complaint(
+                        [(f.name, f.type, data) for f, data in zip(uploaded_files, file_bytes)],
+                        complaint_inputs,
+                        facts_key,
+                    )
+                    result_json = parsed.data
+                    # Reparerte/avkortede brev (f.eks. strømmen brøt) caches ikke, så et nytt forsøk kaller modellen igjen
+                    if isinstance(result_json, dict) and not parsed.repaired:
+                        result_cache.put(cache_key, result_json)
+                    inflight.finish(cache_key, result_json)
+                except BaseException as e:
+                    inflight.finish(cache_key, error=e)
+                    raise
             st.session_state.generated_complaint = result_json
             st.session_state.detected_company = result_json.get("selskapsnavn_funnet", "")
-            
+
+    except MemoryLimitExceeded as e:
+        inc("klage_request_errors_total", error=type(e).__name__)
+        st.error(f"📦 {e}")
+    except QueueTimeout as e:
+        inc("klage_request_errors_total", error=type(e).__name__)
+        st.error(f"⏳ {e}")
+    except WaitTimeout as e:
+        inc("klage_request_errors_total", error=type(e).__name__)
+        st.error("⏳ Den samme forespørselen tok for lang tid å behandle. Prøv igjen om litt.")
     except Exception as e:
+        inc("klage_request_errors_total", error=type(e).__name__)
         st.error(f"En feil oppstod: {e}")
 
 
+# Ny tone/krav/rolle på samme dokumenter: bare brevet skrives på nytt, uten bilder
+if st.session_state.generated_complaint and st.session_state.complaint_facts:
+    if st.button("🔁 Regenerer med annen tone", help="Bruker valgene over og dokumentanalysen som allerede er gjort"):
+        try:
+            result_json = write_complaint(st.session_state.complaint_facts, complaint_inputs).data
+            st.session_state.generated_complaint = result_json
+            st.session_state.detected_company = result_json.get("selskapsnavn_funnet", "")
+        except QueueTimeout as e:
+            inc("klage_request_errors_total", error=type(e).__name__)
+            st.error(f"⏳ {e}")
+        except Exception as e:
+            inc("klage_request_errors_total", error=type(e).__name__)
+            st.error(f"En feil oppstod: {e}")
+
+
 # ==========================================
-# 6. RESULTATVISNING
+# 6. RESULTATVISNING (fragment: interaksjon her kjører ikke hele skriptet på nytt)
 # ==========================================
 if st.session_state.generated_complaint:
-    data = st.session_state.generated_complaint
-    
-    if isinstance(data, dict):
-        detected_name = st.session_state.detected_company
-        
-        doc_name = data.get("navn_paa_kvittering")
-        if doc_name and mitt_navn:
-            if not check_name_similarity(doc_name, mitt_navn):
-                st.error(
-                    f"⚠️ **Navnevarsel:** Dokumentet ser ut til å tilhøre **{doc_name}**, "
-                    f"men du har registrert navnet ditt som **{mitt_navn}**. "
-                    "Sjekk at du bruker ditt eget dokument.", 
-                    icon="🚫"
-                )
-
-        contact_info = get_best_contact_method(detected_name)
-        
-        st.markdown("---")
-        st.subheader("📍 Mottaker & Sendingsmetode")
-        
-        final_email = ""
-        web_link = ""
-
-        if contact_info:
-            st.success(f"✅ Identifisert selskap: **{contact_info.get('navn', detected_name)}**")
-            
-            if "advarsel" in contact_info:
-                st.warning(f"⚠️ **OBS:** {contact_info['advarsel']}")
-                
-            if "web" in contact_info:
-                web_link = contact_info["web"]
-                st.info(f"🌐 Dette selskapet bruker primært webskjema/portal.")
-                st.link_button(f"Gå til {contact_info['navn']} sitt klageskjema ↗️", web_link)
-                
-                st.caption("👇 1. Kopier teksten under.")
-                st.caption("👉 2. Trykk på knappen over for å lime det inn i skjemaet deres.")
-                
-                if "email" in contact_info:
-                    final_email = contact_info["email"]
-                    st.markdown(f"*(Alternativ e-post funnet: `{final_email}` - men webskjema anbefales)*")
-            else:
-                final_email = contact_info.get("email", "")
-                
-        else:
-            st.warning(f"⚠️ Fant ikke '{detected_name}' i vår verifiserte database. Sjekk at e-posten under er riktig.")
-            final_email = data.get("mottaker_epost_gjetning", "")
-
-        if not web_link:
-            col_rec_ui, col_subj_ui = st.columns([1, 1])
-            with col_rec_ui:
-                user_email = st.text_input("Mottaker e-post (kan endres):", value=final_email)
-            with col_subj_ui:
-                user_subject = st.text_input("Emnefelt:", value=data.get("emne", ""))
-        else:
-            user_subject = st.text_input("Emnefelt (til skjemaet):", value=data.get("emne", ""))
-            user_email = final_email
-
-        st.markdown("### 📝 Klagebrev")
-        user_body = st.text_area("Innhold (Redigerbar):", value=data.get("brødtekst", ""), height=400)
-        
-        st.markdown("---")
-        
-        st.subheader("✅ Sjekkliste før sending")
-        
-        c1, c2 = st.columns(2)
-        check_rec = c1.checkbox("Mottaker/Skjema er korrekt")
-        check_txt = c2.checkbox("Mine detaljer stemmer")
-        
-        # Knappen er alltid synlig, men 'disabled' til sjekklisten er ok
-        is_ready = check_rec and check_txt
-        
-        st.markdown("---")
-        
-        if web_link:
-                st.info("👈 Kopier teksten til høyre, og bruk 'Gå til klageskjema'-knappen lenger opp.")
-        elif user_email and "@" in user_email:
-            
-            # VIS PÅMINNELSE OM VEDLEGG ALLTID
-            if st.session_state.uploaded_filenames:
-                files_str = ", ".join(st.session_state.uploaded_filenames)
-                st.info(f"📎 **Husk:** Legg ved disse filene manuelt i e-posten: **{files_str}**", icon="⚠️")
-            else:
-                st.info("📎 **Husk:** Du må legge ved eventuelle bilder/kvitteringer manuelt.", icon="⚠️")
-
-            safe_s = urllib.parse.quote(user_subject)
-            safe_b = urllib.parse.quote(user_body)
-            mailto = f"mailto:{user_email}?subject={safe_s}&body={safe_b}"
-            
-            st.link_button(
-                "📧 Åpne i E-postprogram", 
-                mailto, 
-                type="primary", 
-                use_container_width=True,
-                disabled=not is_ready 
-            )
-            
-            if not is_ready:
-                st.caption("🛑 Du må huke av sjekkpunktene over for å aktivere knappen.")
-        else:
-            st.warning("Mangler e-postadresse.")
-    else:
-        st.error("Kunne ikke lese svaret fra AI. Prøv å trykke på knappen en gang til.")
+    show_result_view(
+        st.session_state.generated_complaint,
+        st.session_state.detected_company,
+        mitt_navn,
+        st.session_state.uploaded_filenames,
+        get_best_contact_method,
+    )
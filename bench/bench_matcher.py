@@ -0,0 +1,64 @@
+"""Mikrobenchmark for kontaktmatcheren mot den gamle lineære skanningen.
+
+Kjør fra rotmappen:  python -m bench.bench_matcher
+"""
+import time
+
+from klagehjelpen.contacts import load_contacts
+from klagehjelpen.matcher import ContactMatcher
+
+# Navn slik AI-en gir dem; korrekthetstilfellene ligger i tests/test_matcher.py
+NAMES = [
+    "Elkjøp Norge AS", "ELKJOP ASA", "Elkjøpp", "Service AS", "Kidsbutikken AS", "Kid Interiør AS",
+    "Powerhouse Events", "POWER Norge AS", "H&M Hennes & Mauritz AS", "HM Norge", "Clasohlson",
+    "Komplet.no", "Zalndo SE", "Air France KLM", "Scandinavian Airlines (SAS)", "Widerøe's Flyveselskap",
+    "Rema 1000 Grünerløkka", "Ice Communication Norge AS", "Vyer", "Pineapple AS",
+    "Ukjent Selskap AS", "Firma42 Handel AS",
+]
+
+
+def linear_scan(contacts, name):
+    """Den gamle implementasjonen, til sammenligning."""
+    search_term = name.lower().strip()
+    for key, info in contacts.items():
+        if key in search_term:
+            return info
+    return None
+
+
+def synthetic_directory(size: int) -> dict:
+    contacts = load_contacts()
+    i = 0
+    while len(contacts) < size:
+        contacts[f"firma{i} handel"] = {"email": f"post@firma{i}.no", "navn": f"Firma{i} Handel"}
+        i += 1
+    return contacts
+
+
+def timeit(fn, names, repeat=5) -> float:
+    """Beste gjennomsnittstid per oppslag i mikrosekunder."""
+    for name in names:  # oppvarming
+        fn(name)
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for name in names:
+            fn(name)
+        best = min(best, time.perf_counter() - start)
+    return best / len(names) * 1e6
+
+
+def run_benchmark():
+    print(f"{'størrelse':>10} {'bygg (ms)':>10} {'lineær (µs)':>12} {'matcher (µs)':>13}")
+    for size in (100, 1_000, 10_000):
+        contacts = synthetic_directory(size)
+        start = time.perf_counter()
+        matcher = ContactMatcher(contacts)
+        build_ms = (time.perf_counter() - start) * 1e3
+        linear = timeit(lambda n: linear_scan(contacts, n), NAMES)
+        indexed = timeit(matcher.match, NAMES)
+        print(f"{size:>10} {build_ms:>10.1f} {linear:>12.1f} {indexed:>13.1f}")
+
+
+if __name__ == "__main__":
+    run_benchmark()
@@ -0,0 +1,112 @@
+"""Måler hva en interaksjon i resultatvisningen (seksjon 6) koster.
+
+Kjør fra rotmappen:  python -m bench.bench_rerun [-o resultat.json]
+
+- "full_app": hele app.py kjøres på nytt når en avkrysningsboks endres. Slik
+  var det før resultatvisningen ble et fragment, og det er fortsatt kostnaden
+  for interaksjoner utenfor fragmentet.
+- "fragment": bare resultatvisningen (result_view.render_result_view) kjøres,
+  slik Streamlit gjør når interaksjonen skjer inne i fragmentet.
+
+AppTest kjører alltid hele skriptet, så fragmentet måles som eget skript.
+I tillegg måles kald import av kjernen, og om PyMuPDF/genai blir lastet.
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+import time
+
+from streamlit.testing.v1 import AppTest
+
+from bench.suite import stats_ms
+
+APP_PATH = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "app.py")
+
+SAMPLE_RESULT = {
+    "selskapsnavn_funnet": "Elkjøp",
+    "navn_paa_kvittering": "Ola Nordmann",
+    "emne": "Reklamasjon på TV – døde piksler",
+    "mottaker_epost_gjetning": "kundeservice@elkjop.no",
+    "brødtekst": "Hei,\n\n" + "Jeg viser til kjøpet og ber om kostnadsfri retting etter forbrukerkjøpsloven § 29. " * 40
+                 + "\n\nMed vennlig hilsen, Ola Nordmann",
+}
+
+
+def _fragment_script():
+    import streamlit as st
+
+    from klagehjelpen.contacts import ContactDirectory
+    from result_view import render_result_view
+
+    @st.cache_resource
+    def directory():
+        return ContactDirectory()
+
+    render_result_view(
+        st.session_state.generated_complaint,
+        st.session_state.detected_company,
+        "Ola Nordmann",
+        st.session_state.uploaded_filenames,
+        directory().match,
+    )
+
+
+def _seed(at):
+    at.session_state.generated_complaint = SAMPLE_RESULT
+    at.session_state.detected_company = SAMPLE_RESULT["selskapsnavn_funnet"]
+    at.session_state.uploaded_filenames = ["kvittering.pdf", "skade.jpg"]
+    return at
+
+
+def time_interactions(at, rounds=20) -> dict:
+    """Tid per omkjøring når første avkrysningsboks slås av og på."""
+    _seed(at).run(timeout=60)
+    if at.exception:
+        raise RuntimeError(at.exception[0].message)
+    samples = []
+    for i in range(rounds):
+        box = at.checkbox[0]
+        box.uncheck() if i % 2 else box.check()
+        start = time.perf_counter()
+        at.run(timeout=60)
+        samples.append(time.perf_counter() - start)
+    return stats_ms(samples)
+
+
+def cold_import() -> dict:
+    code = (
+        "import sys, time; t = time.perf_counter(); import klagehjelpen.core; "
+        "print(round((time.perf_counter() - t) * 1e3, 1), 'fitz' in sys.modules, "
+        "'google.generativeai' in sys.modules)"
+    )
+    out = subprocess.run([sys.executable, "-c", code], capture_output=True, text=True, check=True).stdout.split()
+    return {"import_ms": float(out[0]), "fitz_loaded": out[1] == "True", "genai_loaded": out[2] == "True"}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Rerun-kostnad for resultatvisningen.")
+    parser.add_argument("-o", "--output", help="Skriv JSON-resultatet hit (standard: stdout)")
+    parser.add_argument("--rounds", type=int, default=20)
+    args = parser.parse_args(argv)
+
+    full = time_interactions(AppTest.from_file(APP_PATH, default_timeout=60), args.rounds)
+    fragment = time_interactions(AppTest.from_function(_fragment_script, default_timeout=60), args.rounds)
+    report = {
+        "full_app": full,
+        "fragment": fragment,
+        "speedup_p50": round(full["p50_ms"] / fragment["p50_ms"], 2) if fragment["p50_ms"] else None,
+        "core_import": cold_import(),
+    }
+    text = json.dumps(report, ensure_ascii=False, indent=2)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            f.write(text + "\n")
+    else:
+        print(text)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
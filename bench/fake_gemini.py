@@ -0,0 +1,183 @@
+"""Lokal HTTP-stand-in for Gemini REST-API-et, for ende-til-ende-målinger.
+
+    python -m bench.fake_gemini --port 8765 --delay 0.8 --jitter 0.3 --failure-rate 0.05
+
+Svarer på POST /v1beta/models/{modell}:generateContent (og :streamGenerateContent
+med ?alt=sse) med et gyldig klage-JSON. Klienten peker hit med
+
+    genai.configure(api_key="fake", transport="rest",
+                    client_options={"api_endpoint": "http://127.0.0.1:8765"})
+
+Forsinkelse og feilrate kan settes per modell, slik at fallback og hedging
+kan måles: --model-delay gemini-2.0-flash=2.5
+"""
+import argparse
+import json
+import random
+import re
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+_PATH_RE = re.compile(r"^/v1beta/models/(?P<model>[^:/]+):(?P<method>generateContent|streamGenerateContent)")
+
+
+class FakeGeminiConfig:
+    def __init__(self, delay=0.5, jitter=0.2, failure_rate=0.0, failure_status=429,
+                 model_delays=None, seed=None):
+        self.delay = delay
+        self.jitter = jitter
+        self.failure_rate = failure_rate
+        self.failure_status = failure_status
+        self.model_delays = dict(model_delays or {})
+        self._rng = random.Random(seed)
+        self._lock = threading.Lock()
+        self.requests = 0
+        self.failures = 0
+
+    def draw(self, model):
+        """Trekker (forsinkelse, skal_feile) for ett kall."""
+        base = self.model_delays.get(model, self.delay)
+        with self._lock:
+            self.requests += 1
+            delay = max(0.0, base * (1 + self._rng.uniform(-self.jitter, self.jitter)))
+            fail = self._rng.random() < self.failure_rate
+            if fail:
+                self.failures += 1
+        return delay, fail
+
+
+def fake_complaint(prompt: str) -> dict:
+    company = re.search(r"- SELSKAP: (.+)", prompt)
+    name = re.search(r"- NAVN PÅ KVITTERING: (.+)", prompt)
+    complainant = re.search(r"- KLAGER: (.*) \(", prompt)
+    return {
+        "selskapsnavn_funnet": company.group(1).strip() if company else "Elkjøp",
+        "navn_paa_kvittering": name.group(1).strip() if name else None,
+        "emne": "Reklamasjon på vare",
+        "mottaker_epost_gjetning": "",
+        "brødtekst": "Hei,\n\nJeg viser til kjøpet og reklamerer på varen etter forbrukerkjøpsloven § 27.\n\n"
+                     f"Med vennlig hilsen, {complainant.group(1) if complainant else ''}",
+    }
+
+
+def _prompt_text(body: dict) -> str:
+    parts = []
+    for content in body.get("contents", []):
+        for part in content.get("parts", []):
+            if "text" in part:
+                parts.append(part["text"])
+    return "\n".join(parts)
+
+
+def _response(text: str, prompt_chars: int, finished=True) -> dict:
+    candidate = {"content": {"parts": [{"text": text}], "role": "model"}, "index": 0}
+    if finished:
+        candidate["finishReason"] = "STOP"
+    prompt_tokens = max(1, prompt_chars // 4)
+    output_tokens = max(1, len(text) // 4)
+    return {
+        "candidates": [candidate],
+        "usageMetadata": {"promptTokenCount": prompt_tokens, "candidatesTokenCount": output_tokens,
+                          "totalTokenCount": prompt_tokens + output_tokens},
+    }
+
+
+class _Handler(BaseHTTPRequestHandler):
+    config: FakeGeminiConfig = None
+    protocol_version = "HTTP/1.1"
+
+    def do_POST(self):
+        match = _PATH_RE.match(self.path)
+        length = int(self.headers.get("Content-Length") or 0)
+        raw = self.rfile.read(length) if length else b""
+        if not match:
+            self._json(404, {"error": {"code": 404, "message": "Not found", "status": "NOT_FOUND"}})
+            return
+        model = match.group("model")
+        delay, fail = self.config.draw(model)
+        time.sleep(delay)
+        if fail:
+            status = self.config.failure_status
+            self._json(status, {"error": {"code": status, "message": "Simulert feil fra stand-in",
+                                          "status": "RESOURCE_EXHAUSTED" if status == 429 else "UNAVAILABLE"}})
+            return
+
+        prompt = _prompt_text(json.loads(raw or b"{}"))
+        text = json.dumps(fake_complaint(prompt), ensure_ascii=False)
+        if match.group("method") == "generateContent":
+            self._json(200, _response(text, len(prompt)))
+        else:
+            self._sse(text, len(prompt))
+
+    def _json(self, status, payload):
+        body = json.dumps(payload, ensure_ascii=False).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json; charset=UTF-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _sse(self, text, prompt_chars, chunk_size=40):
+        chunks = [text[i:i + chunk_size] for i in range(0, len(text), chunk_size)] or [""]
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Connection", "close")
+        self.end_headers()
+        for i, chunk in enumerate(chunks):
+            payload = _response(chunk, prompt_chars, finished=i == len(chunks) - 1)
+            self.wfile.write(f"data: {json.dumps(payload, ensure_ascii=False)}\r\n\r\n".encode("utf-8"))
+            self.wfile.flush()
+        self.close_connection = True
+
+    def log_message(self, format, *args):
+        pass
+
+
+def start_fake_gemini(config: FakeGeminiConfig, port: int = 0, host: str = "127.0.0.1"):
+    """Starter stand-in-serveren i en bakgrunnstråd. Port 0 velger en ledig port."""
+    handler = type("FakeGeminiHandler", (_Handler,), {"config": config})
+    server = ThreadingHTTPServer((host, port), handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name="fake-gemini", daemon=True).start()
+    return server
+
+
+def endpoint(server) -> str:
+    host, port = server.server_address[:2]
+    return f"http://{host}:{port}"
+
+
+def _parse_model_delays(values):
+    delays = {}
+    for value in values or []:
+        model, _, seconds = value.partition("=")
+        delays[model] = float(seconds)
+    return delays
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Lokal stand-in for Gemini REST-API-et.")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--delay", type=float, default=0.5, help="Gjennomsnittlig svartid (sek)")
+    parser.add_argument("--jitter", type=float, default=0.2, help="Relativ variasjon i svartid (0.2 = ±20 %%)")
+    parser.add_argument("--failure-rate", type=float, default=0.0, help="Andel kall som feiler (0–1)")
+    parser.add_argument("--failure-status", type=int, default=429, help="HTTP-status ved simulert feil")
+    parser.add_argument("--model-delay", action="append", help="Egen svartid per modell: modell=sek")
+    parser.add_argument("--seed", type=int)
+    args = parser.parse_args(argv)
+
+    config = FakeGeminiConfig(args.delay, args.jitter, args.failure_rate, args.failure_status,
+                              _parse_model_delays(args.model_delay), args.seed)
+    server = start_fake_gemini(config, args.port, args.host)
+    print(f"Stand-in for Gemini på {endpoint(server)} (Ctrl+C for å stoppe)")
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,381 @@
+"""Reproduserbar benchmarksuite for de varme stiene i en klageforespørsel.
+
+Kjør fra rotmappen:
+
+    python -m bench.suite -o bench-resultater.json
+    python -m bench.suite --quick --only pdf,contacts
+    python -m bench.suite --only e2e --delay 0.8 --failure-rate 0.05 --concurrency 1,10,50,100
+    python -m bench.suite --only e2e --rpm 600 --concurrency 10,50
+
+Korpuset (bench.corpus) lages fra et fast frø, og ende-til-ende-målingen går mot
+en lokal stand-in for Gemini (bench.fake_gemini), så tallene kan sammenlignes
+mellom commits. Resultatet er ett JSON-dokument med commit, miljø og målinger.
+"""
+import argparse
+import json
+import os
+import platform
+import subprocess
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+
+from bench import corpus
+from bench.bench_matcher import NAMES, synthetic_directory
+from klagehjelpen.core import (
+    ComplaintInputs, build_letter_prompt, check_name_similarity, finalize_facts, prepare_facts_request,
+)
+from klagehjelpen.images import optimize_images
+from klagehjelpen.ingest import MemoryBudget, extract_pdf, ingest_documents, load_image
+from klagehjelpen.json_stream import IncrementalJSONParser
+from klagehjelpen.llm import clean_json_text
+from klagehjelpen.matcher import ContactMatcher
+from klagehjelpen.metrics import REGISTRY, STAGE_SECONDS
+from klagehjelpen.response import parse_complaint, parse_facts
+
+SECTIONS = ("pdf", "images", "contacts", "names", "json", "e2e")
+
+
+# ==========================================
+# MÅLEVERKTØY
+# ==========================================
+
+def stats_ms(samples) -> dict:
+    """Sammendrag av en liste med målinger i sekunder, oppgitt i millisekunder."""
+    ordered = sorted(samples)
+    if not ordered:
+        return {"n": 0}
+
+    def pct(p):
+        return round(ordered[min(len(ordered) - 1, int(p * len(ordered)))] * 1e3, 3)
+
+    return {
+        "n": len(ordered),
+        "min_ms": round(ordered[0] * 1e3, 3),
+        "mean_ms": round(sum(ordered) / len(ordered) * 1e3, 3),
+        "p50_ms": pct(0.50),
+        "p95_ms": pct(0.95),
+        "max_ms": round(ordered[-1] * 1e3, 3),
+    }
+
+
+def measure(fn, repeat=5, warmup=1) -> dict:
+    for _ in range(warmup):
+        fn()
+    samples = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        samples.append(time.perf_counter() - start)
+    return stats_ms(samples)
+
+
+def per_call_us(fn, items, repeat=5) -> float:
+    """Beste gjennomsnittstid per kall i mikrosekunder over hele `items`."""
+    for item in items:
+        fn(item)
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for item in items:
+            fn(item)
+        best = min(best, time.perf_counter() - start)
+    return round(best / len(items) * 1e6, 3)
+
+
+# ==========================================
+# SEKSJONER
+# ==========================================
+
+def bench_pdf(quick=False) -> list:
+    results = []
+    for kind, make in (("text", corpus.text_pdf), ("scanned", corpus.scanned_pdf)):
+        for pages in (1, 10) if quick else (1, 10, 100):
+            data = make(pages)
+            holder = {}
+
+            def run():
+                holder["budget"] = MemoryBudget(limit=0)
+                holder["text"], holder["image"], _, holder["pages_read"] = extract_pdf(data, budget=holder["budget"])
+
+            timing = measure(run, repeat=3 if pages >= 100 else 5)
+            # Tekstbudsjettet og KLAGE_PDF_MAX_PAGES stopper lesingen tidlig; oppgi hva som faktisk ble lest
+            results.append({
+                "case": f"{kind}: {holder['pages_read']} av {pages} sider lest",
+                "kind": kind, "pages": pages, "pages_read": holder["pages_read"], "pdf_bytes": len(data),
+                "text_chars": len(holder["text"]),
+                "image_size": list(holder["image"].size) if holder["image"] else None,
+                "peak_bytes": holder["budget"].peak,
+                **timing,
+            })
+    return results
+
+
+def bench_images(quick=False) -> dict:
+    count = 2 if quick else 4
+    photos = [corpus.phone_photo(seed=i + 1, orientation=6 if i % 2 else 1) for i in range(count)]
+    files = [(f"foto{i}.jpg", "image/jpeg", data) for i, data in enumerate(photos)]
+
+    def optimize():
+        optimize_images([load_image(data) for data in photos])
+
+    _, report = optimize_images([load_image(data) for data in photos])
+    return {
+        "photos": count,
+        "photo_bytes": sum(len(p) for p in photos),
+        "decode_one": measure(lambda: load_image(photos[0])),
+        "ingest_parallel": measure(lambda: ingest_documents(files), repeat=3),
+        "decode_and_optimize": measure(optimize, repeat=3),
+        "bytes_before": report.bytes_before,
+        "bytes_after": report.bytes_after,
+    }
+
+
+def bench_contacts(quick=False) -> list:
+    results = []
+    for size in (100, 1_000) if quick else (100, 1_000, 10_000):
+        contacts = synthetic_directory(size)
+        start = time.perf_counter()
+        matcher = ContactMatcher(contacts)
+        build = time.perf_counter() - start
+        results.append({
+            "entries": len(contacts),
+            "build_ms": round(build * 1e3, 3),
+            "match_us": per_call_us(matcher.match, NAMES),
+        })
+    return results
+
+
+NAME_PAIRS = [
+    ("Ola Nordmann", "Ola Nordmann"),
+    ("NORDMANN, OLA", "Ola Nordmann"),
+    ("Kari Nordkvinne", "Ola Nordmann"),
+    ("null", "Ola Nordmann"),
+    (None, "Ola Nordmann"),
+    ("Hans-Petter Ødegård Johansen", "Hans Petter Odegard"),
+]
+
+
+def bench_names(quick=False) -> dict:
+    return {"pairs": len(NAME_PAIRS), "check_us": per_call_us(lambda pair: check_name_similarity(*pair), NAME_PAIRS)}
+
+
+def _sample_responses() -> dict:
+    body = {
+        "selskapsnavn_funnet": "Elkjøp", "navn_paa_kvittering": "Ola Nordmann",
+        "emne": "Reklamasjon på TV", "mottaker_epost_gjetning": "kundeservice@elkjop.no",
+        "brødtekst": "Hei,\n\n" + "Jeg viser til kjøpet og ber om retting etter § 29. " * 40,
+    }
+    plain = json.dumps(body, ensure_ascii=False)
+    return {
+        "plain": plain,
+        "fenced": "```json\n" + json.dumps(body, ensure_ascii=False, indent=4) + "\n```",
+        "ascii_escaped": json.dumps(body),
+        "truncated": plain[:-200],
+    }
+
+
+def bench_json(quick=False) -> dict:
+    results = {}
+    for label, text in _sample_responses().items():
+        chunks = [text[i:i + 40] for i in range(0, len(text), 40)]
+
+        def incremental():
+            parser = IncrementalJSONParser()
+            for chunk in chunks:
+                parser.feed(chunk)
+
+        def clean_and_parse(t):
+            try:
+                json.loads(clean_json_text(t))
+            except ValueError:
+                pass
+
+        results[label] = {
+            "chars": len(text),
+            "clean_and_parse_us": per_call_us(clean_and_parse, [text]),
+            "parse_complaint_us": per_call_us(parse_complaint, [text]),
+            "incremental_us": per_call_us(lambda _: incremental(), [None]),
+        }
+    return results
+
+
+def bench_e2e(levels, requests_per_level=None, delay=0.5, jitter=0.2, failure_rate=0.0,
+              failure_status=429, timeout=30.0, rpm=0.0) -> dict:
+    import google.generativeai as genai
+
+    from bench.fake_gemini import FakeGeminiConfig, endpoint, start_fake_gemini
+    from klagehjelpen.admission import BURST, AdmissionController, LocalBucket
+    from klagehjelpen.contacts import load_contacts
+    from klagehjelpen.llm import FACTS_CONFIG, LETTER_CONFIG, run_generation
+
+    config = FakeGeminiConfig(delay, jitter, failure_rate, failure_status, seed=1)
+    server = start_fake_gemini(config)
+    genai.configure(api_key="fake", transport="rest", client_options={"api_endpoint": endpoint(server)})
+
+    matcher = ContactMatcher(load_contacts())
+    files = [
+        ("kvittering.pdf", "application/pdf", corpus.text_pdf(1)),
+        ("skade.jpg", "image/jpeg", corpus.phone_photo(seed=7)),
+    ]
+    inputs = ComplaintInputs(feil_beskrivelse="Skjermen har døde piksler", mitt_navn="Ola Nordmann",
+                             min_epost="ola@example.no")
+
+    def admitted(controller, prompt, images=None, **kwargs):
+        # Samme vei som appen: vent på tur i køen, og meld kvotefeil tilbake til bucketen
+        admission = controller.admit(timeout=timeout * 4)
+        try:
+            return run_generation(prompt, images, models=admission.models, allow=admission.allow,
+                                  timeout=timeout, **kwargs), admission.waited
+        except Exception as e:
+            controller.report_failure(e)
+            raise
+
+    def session(controller):
+        # Steg 1 (fakta fra dokumentene) og steg 2 (brevet), som extract_facts/write_complaint i appen
+        start = time.perf_counter()
+        waited = 0.0
+        try:
+            request = prepare_facts_request(files, matcher)
+            try:
+                generation, wait = admitted(controller, request.prompt, request.images,
+                                            parse=parse_facts, generation_config=FACTS_CONFIG)
+            finally:
+                request.release()
+            waited += wait
+            facts = finalize_facts(generation.data, request, matcher)
+            generation, wait = admitted(
+                controller, build_letter_prompt(inputs, facts), generation_config=LETTER_CONFIG,
+                parse=lambda text, model=None: parse_complaint(text, model, defaults=facts),
+            )
+            waited += wait
+            return time.perf_counter() - start, waited, True, generation.model
+        except Exception:
+            return time.perf_counter() - start, waited, False, None
+
+    results = []
+    try:
+        for concurrency in levels:
+            total = requests_per_level or max(20, concurrency * 2)
+            REGISTRY.reset()
+            calls_before = config.requests
+            start = time.perf_counter()
+            # Ny kontroller per nivå, så køen og bucketene starter fulle; rpm=0 er ubegrenset
+            controller = AdmissionController(primary_bucket=LocalBucket(rpm / 60.0, BURST),
+                                             fallback_bucket=LocalBucket(rpm / 60.0, BURST))
+            with ThreadPoolExecutor(max_workers=concurrency) as pool:
+                outcomes = list(pool.map(session, [controller] * total))
+            elapsed = time.perf_counter() - start
+
+            latencies = [seconds for seconds, _, _, _ in outcomes]
+            ok = sum(1 for _, _, success, _ in outcomes if success)
+            models = {}
+            for _, _, _, model in outcomes:
+                if model:
+                    models[model] = models.get(model, 0) + 1
+            stages = {
+                name[len(STAGE_SECONDS):]: summary
+                for name, summary in REGISTRY.snapshot()["summaries"].items()
+                if name.startswith(STAGE_SECONDS + "{")
+            }
+            results.append({
+                "concurrency": concurrency, "requests": total, "ok": ok, "failed": total - ok,
+                "model_calls": config.requests - calls_before,
+                "throughput_rps": round(total / elapsed, 3) if elapsed else 0.0,
+                "models": models, "latency": stats_ms(latencies),
+                "queue_wait": stats_ms([waited for _, waited, _, _ in outcomes]), "stages": stages,
+            })
+    finally:
+        server.shutdown()
+    return {
+        "server": {"delay_s": delay, "jitter": jitter, "failure_rate": failure_rate,
+                   "failure_status": failure_status, "rpm": rpm},
+        "levels": results,
+    }
+
+
+# ==========================================
+# KJØRING
+# ==========================================
+
+def _git(*args):
+    try:
+        return subprocess.run(["git", *args], capture_output=True, text=True, timeout=10).stdout.strip()
+    except (OSError, subprocess.SubprocessError):
+        return ""
+
+
+def run_suite(sections, quick=False, e2e_options=None) -> dict:
+    results = {}
+    runners = {
+        "pdf": bench_pdf, "images": bench_images, "contacts": bench_contacts,
+        "names": bench_names, "json": bench_json,
+    }
+    for section in sections:
+        print(f"Kjører {section} ...", file=sys.stderr)
+        start = time.perf_counter()
+        if section == "e2e":
+            results[section] = bench_e2e(**(e2e_options or {}))
+        else:
+            results[section] = runners[section](quick)
+        print(f"  ferdig på {time.perf_counter() - start:.1f} s", file=sys.stderr)
+
+    return {
+        "meta": {
+            "commit": _git("rev-parse", "HEAD"),
+            "dirty": bool(_git("status", "--porcelain", "--untracked-files=no")),
+            "timestamp": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpus": os.cpu_count(),
+            "quick": quick,
+            "sections": list(sections),
+        },
+        "results": results,
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmarksuite for klagehjelpen.")
+    parser.add_argument("-o", "--output", help="Skriv JSON-resultatet hit (standard: stdout)")
+    parser.add_argument("--only", help=f"Kommaseparerte seksjoner ({','.join(SECTIONS)})")
+    parser.add_argument("--quick", action="store_true", help="Mindre korpus og færre nivåer")
+    parser.add_argument("--concurrency", help="Samtidige økter for e2e (standard 1,10,50,100)")
+    parser.add_argument("--requests", type=int, help="Forespørsler per samtidighetsnivå (standard maks(20, 2×nivå))")
+    parser.add_argument("--delay", type=float, default=0.5, help="Svartid for stand-in-modellen (sek)")
+    parser.add_argument("--jitter", type=float, default=0.2, help="Relativ variasjon i svartid")
+    parser.add_argument("--failure-rate", type=float, default=0.0, help="Andel modellkall som feiler (0–1)")
+    parser.add_argument("--failure-status", type=int, default=429, help="HTTP-status ved simulert feil")
+    parser.add_argument("--timeout", type=float, default=30.0, help="Tidsgrense per modellforsøk (sek)")
+    parser.add_argument("--rpm", type=float, default=0.0,
+                        help="Kvote per modell i køen for e2e, kall per minutt (standard 0 = ubegrenset)")
+    args = parser.parse_args(argv)
+
+    sections = [s.strip() for s in args.only.split(",")] if args.only else list(SECTIONS)
+    unknown = [s for s in sections if s not in SECTIONS]
+    if unknown:
+        parser.error(f"ukjente seksjoner: {', '.join(unknown)}")
+
+    if args.concurrency:
+        levels = [int(c) for c in args.concurrency.split(",")]
+    else:
+        levels = [1, 10] if args.quick else [1, 10, 50, 100]
+    e2e_options = {
+        "levels": levels, "requests_per_level": args.requests, "delay": args.delay, "jitter": args.jitter,
+        "failure_rate": args.failure_rate, "failure_status": args.failure_status, "timeout": args.timeout,
+        "rpm": args.rpm,
+    }
+
+    report = run_suite(sections, args.quick, e2e_options)
+    text = json.dumps(report, ensure_ascii=False, indent=2)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            f.write(text + "\n")
+    else:
+        print(text)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
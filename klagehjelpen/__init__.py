@@ -0,0 +1 @@
+"""Kjernelogikk for KlageHjelpen, uavhengig av Streamlit-grensesnittet."""
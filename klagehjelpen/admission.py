@@ -0,0 +1,333 @@
+"""Adgangskontroll foran Gemini: felles kvote, rettferdig kø og sammenslåing.
+
+Alle økter i prosessen (og med KLAGE_ADMISSION_FILE også andre prosesser på
+samme maskin) deler én token-bucket per modell. Forespørsler venter i en
+FIFO-kø og får vite plass og omtrentlig ventetid underveis:
+
+    admission = get_admission_controller().admit(
+        on_wait=lambda position, eta: status.info(f"Nummer {position} i køen (ca. {eta:.0f} s)"))
+    try:
+        generation = run_generation(prompt, images, models=admission.models, allow=admission.allow)
+    except Exception as e:
+        controller.report_failure(e)
+        raise
+
+Er køen lang (KLAGE_QUEUE_FALLBACK_DEPTH) og fallback-modellen har ledig
+kvote, sendes forespørselen dit i stedet for å vente. En 429 fra en modell
+setter hele bucketen på pause for alle, så øktene ikke prøver på nytt samtidig.
+
+`SingleFlight` slår sammen identiske forespørsler som allerede er i gang
+(samme cache-nøkkel): bare den første kaller modellen, de andre får svaret.
+"""
+import json
+import os
+import re
+import threading
+import time
+from collections import deque
+from concurrent.futures import Future
+from contextlib import contextmanager
+from dataclasses import dataclass, field
+
+from klagehjelpen.llm import FALLBACK_MODEL, PRIMARY_MODEL
+from klagehjelpen.metrics import inc, observe
+
+PRIMARY_RPM = float(os.getenv("KLAGE_MODEL_RPM", "15"))
+FALLBACK_RPM = float(os.getenv("KLAGE_FALLBACK_RPM", "15"))
+BURST = int(os.getenv("KLAGE_MODEL_BURST", "3"))
+FALLBACK_DEPTH = int(os.getenv("KLAGE_QUEUE_FALLBACK_DEPTH", "3"))
+QUEUE_TIMEOUT = float(os.getenv("KLAGE_QUEUE_TIMEOUT", "120"))
+RATE_LIMIT_PAUSE = float(os.getenv("KLAGE_RATE_LIMIT_PAUSE", "10"))
+ADMISSION_FILE = os.getenv("KLAGE_ADMISSION_FILE") or None
+
+_RATE_LIMIT_RE = re.compile(r"\b429\b|quota|ResourceExhausted|TooManyRequests", re.I)
+
+
+class QueueTimeout(RuntimeError):
+    pass
+
+
+class FlightAbandoned(RuntimeError):
+    """Den som kjørte forespørselen ble avbrutt (f.eks. Streamlit-rerun); prøv selv."""
+
+
+def is_rate_limit_error(error) -> bool:
+    name = type(error).__name__
+    return name in ("ResourceExhausted", "TooManyRequests") or bool(_RATE_LIMIT_RE.search(str(error)))
+
+
+# ==========================================
+# TOKEN-BUCKETS
+# ==========================================
+
+def _refill(state, now, rate, capacity):
+    if now < state["paused_until"]:
+        return
+    since = max(state["updated"], state["paused_until"])
+    state["tokens"] = min(capacity, state["tokens"] + max(0.0, now - since) * rate)
+    state["updated"] = now
+
+
+def _take(state, now, rate, capacity) -> float:
+    """Tar ett token hvis mulig. Returnerer 0, ellers sekunder til neste token."""
+    _refill(state, now, rate, capacity)
+    if now < state["paused_until"]:
+        return state["paused_until"] - now + (max(0.0, 1 - state["tokens"]) / rate if rate else 0.0)
+    if state["tokens"] >= 1:
+        state["tokens"] -= 1
+        return 0.0
+    return (1 - state["tokens"]) / rate
+
+
+def _pause(state, now, seconds):
+    state["paused_until"] = max(state["paused_until"], now + seconds)
+    state["tokens"] = 0.0
+    state["updated"] = now
+
+
+class LocalBucket:
+    """Token-bucket for én prosess. `rate` er tokens per sekund (0 = ubegrenset)."""
+
+    def __init__(self, rate: float, capacity: int = 1):
+        self.rate = rate
+        self.capacity = max(1, capacity)
+        self._state = {"tokens": float(self.capacity), "updated": time.time(), "paused_until": 0.0}
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def _locked(self):
+        with self._lock:
+            yield self._state
+
+    def take(self) -> float:
+        if self.rate <= 0:
+            return 0.0
+        with self._locked() as state:
+            return _take(state, time.time(), self.rate, self.capacity)
+
+    def pause(self, seconds: float):
+        with self._locked() as state:
+            _pause(state, time.time(), seconds)
+
+
+class FileBucket(LocalBucket):
+    """Token-bucket delt mellom prosesser via en JSON-fil med fcntl-lås (POSIX)."""
+
+    def __init__(self, path: str, name: str, rate: float, capacity: int = 1):
+        super().__init__(rate, capacity)
+        self.path = path
+        self.name = name
+
+    @contextmanager
+    def _locked(self):
+        import fcntl  # kun POSIX; prosesslokal LocalBucket brukes ellers
+
+        with self._lock, open(self.path, "a+", encoding="utf-8") as f:
+            fcntl.flock(f, fcntl.LOCK_EX)
+            try:
+                f.seek(0)
+                try:
+                    buckets = json.loads(f.read() or "{}")
+                except ValueError:
+                    buckets = {}
+                state = buckets.get(self.name) or dict(self._state)
+                yield state
+                buckets[self.name] = state
+                f.seek(0)
+                f.truncate()
+                f.write(json.dumps(buckets))
+                f.flush()
+            finally:
+                fcntl.flock(f, fcntl.LOCK_UN)
+
+
+def make_bucket(name: str, rpm: float, capacity: int = BURST, path: str = ADMISSION_FILE):
+    rate = rpm / 60.0
+    return FileBucket(path, name, rate, capacity) if path else LocalBucket(rate, capacity)
+
+
+# ==========================================
+# KØ
+# ==========================================
+
+@dataclass
+class Admission:
+    models: list
+    waited: float = 0.0
+    position: int = 1  # plass i køen ved ankomst
+    buckets: dict = field(default_factory=dict, repr=False)
+
+    @property
+    def model(self) -> str:
+        return self.models[0]
+
+    def allow(self, model) -> bool:
+        """Før et fallback-kall: tar et token fra modellens bucket (uten å vente).
+
+        Tokenet for `self.model` er allerede tatt ved opptak. Gis som `allow`
+        til run_generation/generate_complaint_stream, slik at fallback-kvoten
+        også gjelder når primærmodellen feiler.
+        """
+        if model == self.model:
+            return True
+        bucket = self.buckets.get(model)
+        if bucket is None or bucket.take() == 0:
+            return True
+        inc("klage_fallback_denied_total", model=model)
+        return False
+
+
+class AdmissionController:
+    """FIFO-kø foran modellkallene. Bare den som står først, kan ta et token."""
+
+    def __init__(self, primary=PRIMARY_MODEL, fallback=FALLBACK_MODEL, primary_bucket=None,
+                 fallback_bucket=None, fallback_depth=FALLBACK_DEPTH, timeout=QUEUE_TIMEOUT):
+        self.primary = primary
+        self.fallback = fallback
+        self.buckets = {primary: primary_bucket or make_bucket(primary, PRIMARY_RPM)}
+        if fallback:
+            self.buckets[fallback] = fallback_bucket or make_bucket(fallback, FALLBACK_RPM)
+        self.fallback_depth = fallback_depth
+        self.timeout = timeout
+        self._queue = deque()
+        self._cond = threading.Condition()
+
+    @property
+    def depth(self) -> int:
+        with self._cond:
+            return len(self._queue)
+
+    def _rate(self, model):
+        bucket = self.buckets.get(model)
+        return bucket.rate if bucket and bucket.rate > 0 else float("inf")
+
+    def _estimate(self, position, wait, depth):
+        rate = self._rate(self.primary)
+        if self.fallback and depth >= self.fallback_depth:
+            rate += self._rate(self.fallback)
+        return (wait or 0.0) + (position - 1) / rate
+
+    def _try_admit(self):
+        """Kalles av den som står først. Returnerer (modeller eller None, ventetid)."""
+        wait = self.buckets[self.primary].take()
+        if wait == 0:
+            return [self.primary] + ([self.fallback] if self.fallback else []), 0.0
+        if self.fallback and len(self._queue) >= self.fallback_depth:
+            if self.buckets[self.fallback].take() == 0:
+                inc("klage_queue_fallback_routed_total")
+                return [self.fallback], 0.0
+        return None, wait
+
+    def admit(self, on_wait=None, timeout=None) -> Admission:
+        """Blokkerer til forespørselen får et token. `on_wait(plass, sekunder)` kalles mens den venter."""
+        timeout = self.timeout if timeout is None else timeout
+        ticket = object()
+        start = time.monotonic()
+        with self._cond:
+            self._queue.append(ticket)
+            arrival = len(self._queue)
+        observe("klage_queue_depth", arrival)
+        try:
+            while True:
+                with self._cond:
+                    position = self._queue.index(ticket) + 1
+                    models, wait = (None, None)
+                    if position == 1:
+                        models, wait = self._try_admit()
+                        if models:
+                            self._queue.popleft()
+                            self._cond.notify_all()
+                    depth = len(self._queue)
+                if models:
+                    waited = time.monotonic() - start
+                    observe("klage_queue_wait_seconds", waited)
+                    inc("klage_admissions_total", model=models[0])
+                    return Admission(models, waited, arrival, self.buckets)
+
+                if time.monotonic() - start > timeout:
+                    inc("klage_queue_timeouts_total")
+                    raise QueueTimeout(
+                        "Det er stor pågang akkurat nå. Prøv igjen om et par minutter."
+                    )
+                if on_wait:
+                    on_wait(position, self._estimate(position, wait, depth))
+                with self._cond:
+                    self._cond.wait(timeout=min(wait or 0.5, 0.5))
+        except BaseException:
+            with self._cond:
+                if ticket in self._queue:
+                    self._queue.remove(ticket)
+                    self._cond.notify_all()
+            raise
+
+    def report_failure(self, error):
+        """Ved kvotefeil settes modellens bucket på pause for alle økter."""
+        attempts = getattr(error, "attempts", None) or []
+        models = {a.model for a in attempts if _RATE_LIMIT_RE.search(a.error or "")}
+        if not attempts and is_rate_limit_error(error):
+            models.add(self.primary)
+        for model in models:
+            bucket = self.buckets.get(model)
+            if bucket:
+                bucket.pause(RATE_LIMIT_PAUSE)
+                inc("klage_rate_limit_pauses_total", model=model)
+
+
+# ==========================================
+# SAMMENSLÅING AV IDENTISKE FORESPØRSLER
+# ==========================================
+
+@dataclass
+class Flight:
+    future: Future = field(default_factory=Future)
+    leader: bool = True
+
+
+class SingleFlight:
+    """Identiske forespørsler (samme nøkkel) som pågår samtidig, kjøres bare én gang.
+
+        while True:
+            flight = inflight.join(key)
+            if flight.leader:
+                break
+            try:
+                return flight.future.result(timeout)
+            except FlightAbandoned:
+                continue  # lederen ble avbrutt: neste som kommer inn, blir ny leder
+        try:
+            result = ...
+            inflight.finish(key, result)
+        except BaseException as e:
+            inflight.finish(key, error=e)
+            raise
+
+    Bare vanlige feil (Exception) deles med de som venter. Avbrudd som
+    Streamlits RerunException/StopException (BaseException) tilhører lederens
+    økt og kan bære dens skjemaverdier; da får de som venter FlightAbandoned.
+    """
+
+    def __init__(self):
+        self._flights = {}
+        self._lock = threading.Lock()
+
+    def join(self, key) -> Flight:
+        with self._lock:
+            flight = self._flights.get(key)
+            if flight is not None:
+                inc("klage_coalesced_requests_total")
+                return Flight(flight.future, leader=False)
+            flight = self._flights[key] = Flight()
+            return flight
+
+    def finish(self, key, result=None, error=None):
+        with self._lock:
+            flight = self._flights.pop(key, None)
+        if flight is None:
+            return
+        if error is not None and not isinstance(error, Exception):
+            inc("klage_flights_abandoned_total")
+            error = FlightAbandoned("Forespørselen ble avbrutt før den var ferdig")
+        if error is not None:
+            flight.future.set_exception(error)
+        else:
+            flight.future.set_result(result)
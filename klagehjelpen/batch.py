@@ -0,0 +1,319 @@
+"""Headless batch-kjøring av klagesaker fra et JSONL-manifest.
+
+    python -m klagehjelpen.batch saker.jsonl -o resultater.jsonl --workers 4 --rps 2
+    python -m klagehjelpen.batch saker.jsonl -o resultater.jsonl --fake   # lokal stand-in-modell
+
+Manifestet har én sak per linje:
+
+    {"case_id": "A-1", "files": ["kvittering.pdf", "skade.jpg"],
+     "feil_beskrivelse": "...", "losning": "...", "tone": "...", "rolle": "...",
+     "hendelsesdato": "2024-03-12", "mitt_navn": "...", "min_epost": "..."}
+
+Relative filstier leses fra manifestets mappe. Utfilen er også checkpoint:
+saker som allerede står med status "ok" der, hoppes over ved ny kjøring.
+"""
+import argparse
+import json
+import logging
+import mimetypes
+import os
+import random
+import re
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+from datetime import date
+
+from klagehjelpen.admission import is_rate_limit_error
+from klagehjelpen.core import ComplaintInputs, check_name_similarity, finalize_result, prepare_request
+from klagehjelpen.llm import Attempt, Generation
+from klagehjelpen.metrics import REGISTRY, span, start_metrics_server
+
+logger = logging.getLogger(__name__)
+
+
+# ==========================================
+# RATE LIMITING
+# ==========================================
+
+class RateLimiter:
+    """Token-bucket som deles av alle arbeidertrådene.
+
+    `penalize()` kalles ved 429/kvotefeil og stopper alle tråder en stund,
+    slik at vi ikke prøver på nytt samtidig.
+    """
+
+    def __init__(self, rate_per_second: float, burst: int = 1):
+        self.rate = rate_per_second
+        self.capacity = max(1, burst)
+        self._tokens = float(self.capacity)
+        self._updated = time.monotonic()
+        self._paused_until = 0.0
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        if self.rate <= 0:
+            return
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                if now < self._paused_until:
+                    wait = self._paused_until - now
+                else:
+                    self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+                    self._updated = now
+                    if self._tokens >= 1:
+                        self._tokens -= 1
+                        return
+                    wait = (1 - self._tokens) / self.rate
+            time.sleep(wait)
+
+    def penalize(self, seconds: float):
+        with self._lock:
+            self._paused_until = max(self._paused_until, time.monotonic() + seconds)
+            self._tokens = 0.0
+
+
+# ==========================================
+# STATISTIKK
+# ==========================================
+
+@dataclass
+class BatchStats:
+    total: int = 0
+    skipped: int = 0
+    ok: int = 0
+    failed: int = 0
+    retries: int = 0
+    latencies: list = field(default_factory=list)
+    started: float = field(default_factory=time.monotonic)
+    _lock: threading.Lock = field(default_factory=threading.Lock, repr=False)
+
+    def record(self, ok: bool, seconds: float, retries: int):
+        with self._lock:
+            if ok:
+                self.ok += 1
+            else:
+                self.failed += 1
+            self.retries += retries
+            self.latencies.append(seconds)
+
+    def summary(self) -> dict:
+        with self._lock:
+            elapsed = time.monotonic() - self.started
+            latencies = sorted(self.latencies)
+            processed = self.ok + self.failed
+
+        def pct(p):
+            if not latencies:
+                return 0.0
+            return round(latencies[min(len(latencies) - 1, int(p * len(latencies)))], 3)
+
+        return {
+            "total": self.total, "skipped": self.skipped, "ok": self.ok, "failed": self.failed,
+            "retries": self.retries, "elapsed_s": round(elapsed, 2),
+            "cases_per_min": round(processed / elapsed * 60, 2) if elapsed else 0.0,
+            "p50_s": pct(0.50), "p95_s": pct(0.95),
+        }
+
+
+# ==========================================
+# MANIFEST OG CHECKPOINT
+# ==========================================
+
+def read_manifest(path) -> list:
+    base = os.path.dirname(os.path.abspath(path))
+    cases = []
+    with open(path, "r", encoding="utf-8") as f:
+        for line_no, line in enumerate(f, 1):
+            line = line.strip()
+            if not line or line.startswith("#"):
+                continue
+            case = json.loads(line)
+            case.setdefault("case_id", f"linje-{line_no}")
+            case["files"] = [p if os.path.isabs(p) else os.path.join(base, p) for p in case.get("files", [])]
+            cases.append(case)
+    return cases
+
+
+def completed_case_ids(output_path) -> set:
+    done = set()
+    if not os.path.exists(output_path):
+        return done
+    with open(output_path, "r", encoding="utf-8") as f:
+        for line in f:
+            try:
+                record = json.loads(line)
+            except ValueError:
+                continue  # halvskrevet linje fra en avbrutt kjøring
+            if record.get("status") == "ok":
+                done.add(record.get("case_id"))
+    return done
+
+
+def load_files(paths) -> list:
+    files = []
+    with span("file_read", files=len(paths)):
+        for path in paths:
+            mime_type = mimetypes.guess_type(path)[0] or "application/octet-stream"
+            with open(path, "rb") as f:
+                files.append((os.path.basename(path), mime_type, f.read()))
+    return files
+
+
+def case_inputs(case: dict) -> ComplaintInputs:
+    inputs = ComplaintInputs()
+    for name in ("feil_beskrivelse", "losning", "tone", "rolle", "mitt_navn", "min_epost"):
+        if case.get(name) is not None:
+            setattr(inputs, name, case[name])
+    if case.get("hendelsesdato"):
+        inputs.hendelsesdato = date.fromisoformat(case["hendelsesdato"])
+    return inputs
+
+
+# ==========================================
+# LOKAL STAND-IN-MODELL
+# ==========================================
+
+def fake_generate(prompt: str, images=None, delay: float = 0.0) -> Generation:
+    """Deterministisk svar uten nettverk, for testing av batch-kjøringen."""
+    start = time.perf_counter()
+    if delay:
+        time.sleep(delay)
+    company = re.search(r"- SELSKAP: (.+)", prompt)
+    name = re.search(r"- NAVN PÅ KVITTERING: (.+)", prompt)
+    complainant = re.search(r"- KLAGER: (.*) \(", prompt)
+    data = {
+        "selskapsnavn_funnet": company.group(1).strip() if company else "Ukjent",
+        "navn_paa_kvittering": name.group(1).strip() if name else None,
+        "emne": "Reklamasjon",
+        "mottaker_epost_gjetning": "",
+        "brødtekst": f"Hei,\n\nJeg viser til kjøpet og reklamerer.\n\nMed vennlig hilsen, "
+                     f"{complainant.group(1) if complainant else ''}",
+    }
+    seconds = time.perf_counter() - start
+    return Generation(data=data, model="fake", seconds=seconds,
+                      attempts=[Attempt(model="fake", seconds=seconds, ok=True)])
+
+
+# ==========================================
+# KJØRING
+# ==========================================
+
+def process_case(case, generate, matcher=None, limiter=None, max_retries=5, base_delay=2.0) -> dict:
+    """Kjører én sak. Returnerer en JSON-serialiserbar resultatlinje."""
+    record = {"case_id": case["case_id"], "status": "error"}
+    start = time.perf_counter()
+    retries = 0
+    try:
+        inputs = case_inputs(case)
+        request = prepare_request(load_files(case["files"]), inputs, matcher)
+        while True:
+            if limiter:
+                limiter.acquire()
+            try:
+                generation = generate(request.prompt, request.images)
+                break
+            except Exception as e:
+                if not is_rate_limit_error(e) or retries >= max_retries:
+                    raise
+                # Eksponentiell backoff med jitter; stopp hele poolen like lenge
+                delay = base_delay * (2 ** retries) * random.uniform(0.8, 1.2)
+                retries += 1
+                logger.warning("Kvotefeil for %s, venter %.1f s (forsøk %d)", case["case_id"], delay, retries)
+                if limiter:
+                    limiter.penalize(delay)
+                else:
+                    time.sleep(delay)
+
+        request.release()
+        result = finalize_result(generation.data, request, matcher)
+        contact = matcher.match(result.get("selskapsnavn_funnet")) if matcher and result.get("selskapsnavn_funnet") else None
+        record.update({
+            "status": "ok",
+            "model": generation.model,
+            "peak_memory": request.peak_memory,
+            "result": result,
+            "contact": contact,
+            "name_warning": not check_name_similarity(result.get("navn_paa_kvittering"), inputs.mitt_navn),
+            "attempts": [{"model": a.model, "seconds": round(a.seconds, 3), "ok": a.ok} for a in generation.attempts],
+        })
+    except Exception as e:
+        record["error"] = f"{type(e).__name__}: {e}"
+    record["seconds"] = round(time.perf_counter() - start, 3)
+    record["retries"] = retries
+    return record
+
+
+def run_batch(cases, output_path, generate, matcher=None, workers=4, rps=1.0, max_retries=5,
+              progress_every=10) -> BatchStats:
+    stats = BatchStats(total=len(cases))
+    done_ids = completed_case_ids(output_path)
+    todo = [c for c in cases if c["case_id"] not in done_ids]
+    stats.skipped = len(cases) - len(todo)
+    limiter = RateLimiter(rps, burst=workers)
+    write_lock = threading.Lock()
+
+    with open(output_path, "a", encoding="utf-8") as out:
+        def work(case):
+            record = process_case(case, generate, matcher, limiter, max_retries)
+            with write_lock:
+                out.write(json.dumps(record, ensure_ascii=False, default=str) + "\n")
+                out.flush()  # hver ferdige linje er et checkpoint
+            stats.record(record["status"] == "ok", record["seconds"], record["retries"])
+            processed = stats.ok + stats.failed
+            if progress_every and processed % progress_every == 0:
+                logger.info("Fremdrift: %s", stats.summary())
+
+        with ThreadPoolExecutor(max_workers=max(1, workers), thread_name_prefix="batch") as pool:
+            list(pool.map(work, todo))
+    return stats
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Batch-generering av klageutkast fra et JSONL-manifest.")
+    parser.add_argument("manifest", help="JSONL med én sak per linje")
+    parser.add_argument("-o", "--output", required=True, help="JSONL med resultater (også checkpoint)")
+    parser.add_argument("--workers", type=int, default=4, help="Samtidige saker (standard 4)")
+    parser.add_argument("--rps", type=float, default=1.0, help="Maks AI-kall per sekund (0 = ubegrenset)")
+    parser.add_argument("--max-retries", type=int, default=5, help="Nye forsøk ved kvotefeil (429)")
+    parser.add_argument("--fake", action="store_true", help="Bruk lokal stand-in-modell i stedet for Gemini")
+    parser.add_argument("--fake-delay", type=float, default=0.0, help="Kunstig forsinkelse for --fake (sek)")
+    parser.add_argument("--metrics-port", type=int, help="Eksponer Prometheus-metrikker på denne porten")
+    parser.add_argument("--metrics-json", help="Skriv metrikk-øyeblikksbilde (JSON) hit når kjøringen er ferdig")
+    parser.add_argument("--no-contacts", action="store_true", help="Ikke slå opp i kontaktdatabasen")
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(message)s")
+    if args.metrics_port:
+        start_metrics_server(args.metrics_port)
+
+    if args.fake:
+        generate = lambda prompt, images: fake_generate(prompt, images, args.fake_delay)
+    else:
+        from dotenv import load_dotenv
+        import google.generativeai as genai
+        from klagehjelpen.llm import run_generation
+
+        load_dotenv()
+        genai.configure(api_key=os.getenv("GOOGLE_API_KEY", ""))
+        generate = run_generation
+
+    matcher = None
+    if not args.no_contacts:
+        from klagehjelpen.contacts import ContactDirectory
+        matcher = ContactDirectory().matcher()
+
+    cases = read_manifest(args.manifest)
+    stats = run_batch(cases, args.output, generate, matcher, args.workers, args.rps, args.max_retries)
+    print(json.dumps(stats.summary(), ensure_ascii=False), file=sys.stderr)
+    if args.metrics_json:
+        with open(args.metrics_json, "w", encoding="utf-8") as f:
+            json.dump(REGISTRY.snapshot(), f, ensure_ascii=False, indent=2)
+    return 0 if stats.failed == 0 else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,184 @@
+"""Utvalg av dokumenttekst innenfor et token-budsjett.
+
+I stedet for å klippe `combined_text[:6000]` blindt, scores hver linje etter
+hvor nyttig den er for en klage (beløp, datoer, ordre- og org.nr., varelinjer,
+kjøpers navn), mens standardvilkår og annen boilerplate trekkes ned.
+Linjer som bare er boilerplate, tas aldri med, selv om det er plass til
+dem. Budsjettet fordeles rettferdig mellom filene (max-min), og valgte linjer
+skrives ut i opprinnelig rekkefølge med "[...]" der noe er utelatt. Både
+rammene og "[...]"-markørene regnes med i budsjettet.
+"""
+import bisect
+import math
+import os
+import re
+from dataclasses import dataclass
+
+DEFAULT_TOKEN_BUDGET = int(os.getenv("KLAGE_TEXT_TOKEN_BUDGET", "1500"))
+
+_TOKEN_RE = re.compile(r"\w+|[^\w\s]")
+_GAP_MARKER = "[...]"
+
+# Desimalpunktum uten valuta ("Avsnitt 1.10") er oftere avsnittsnummer enn beløp
+_AMOUNT = re.compile(r"(?i)(\bkr\.?\s*\d|\d[\d .]*,\d{2}\b|\d\s*(kr|nok)\b|\bnok\s*\d|\d+,-)")
+_DATE = re.compile(
+    r"(?i)(\b\d{1,2}[./-]\d{1,2}[./-]\d{2,4}\b|\b\d{4}-\d{2}-\d{2}\b|"
+    r"\b\d{1,2}\.?\s*(jan|feb|mar|apr|mai|may|jun|jul|aug|sep|okt|oct|nov|des|dec)[a-z]*\.?\s*\d{2,4})"
+)
+_ORDER = re.compile(
+    r"(?i)\b(ordre|order|bestilling|kvittering|faktura|invoice|booking|referanse|ref|kid|"
+    r"transaksjon|serienummer|serial)\w*\b.{0,20}?[A-Z0-9-]*\d{3,}"
+)
+_ORG_NR = re.compile(r"(?i)(org\.?\s*(nr|nummer)|foretaksregisteret|\bmva\b|\b\d{3}\s?\d{3}\s?\d{3}\b)")
+_BUYER = re.compile(r"(?i)\b(kunde|kjøper|navn|levert til|leveringsadresse|faktureres til|bill to|ship to|passasjer)\b")
+_PRODUCT = re.compile(r"(?i)\b(vare|artikkel|produkt|antall|stk|modell|model|sku|art\.?\s*nr)\b")
+_BOILERPLATE = re.compile(
+    r"(?i)\b(vilkår|betingelser|angrerett|personvern|cookies?|informasjonskapsler|"
+    r"terms|conditions|privacy|copyright|alle rettigheter|nyhetsbrev|følg oss)"
+)
+_URL = re.compile(r"(?i)\b(https?://|www\.)\S*")
+
+
+def estimate_tokens(text: str) -> int:
+    """Rask lokal tokenestimering (ord og tegn, skalert for norsk tekst og tall)."""
+    if not text:
+        return 0
+    return math.ceil(len(_TOKEN_RE.findall(text)) * 1.3)
+
+
+def score_line(line: str) -> float:
+    stripped = line.strip()
+    if not stripped:
+        return 0.0
+    # Nettadresser teller verken for eller mot; en linje med bare lenker er boilerplate
+    text = _URL.sub(" ", stripped).strip(" ·|:-–")
+    if not text:
+        return 0.0
+    long_line = len(stripped) > 200
+    stripped = text
+    score = 0.0
+    if _AMOUNT.search(stripped):
+        score += 3
+    if _DATE.search(stripped):
+        score += 3
+    if _ORDER.search(stripped):
+        score += 3
+    if _ORG_NR.search(stripped):
+        score += 2
+    if _BUYER.search(stripped):
+        score += 2
+    if _PRODUCT.search(stripped):
+        score += 1.5
+    if _BOILERPLATE.search(stripped):
+        score -= 3
+    if long_line:
+        score -= 1  # lange avsnitt er som regel vilkårstekst
+    if score <= 0 and _BOILERPLATE.search(stripped):
+        return 0.0  # ren boilerplate: tas ikke med
+    # Litt tekst er bedre enn ingenting, så lenge det ikke er boilerplate
+    return max(score, 0.0) + 0.1
+
+
+@dataclass
+class BudgetReport:
+    token_budget: int = 0
+    tokens_in: int = 0  # dokumentlinjene, uten rammer
+    tokens_out: int = 0  # hele den utvalgte teksten, med rammer og "[...]"
+    line_tokens_out: int = 0  # bare de valgte linjene, sammenlignbart med tokens_in
+    lines_in: int = 0
+    lines_out: int = 0
+
+
+def _fair_shares(demands, budget):
+    """Max-min-fordeling: filer som trenger lite får alt, resten deler likt."""
+    shares = [0] * len(demands)
+    remaining = budget
+    order = sorted(range(len(demands)), key=lambda i: demands[i])
+    for pos, i in enumerate(order):
+        share = min(demands[i], remaining // (len(demands) - pos))
+        shares[i] = share
+        remaining -= share
+    return shares
+
+
+def _select_lines(lines, costs, share):
+    """Grådig utvalg etter score. Returnerer (valgte linjer, tokens inkl. "[...]")."""
+    scores = [score_line(line) for line in lines]
+    ranked = sorted(range(len(lines)), key=lambda i: (-scores[i], i))
+    marker_cost = estimate_tokens(_GAP_MARKER)
+    # text_before[k] = antall ikke-tomme linjer før linje k
+    text_before = [0]
+    for line in lines:
+        text_before.append(text_before[-1] + bool(line.strip()))
+
+    def has_text(start, end):
+        return end > start and text_before[end] > text_before[start]
+
+    chosen = []  # sortert
+    used = marker_cost if has_text(0, len(lines)) else 0  # alt utelatt = én markør
+    for i in ranked:
+        if scores[i] <= 0 or costs[i] == 0:
+            continue
+        # Linjen deler et utelatt område i to; hver del med tekst gir en "[...]"
+        pos = bisect.bisect(chosen, i)
+        prev_end = chosen[pos - 1] + 1 if pos else 0
+        next_start = chosen[pos] if pos < len(chosen) else len(lines)
+        markers = has_text(prev_end, i) + has_text(i + 1, next_start) - 1
+        cost = costs[i] + markers * marker_cost
+        if used + cost > share:
+            continue
+        chosen.insert(pos, i)
+        used += cost
+    return set(chosen), used
+
+
+def _render(name, lines, chosen):
+    parts = [f"\n--- TEKST FRA {name} ---\n"]
+    gap = False
+    for i, line in enumerate(lines):
+        if i in chosen:
+            if gap:
+                parts.append(_GAP_MARKER + "\n")
+                gap = False
+            parts.append(line + "\n")
+        elif line.strip():
+            gap = True
+    if gap:
+        parts.append(_GAP_MARKER + "\n")
+    return "".join(parts)
+
+
+def select_document_text(documents, token_budget=DEFAULT_TOKEN_BUDGET):
+    """Velger de viktigste linjene fra `documents` ([(navn, tekst), ...]).
+
+    Returnerer (tekst, BudgetReport). Rammen "--- TEKST FRA <navn> ---"
+    beholdes for hver fil, i opprinnelig rekkefølge. `tokens_out` er det
+    estimerte omfanget av hele teksten, med rammer og "[...]".
+    """
+    report = BudgetReport(token_budget=token_budget)
+    if not documents:
+        return "", report
+
+    split = []
+    for name, text in documents:
+        lines = text.splitlines()
+        costs = [estimate_tokens(line) for line in lines]
+        split.append((name, lines, costs))
+        report.tokens_in += sum(costs)
+        report.lines_in += sum(1 for line in lines if line.strip())
+
+    # Rammelinjene og én "[...]" per fil koster også; trekk dem fra før fordelingen
+    header_cost = sum(estimate_tokens(f"--- TEKST FRA {name} ---") for name, _, _ in split)
+    marker_cost = estimate_tokens(_GAP_MARKER)
+    shares = _fair_shares([sum(costs) for _, _, costs in split],
+                          max(0, token_budget - header_cost - marker_cost * len(split)))
+
+    report.tokens_out = header_cost
+    rendered = []
+    for (name, lines, costs), share in zip(split, shares):
+        chosen, used = _select_lines(lines, costs, share + marker_cost)
+        report.tokens_out += used
+        report.line_tokens_out += sum(costs[i] for i in chosen)
+        report.lines_out += len(chosen)
+        rendered.append(_render(name, lines, chosen))
+    return "".join(rendered), report
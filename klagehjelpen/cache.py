@@ -0,0 +1,200 @@
+"""Innholdsadressert cache for ferdige klageutkast.
+
+Nøkkelen er en SHA-256 over bytene i de opplastede filene pluss normaliserte
+skjemaverdier, slik at dobbeltklikk og nye forsøk etter nettverksfeil ikke
+bruker opp API-kvoten.
+
+Treff og bom eksporteres som `klage_cache_lookups_total{stage, result}`, der
+`stage` skiller brevet fra faktaene i to-stegs-løypa.
+"""
+import hashlib
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+from datetime import date, datetime
+
+from klagehjelpen.metrics import inc
+
+
+def _normalize(value):
+    if value is None:
+        return ""
+    if isinstance(value, (date, datetime)):
+        return value.isoformat()
+    if isinstance(value, str):
+        # Ekstra mellomrom og linjeskift skal ikke gi en ny forespørsel
+        return " ".join(value.split())
+    return str(value)
+
+
+def file_digest(data: bytes) -> str:
+    return hashlib.sha256(data).hexdigest()
+
+
+def make_cache_key(files, **inputs) -> str:
+    """Lager cachenøkkel fra filbytes (i opplastingsrekkefølge) og skjemaverdier."""
+    h = hashlib.sha256()
+    for data in files:
+        h.update(file_digest(data).encode("ascii"))
+        h.update(b"\0")
+    normalized = {k: _normalize(v) for k, v in inputs.items()}
+    h.update(json.dumps(normalized, sort_keys=True, ensure_ascii=False).encode("utf-8"))
+    return h.hexdigest()
+
+
+class ResultCache:
+    """LRU-cache med TTL og valgfri disk-backend som overlever omstart.
+
+    Minnet holder de `max_entries` sist brukte svarene. Med `disk_dir` lagres
+    hvert svar i tillegg som en JSON-fil, og disken beskjæres til
+    `max_disk_entries` filer (eldst brukt først).
+    """
+
+    def __init__(self, max_entries=128, ttl_seconds=3600, disk_dir=None, max_disk_entries=1000):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.disk_dir = disk_dir
+        self.max_disk_entries = max_disk_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self._stats = {"hits": 0, "misses": 0, "disk_hits": 0, "evictions": 0, "expired": 0}
+        if disk_dir:
+            os.makedirs(disk_dir, exist_ok=True)
+
+    # --- Offentlig API ---
+
+    def get(self, key, stage="brev"):
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                expires_at, value = entry
+                if expires_at > now:
+                    self._entries.move_to_end(key)
+                    self._stats["hits"] += 1
+                    inc("klage_cache_lookups_total", stage=stage, result="hit")
+                    return value
+                del self._entries[key]
+                self._stats["expired"] += 1
+
+        record = self._disk_get(key, now)
+        with self._lock:
+            if record is None:
+                self._stats["misses"] += 1
+                inc("klage_cache_lookups_total", stage=stage, result="miss")
+                return None
+            self._stats["hits"] += 1
+            self._stats["disk_hits"] += 1
+            # Beholder utløpstiden fra disken; et treff skal ikke forlenge levetiden
+            expires_at, value = record
+            self._store(key, value, expires_at)
+        inc("klage_cache_lookups_total", stage=stage, result="disk_hit")
+        return value
+
+    def put(self, key, value):
+        expires_at = time.time() + self.ttl_seconds
+        with self._lock:
+            self._store(key, value, expires_at)
+        self._disk_put(key, value, expires_at)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+        for path in self._disk_files():
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+
+    def stats(self) -> dict:
+        with self._lock:
+            stats = dict(self._stats)
+            stats["entries"] = len(self._entries)
+        lookups = stats["hits"] + stats["misses"]
+        stats["hit_rate"] = stats["hits"] / lookups if lookups else 0.0
+        return stats
+
+    # --- Minne ---
+
+    def _store(self, key, value, expires_at):
+        self._entries[key] = (expires_at, value)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+            self._stats["evictions"] += 1
+            inc("klage_cache_evictions_total", tier="minne")
+
+    # --- Disk ---
+
+    def _disk_path(self, key):
+        return os.path.join(self.disk_dir, f"{key}.json")
+
+    def _disk_files(self):
+        if not self.disk_dir:
+            return []
+        return [
+            os.path.join(self.disk_dir, name)
+            for name in os.listdir(self.disk_dir)
+            if name.endswith(".json")
+        ]
+
+    def _disk_get(self, key, now):
+        if not self.disk_dir:
+            return None
+        path = self._disk_path(key)
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                record = json.load(f)
+        except (OSError, ValueError):
+            return None
+        if record.get("expires_at", 0) <= now:
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+            with self._lock:
+                self._stats["expired"] += 1
+            return None
+        try:
+            os.utime(path)  # mtime brukes som LRU-tidsstempel på disk
+        except OSError:
+            pass
+        return record["expires_at"], record.get("value")
+
+    def _disk_put(self, key, value, expires_at):
+        if not self.disk_dir:
+            return
+        path = self._disk_path(key)
+        tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        try:
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump({"expires_at": expires_at, "value": value}, f, ensure_ascii=False)
+            os.replace(tmp_path, path)
+        except (OSError, TypeError, ValueError):
+            try:
+                os.remove(tmp_path)
+            except OSError:
+                pass
+            return
+        self._prune_disk()
+
+    def _prune_disk(self):
+        files = self._disk_files()
+        overflow = len(files) - self.max_disk_entries
+        if overflow <= 0:
+            return
+        def mtime(path):
+            try:
+                return os.path.getmtime(path)
+            except OSError:
+                return 0
+        for path in sorted(files, key=mtime)[:overflow]:
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+            with self._lock:
+                self._stats["evictions"] += 1
+            inc("klage_cache_evictions_total", tier="disk")
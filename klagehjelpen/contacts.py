@@ -0,0 +1,111 @@
+"""Verifisert kontaktdatabase.
+
+Selskapene ligger i `data/contacts.json` (eller filen i KLAGE_CONTACTS_FILE),
+én oppføring per selskap med alle aliasene samlet:
+
+    {"navn": "Elkjøp", "aliases": ["elkjøp"], "kategori": "...",
+     "email": "...", "web": "...", "advarsel": "..."}
+
+Filen leses først ved første oppslag, og lastes inn på nytt i bakgrunnen når
+mtime endres, slik at nye selskaper ikke krever ny utrulling.
+"""
+import json
+import logging
+import os
+import threading
+import time
+
+from klagehjelpen.matcher import ContactMatcher
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_CONTACTS_FILE = os.getenv(
+    "KLAGE_CONTACTS_FILE",
+    os.path.join(os.path.dirname(__file__), "data", "contacts.json"),
+)
+
+# Feltene som vises i appen; alias og kategori er kun for oppslag
+_INFO_FIELDS = ("navn", "email", "web", "advarsel")
+
+
+def load_contacts(path=DEFAULT_CONTACTS_FILE) -> dict:
+    """Leser kontaktfilen og returnerer {alias: kontaktinfo}."""
+    with open(path, "r", encoding="utf-8") as f:
+        entries = json.load(f)
+    contacts = {}
+    for entry in entries:
+        info = {k: entry[k] for k in _INFO_FIELDS if entry.get(k)}
+        for alias in entry.get("aliases") or [entry["navn"]]:
+            contacts.setdefault(alias, info)
+    return contacts
+
+
+class ContactDirectory:
+    """Lat, trådsikker kontaktkatalog med automatisk omlasting ved endret mtime.
+
+    Første oppslag laster filen synkront. Senere endringer bygges i en
+    bakgrunnstråd mens den gamle indeksen fortsetter å svare.
+    """
+
+    def __init__(self, path=DEFAULT_CONTACTS_FILE, check_interval=2.0):
+        self.path = path
+        self.check_interval = check_interval
+        self._matcher = None
+        self._mtime = None
+        self._last_check = 0.0
+        self._lock = threading.Lock()
+        self._reloading = False
+
+    def match(self, company_name):
+        return self.matcher().match(company_name)
+
+    def find(self, company_name):
+        return self.matcher().find(company_name)
+
+    def matcher(self) -> ContactMatcher:
+        if self._matcher is None:
+            with self._lock:
+                if self._matcher is None:
+                    self._reload(self._current_mtime())
+        else:
+            self._maybe_reload()
+        return self._matcher
+
+    def __len__(self):
+        return len(self.matcher())
+
+    def _current_mtime(self):
+        try:
+            return os.stat(self.path).st_mtime_ns
+        except OSError:
+            return None
+
+    def _maybe_reload(self):
+        now = time.monotonic()
+        if now - self._last_check < self.check_interval:
+            return
+        self._last_check = now
+        mtime = self._current_mtime()
+        if mtime is None or mtime == self._mtime:
+            return
+        with self._lock:
+            if self._reloading:
+                return
+            self._reloading = True
+        threading.Thread(target=self._background_reload, args=(mtime,), daemon=True).start()
+
+    def _background_reload(self, mtime):
+        try:
+            self._reload(mtime)
+        except (OSError, ValueError, KeyError) as e:
+            # Behold forrige versjon hvis filen er halvskrevet eller ugyldig
+            logger.warning("Kunne ikke laste kontaktfilen %s på nytt: %s", self.path, e)
+            self._mtime = mtime
+        finally:
+            self._reloading = False
+
+    def _reload(self, mtime):
+        matcher = ContactMatcher(load_contacts(self.path))
+        self._matcher = matcher
+        self._mtime = mtime
+        logger.info("Lastet %d kontaktalias fra %s", len(matcher), self.path)
@@ -0,0 +1,286 @@
+"""Kjernen i en klageforespørsel, uten Streamlit.
+
+Brukes både av app.py og av batch-kjøringen (klagehjelpen.batch):
+
+    request = prepare_request(files, ComplaintInputs(...), matcher)
+    generation = generate(request.prompt, request.images)
+    result = finalize_result(generation.data, request, matcher)
+
+I to steg (app.py): fakta hentes én gang per filsett med bilder, og brevet
+skrives fra faktaene med en ren tekstprompt:
+
+    request = prepare_facts_request(files, matcher)
+    facts = finalize_facts(run_generation(request.prompt, request.images, parse=parse_facts, ...).data, ...)
+    letter = run_generation(build_letter_prompt(inputs, facts), parse=..., generation_config=...)
+"""
+import re
+from dataclasses import dataclass, field
+from datetime import date
+
+from klagehjelpen.budget import select_document_text
+from klagehjelpen.images import optimize_images
+from klagehjelpen.ingest import MemoryBudget, ingest_documents, release_documents, render_pdf_pages
+from klagehjelpen.metrics import observe, span
+from klagehjelpen.receipt import extract_receipt_fields
+
+_LETTER_RULES = """
+VIKTIG OM SPRÅK:
+- Hele klagebrevet SKAL skrives på NORSK (Bokmål).
+- Oversett all info fra dokumentene til norsk.
+
+VIKTIG OM SIGNATUR (UNNGÅ DOBBEL TEKST):
+- Avslutt brevet kun én gang slik: "Med vennlig hilsen, [Ditt Navn]".
+- IKKE legg til navn, adresse eller e-post på nytt under signaturen hvis det allerede står der.
+
+DATA:
+- DATO: {hendelsesdato}
+- PROBLEM: "{feil_beskrivelse}"
+- KRAV: {losning}
+- KLAGER: {mitt_navn} ({min_epost})
+- ROLLE: {rolle}
+- TONE: {tone}
+
+JURIDISK HUKOMMELSE:
+- Elektronikk/møbler = 5 års frist (Forbrukerkjøpsloven § 27).
+- Fly = EU261.
+- P-bot = Parkeringsforskriften.
+- Svarfrist: 14 dager.
+"""
+
+PROMPT_TEMPLATE = """
+Du er en profesjonell, norsk klagehjelper.
+
+DOKUMENT-TEKST: {document_text}
+
+FUNNET LOKALT I KVITTERINGEN (pålitelig hvis oppgitt):
+{local_facts_text}
+
+OPPGAVE:
+1. Analyser vedlagte bilder/dokumenter.
+2. Identifiser hvilket bilde som er KVITTERING (hent kjøpsinfo) og hvilket som er SKADEBEVIS (beskriv feilen).
+3. Skriv en reklamasjon basert på NORSK LOV.
+""" + _LETTER_RULES + """
+OUTPUT FORMAT (JSON):
+{{
+    "selskapsnavn_funnet": "string",
+    "navn_paa_kvittering": "string (eller null)",
+    "emne": "string (På Norsk)",
+    "mottaker_epost_gjetning": "string",
+    "brødtekst": "string (Kun på Norsk)"
+}}
+"""
+
+# To-stegs-løypa: steg 1 leser dokumentene (med bilder) og caches per filsett,
+# steg 2 skriver brevet fra faktaene (kun tekst) og kjøres på nytt ved ny tone/krav/rolle.
+FACTS_PROMPT_TEMPLATE = """
+Du er en norsk klagehjelper. Les vedlagte bilder og dokumenter og hent ut FAKTA
+som trengs for en reklamasjon. IKKE skriv noe brev.
+
+DOKUMENT-TEKST: {document_text}
+
+FUNNET LOKALT I KVITTERINGEN (pålitelig hvis oppgitt):
+{local_facts_text}
+
+OPPGAVE:
+1. Avgjør for hver fil om den er KVITTERING (kjøpsinfo), SKADEBEVIS (viser feilen) eller annet.
+2. Hent kjøpsinfo fra kvitteringen: selskap, kjøpers navn, dato, beløp, vare, ordrenummer.
+3. Beskriv nøkternt hva skadebevisene viser.
+4. Skriv på norsk (Bokmål). Felter du ikke finner, settes til null.
+
+OUTPUT FORMAT (JSON):
+{{
+    "selskapsnavn_funnet": "string",
+    "navn_paa_kvittering": "string (eller null)",
+    "mottaker_epost_gjetning": "string (eller null)",
+    "kjopsdato": "string (eller null)",
+    "belop": "string (eller null)",
+    "vare": "string (eller null)",
+    "ordrenummer": "string (eller null)",
+    "skadebevis": "string (hva bildene viser av feil/skade)",
+    "dokumentoversikt": "string (kort: hvilke filer er kvittering, skadebevis og annet)"
+}}
+"""
+
+LETTER_PROMPT_TEMPLATE = """
+Du er en profesjonell, norsk klagehjelper.
+
+FAKTA FRA DOKUMENTENE (allerede analysert, pålitelige):
+{facts_text}
+
+OPPGAVE:
+Skriv en reklamasjon basert på NORSK LOV ut fra faktaene og dataene under.
+""" + _LETTER_RULES + """
+OUTPUT FORMAT (JSON):
+{{
+    "emne": "string (På Norsk)",
+    "brødtekst": "string (Kun på Norsk)"
+}}
+"""
+
+_FACT_LABELS = (
+    ("selskapsnavn_funnet", "SELSKAP"), ("navn_paa_kvittering", "NAVN PÅ KVITTERING"),
+    ("kjopsdato", "KJØPSDATO"), ("belop", "BELØP"), ("vare", "VARE"), ("ordrenummer", "ORDRENUMMER"),
+    ("skadebevis", "SKADEBEVIS"), ("dokumentoversikt", "DOKUMENTER"),
+)
+
+
+@dataclass
+class ComplaintInputs:
+    """Brukerens valg i skjemaet."""
+    feil_beskrivelse: str = ""
+    losning: str = "Usikker - la AI vurdere"
+    tone: str = "Saklig (Anbefalt)"
+    rolle: str = "Privatperson"
+    hendelsesdato: date = field(default_factory=date.today)
+    mitt_navn: str = ""
+    min_epost: str = ""
+
+    def as_dict(self) -> dict:
+        return {
+            "feil_beskrivelse": self.feil_beskrivelse, "losning": self.losning, "tone": self.tone,
+            "rolle": self.rolle, "hendelsesdato": self.hendelsesdato,
+            "mitt_navn": self.mitt_navn, "min_epost": self.min_epost,
+        }
+
+
+@dataclass
+class PreparedRequest:
+    prompt: str
+    images: list
+    local_facts: object = None  # ReceiptFields
+    text_report: object = None  # BudgetReport
+    image_report: object = None  # ImageReport
+    peak_memory: int = 0  # estimerte bytes, se ingest.MemoryBudget
+    pages_read: int = 0
+    pages_total: int = 0
+
+    def release(self):
+        """Slipper bildene (de største bufferne) når AI-kallet er ferdig."""
+        self.images.clear()
+
+
+def build_prompt(inputs: ComplaintInputs, document_text: str, local_facts_text: str = "") -> str:
+    return PROMPT_TEMPLATE.format(
+        document_text=document_text,
+        local_facts_text=local_facts_text or "- (ingenting)",
+        **inputs.as_dict(),
+    )
+
+
+def build_facts_prompt(document_text: str, local_facts_text: str = "") -> str:
+    return FACTS_PROMPT_TEMPLATE.format(
+        document_text=document_text,
+        local_facts_text=local_facts_text or "- (ingenting)",
+    )
+
+
+def facts_prompt_lines(facts: dict) -> str:
+    lines = [f"- {label}: {facts[key]}" for key, label in _FACT_LABELS if facts.get(key)]
+    return "\n".join(lines) or "- (ingen fakta funnet)"
+
+
+def build_letter_prompt(inputs: ComplaintInputs, facts: dict) -> str:
+    return LETTER_PROMPT_TEMPLATE.format(facts_text=facts_prompt_lines(facts), **inputs.as_dict())
+
+
+def prepare_request(files, inputs: ComplaintInputs, matcher=None, memory_limit=None) -> PreparedRequest:
+    """Fra filer ([(navn, mime-type, bytes), ...]) til ferdig prompt og bilder (ett steg).
+
+    Dekodede bilder og PDF-bytes slippes før funksjonen returnerer; bare de
+    komprimerte bildene som skal til AI-en blir med videre.
+    """
+    return _prepare(files, matcher, memory_limit,
+                    lambda document_text, local_facts_text: build_prompt(inputs, document_text, local_facts_text))
+
+
+def prepare_facts_request(files, matcher=None, memory_limit=None) -> PreparedRequest:
+    """Som prepare_request, men for steg 1: prompten avhenger bare av filene."""
+    return _prepare(files, matcher, memory_limit, build_facts_prompt)
+
+
+def _prepare(files, matcher, memory_limit, make_prompt) -> PreparedRequest:
+    budget = MemoryBudget() if memory_limit is None else MemoryBudget(memory_limit)
+    budget.reserve(sum(len(data) for _, _, data in files), "opplastingen")
+
+    # Filene dekodes parallelt; rekkefølgen følger opplastingen. PDF-sider rendres først ved behov.
+    documents = []
+    try:
+        with span("ingest", files=len(files)):
+            documents = ingest_documents(files, render_pdf=False, budget=budget)
+
+        # Digitale kvitteringer leses lokalt; er vi sikre, trengs ikke sidebildet av PDF-en
+        local_facts = None
+        with span("receipt_extract"):
+            for d in documents:
+                if d.is_pdf:
+                    fields = extract_receipt_fields(d.text, matcher)
+                    if local_facts is None or fields.confidence > local_facts.confidence:
+                        local_facts = fields
+                    if fields.is_confident:
+                        d.source = None
+        render_pdf_pages(documents, budget=budget)
+        images = [img for d in documents for img in d.images]
+
+        # Roter, skaler ned, komprimer og fjern duplikater før AI-kallet
+        images, image_report = optimize_images(images)
+    finally:
+        release_documents(documents, budget)
+
+    with span("prompt_build") as span_fields:
+        # De viktigste linjene fra alle PDF-er innenfor token-budsjettet
+        document_text, text_report = select_document_text(
+            [(d.name, d.text) for d in documents if d.is_pdf]
+        )
+        prompt = make_prompt(document_text, local_facts.as_prompt_lines() if local_facts else "")
+        span_fields.update(chars=len(prompt), text_tokens=text_report.tokens_out,
+                           peak_memory=budget.peak)
+    observe("klage_prompt_chars", len(prompt))
+    observe("klage_document_tokens", text_report.tokens_out)
+    observe("klage_request_peak_bytes", budget.peak)
+    return PreparedRequest(
+        prompt, images, local_facts, text_report, image_report, budget.peak,
+        pages_read=sum(d.pages_read for d in documents), pages_total=sum(d.pages for d in documents),
+    )
+
+
+def finalize_result(result_json, request: PreparedRequest, matcher=None):
+    """Ukjent selskap fra AI-en, men kjent fra kvitteringsteksten: bruk det lokale."""
+    if not isinstance(result_json, dict):
+        return result_json
+    local_facts = request.local_facts
+    if local_facts and local_facts.contact_info:
+        ai_company = result_json.get("selskapsnavn_funnet")
+        with span("contact_lookup"):
+            known = bool(matcher and ai_company and matcher.match(ai_company))
+        if not known:
+            result_json["selskapsnavn_funnet"] = local_facts.company
+    return result_json
+
+
+def finalize_facts(facts: dict, request: PreparedRequest, matcher=None) -> dict:
+    """Som finalize_result, og fyller i tillegg hull med det som ble lest lokalt."""
+    facts = finalize_result(facts, request, matcher)
+    local_facts = request.local_facts
+    if local_facts:
+        if not facts.get("navn_paa_kvittering") and local_facts.buyer_name:
+            facts["navn_paa_kvittering"] = local_facts.buyer_name
+        if not facts.get("kjopsdato") and local_facts.purchase_date:
+            facts["kjopsdato"] = local_facts.purchase_date.strftime("%d.%m.%Y")
+        if not facts.get("belop") and local_facts.amount is not None:
+            facts["belop"] = f"{local_facts.amount:.2f} kr"
+    return facts
+
+
+def check_name_similarity(name_on_doc, user_name):
+    # Hvis en av dem mangler, antar vi det er greit (f.eks manuell inntasting)
+    if not name_on_doc or not user_name: return True
+    if name_on_doc.lower() == "null" or name_on_doc.lower() == "none": return True
+
+    doc_clean = re.sub(r'[^\w\s]', '', name_on_doc.lower()).split()
+    user_clean = re.sub(r'[^\w\s]', '', user_name.lower()).split()
+    match_found = False
+    for part in user_clean:
+        if part in doc_clean and len(part) > 2:
+            match_found = True
+            break
+    return match_found
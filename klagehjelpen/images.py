@@ -0,0 +1,150 @@
+"""Optimalisering av bilder før de sendes til Gemini.
+
+Mobilbilder er ofte 12MP+ med EXIF-rotasjon. Opplastingstid og modellens
+latens øker med bildestørrelsen, så vi roterer, skalerer ned, komprimerer og
+fjerner (nesten) like bilder før kallet.
+
+Nesten-like fjernes bare blant fotografier. Rendrede dokumentsider er stort
+sett hvite, så ulike kvitteringer får nesten samme dHash; dem fjerner vi bare
+når pikslene er helt like.
+"""
+import hashlib
+import io
+import os
+from dataclasses import dataclass
+
+from PIL import Image, ImageOps
+
+from klagehjelpen.metrics import inc, observe, span
+
+DEFAULT_MAX_EDGE = int(os.getenv("KLAGE_IMAGE_MAX_EDGE", "1600"))
+DEFAULT_FORMAT = os.getenv("KLAGE_IMAGE_FORMAT", "JPEG").upper()
+DEFAULT_QUALITY = int(os.getenv("KLAGE_IMAGE_QUALITY", "80"))
+# Maks antall ulike bit (av 256) i dHash for at to fotografier regnes som like
+DEFAULT_DEDUPE_DISTANCE = int(os.getenv("KLAGE_IMAGE_DEDUPE", "10"))
+
+# Nøkkel i Image.info der innlesingen legger rå pikselstørrelse i full oppløsning,
+# når bildet er dekodet i redusert oppløsning (JPEG-draft)
+SOURCE_BYTES_KEY = "klage_source_bytes"
+# Nøkkel i Image.info som markerer en rendret PDF-side (ikke et fotografi)
+DOCUMENT_PAGE_KEY = "klage_document_page"
+
+_MIME_TYPES = {"JPEG": "image/jpeg", "WEBP": "image/webp"}
+
+
+@dataclass
+class ImageReport:
+    images_in: int = 0
+    images_out: int = 0
+    duplicates_dropped: int = 0
+    bytes_before: int = 0  # rå piksler (bredde × høyde × kanaler), likt målt for fotografier og PDF-sider
+    bytes_after: int = 0  # kodede bytes som sendes
+
+
+def source_size(img) -> int:
+    """Rå pikselstørrelse i bytes i full oppløsning, også om bildet ble dekodet mindre."""
+    size = img.info.get(SOURCE_BYTES_KEY)
+    if size:
+        return size
+    return img.width * img.height * len(img.getbands())
+
+
+def dhash(img, hash_size=16) -> int:
+    """Perseptuell differanse-hash (hash_size² bit)."""
+    small = img.convert("L").resize((hash_size + 1, hash_size), Image.BILINEAR)
+    pixels = small.tobytes()
+    value = 0
+    for row in range(hash_size):
+        offset = row * (hash_size + 1)
+        for col in range(hash_size):
+            value = (value << 1) | (pixels[offset + col] > pixels[offset + col + 1])
+    return value
+
+
+def _to_rgb(img):
+    if img.mode in ("RGBA", "LA") or (img.mode == "P" and "transparency" in img.info):
+        rgba = img.convert("RGBA")
+        background = Image.new("RGB", rgba.size, (255, 255, 255))
+        background.paste(rgba, mask=rgba.getchannel("A"))
+        return background
+    if img.mode != "RGB":
+        return img.convert("RGB")
+    return img
+
+
+def prepare_image(img, max_edge=DEFAULT_MAX_EDGE):
+    """Retter opp EXIF-rotasjon og skalerer ned til `max_edge` piksler på lengste side."""
+    img = ImageOps.exif_transpose(img)
+    img = _to_rgb(img)
+    if max(img.size) > max_edge:
+        img = img.copy()
+        img.thumbnail((max_edge, max_edge), Image.LANCZOS)
+    return img
+
+
+def encode_image(img, fmt=DEFAULT_FORMAT, quality=DEFAULT_QUALITY) -> dict:
+    """Koder bildet som et Gemini-blob ({"mime_type", "data"})."""
+    fmt = fmt if fmt in _MIME_TYPES else "JPEG"
+    buf = io.BytesIO()
+    if fmt == "WEBP":
+        img.save(buf, format="WEBP", quality=quality, method=4)
+    else:
+        img.save(buf, format="JPEG", quality=quality, optimize=True, progressive=True)
+    return {"mime_type": _MIME_TYPES[fmt], "data": buf.getvalue()}
+
+
+def optimize_images(images, max_edge=DEFAULT_MAX_EDGE, fmt=DEFAULT_FORMAT,
+                    quality=DEFAULT_QUALITY, dedupe_distance=DEFAULT_DEDUPE_DISTANCE):
+    """Returnerer (blobs, ImageReport) for en liste PIL-bilder.
+
+    Bilder med nøyaktig samme piksler som et tidligere bilde hoppes over.
+    Fotografier som er nesten like et tidligere fotografi (dHash-avstand
+    <= `dedupe_distance`) hoppes også over; dokumentsider sammenlignes bare
+    eksakt. Rekkefølgen beholdes ellers.
+    """
+    with span("image_optimize", images=len(images)) as fields:
+        blobs, report = _optimize(images, max_edge, fmt, quality, dedupe_distance)
+        fields.update(bytes_before=report.bytes_before, bytes_after=report.bytes_after)
+    observe("klage_image_bytes", report.bytes_before, phase="before")
+    observe("klage_image_bytes", report.bytes_after, phase="after")
+    if report.duplicates_dropped:
+        inc("klage_images_deduplicated_total", report.duplicates_dropped)
+    return blobs, report
+
+
+def _optimize(images, max_edge, fmt, quality, dedupe_distance):
+    report = ImageReport(images_in=len(images))
+    blobs = []
+    digests = set()  # eksakte piksler for alle bilder som er beholdt
+    seen = []  # (sideforhold, hash) for fotografier som er beholdt
+    for img in images:
+        report.bytes_before += source_size(img)
+        is_page = bool(img.info.get(DOCUMENT_PAGE_KEY))
+        prepared = prepare_image(img, max_edge)
+        if dedupe_distance >= 0:
+            digest = hashlib.sha256(prepared.tobytes()).digest() + repr(prepared.size).encode()
+            if digest in digests:
+                report.duplicates_dropped += 1
+                continue
+            if not is_page:
+                aspect = prepared.width / prepared.height
+                h = dhash(prepared)
+                if any(abs(aspect - a) < 0.02 and bin(h ^ other).count("1") <= dedupe_distance
+                       for a, other in seen):
+                    report.duplicates_dropped += 1
+                    continue
+                seen.append((aspect, h))
+            digests.add(digest)
+        blob = encode_image(prepared, fmt, quality)
+        report.bytes_after += len(blob["data"])
+        blobs.append(blob)
+    report.images_out = len(blobs)
+    return blobs, report
+
+
+def format_bytes(n: int) -> str:
+    if n < 1024:
+        return f"{n} B"
+    if n < 1024 * 1024:
+        return f"{n / 1024:.0f} KB"
+    return f"{n / (1024 * 1024):.1f} MB"
@@ -0,0 +1,251 @@
+"""Innlesing av opplastede filer (PDF og bilder) før AI-kallet.
+
+Bilder dekodes parallelt i en begrenset trådpool. PyMuPDF støtter ikke
+flertråding i det hele tatt (heller ikke separate dokumenter i hver sin tråd),
+så alt PDF-arbeid går serielt bak én lås for hele prosessen – også på tvers
+av Streamlit-økter og batch-arbeidere. Rekkefølgen i resultatet er alltid den
+samme som i opplastingen, slik at prompten blir deterministisk.
+
+Store opplastinger holdes i sjakk på tre måter:
+- PDF-tekst hentes side for side og stopper når tekstbudsjettet er nådd
+  (eller etter KLAGE_PDF_MAX_PAGES sider).
+- Sidebilder rendres først når de faktisk trengs (se `render_pdf_pages`).
+- Alle store buffere (opplasting, dekodede bilder, sidebilder) føres mot et
+  minnebudsjett per forespørsel (`MemoryBudget`, KLAGE_REQUEST_MEMORY_MB).
+"""
+import io
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+
+from PIL import Image
+
+from klagehjelpen.budget import DEFAULT_TOKEN_BUDGET, estimate_tokens
+from klagehjelpen.images import DEFAULT_MAX_EDGE, DOCUMENT_PAGE_KEY, SOURCE_BYTES_KEY, format_bytes
+from klagehjelpen.metrics import span
+
+PDF_MIME = "application/pdf"
+DEFAULT_MAX_WORKERS = int(os.getenv("KLAGE_INGEST_WORKERS", "4"))
+# Hvor mye PDF-tekst vi leser før utvalget i budget.py (litt romslig, så utvalget har noe å velge fra)
+DEFAULT_TEXT_TOKEN_LIMIT = int(os.getenv("KLAGE_PDF_TEXT_TOKENS", str(DEFAULT_TOKEN_BUDGET * 4)))
+DEFAULT_MAX_PAGES = int(os.getenv("KLAGE_PDF_MAX_PAGES", "30"))
+DEFAULT_MEMORY_LIMIT = int(float(os.getenv("KLAGE_REQUEST_MEMORY_MB", "256")) * 1024 * 1024)
+
+_RESERVED_KEY = "klage_reserved_bytes"
+# PyMuPDF er ikke trådsikkert: alle kall mot fitz må holde denne låsen
+_fitz_lock = threading.RLock()
+
+
+class MemoryLimitExceeded(ValueError):
+    pass
+
+
+class MemoryBudget:
+    """Regnskap over store buffere i én forespørsel, med øvre grense.
+
+    Beløpene er estimater (filstørrelse, bredde × høyde × kanaler), ikke målt
+    RSS – det meste av minnet ligger i PIL og MuPDF, utenfor Pythons allokator.
+    """
+
+    def __init__(self, limit: int = DEFAULT_MEMORY_LIMIT):
+        self.limit = limit
+        self.used = 0
+        self.peak = 0
+        self._lock = threading.Lock()
+
+    def reserve(self, nbytes: int, what: str = ""):
+        with self._lock:
+            if self.limit and self.used + nbytes > self.limit:
+                raise MemoryLimitExceeded(
+                    f"Opplastingen er for stor å behandle: {what or 'data'} trenger {format_bytes(nbytes)}, "
+                    f"og grensen er {format_bytes(self.limit)} per forespørsel. Prøv færre filer eller mindre bilder."
+                )
+            self.used += nbytes
+            self.peak = max(self.peak, self.used)
+
+    def release(self, nbytes: int):
+        with self._lock:
+            self.used = max(0, self.used - nbytes)
+
+
+def image_bytes(img) -> int:
+    return img.width * img.height * len(img.getbands())
+
+
+@dataclass
+class IngestedFile:
+    name: str
+    is_pdf: bool = False
+    text: str = ""
+    images: list = field(default_factory=list)
+    pages: int = 0
+    pages_read: int = 0
+    source: bytes = None  # PDF-bytes beholdes bare til sidebildet er rendret (eller droppet)
+
+
+def _fitz():
+    import fitz  # PyMuPDF – tung import, lastes først når en PDF faktisk leses
+    return fitz
+
+
+def _read_bytes(source) -> bytes:
+    if isinstance(source, (bytes, bytearray)):
+        return bytes(source)
+    return source.read()
+
+
+def _render_matrix(page, max_edge):
+    # Standard er 72 DPI uansett sidestørrelse; skaler så lengste side blir ~max_edge
+    longest = max(page.rect.width, page.rect.height) or 1
+    zoom = min(2.0, max(0.5, max_edge / longest))
+    return _fitz().Matrix(zoom, zoom)
+
+
+def _read_text(doc, text_token_limit, max_pages):
+    """Tekst side for side til budsjettet er nådd. Returnerer (tekst, sider lest)."""
+    parts = []
+    tokens = 0
+    pages_read = 0
+    for page in doc:
+        if pages_read >= max_pages or (text_token_limit and tokens >= text_token_limit):
+            break
+        text = page.get_text()
+        parts.append(text + "\n")
+        tokens += estimate_tokens(text)
+        pages_read += 1
+    return "".join(parts), pages_read
+
+
+def _render_page(doc, page_no, max_edge, budget=None):
+    page = doc.load_page(page_no)
+    matrix = _render_matrix(page, max_edge)
+    size = (page.rect * matrix).irect
+    nbytes = size.width * size.height * 3
+    if budget:
+        budget.reserve(nbytes, "sidebilde")
+    try:
+        pix = page.get_pixmap(matrix=matrix, alpha=False)
+        # samples_mv unngår en ekstra kopi av pikseldataene; PIL kopierer selv
+        img = Image.frombytes("RGB", [pix.width, pix.height], pix.samples_mv)
+    except BaseException:
+        if budget:
+            budget.release(nbytes)
+        raise
+    del pix
+    img.info[DOCUMENT_PAGE_KEY] = True
+    img.info[_RESERVED_KEY] = nbytes if budget else 0
+    return img
+
+
+def extract_pdf(data: bytes, max_edge=DEFAULT_MAX_EDGE, render=True, budget=None,
+                text_token_limit=DEFAULT_TEXT_TOKEN_LIMIT, max_pages=DEFAULT_MAX_PAGES) -> tuple:
+    """Returnerer (tekst, bilde av første side eller None, antall sider, sider lest)."""
+    with _fitz_lock:
+        return _extract_pdf(data, max_edge, render, budget, text_token_limit, max_pages)
+
+
+def _extract_pdf(data, max_edge, render, budget, text_token_limit, max_pages):
+    with span("pdf_open", bytes=len(data)):
+        doc = _fitz().open(stream=data, filetype="pdf")
+    try:
+        page_count = len(doc)
+        with span("pdf_text", pages=page_count) as fields:
+            text, pages_read = _read_text(doc, text_token_limit, max_pages)
+            fields["pages_read"] = pages_read
+        first_page_img = None
+        if render and page_count > 0:
+            with span("pdf_pixmap"):
+                first_page_img = _render_page(doc, 0, max_edge, budget)
+    finally:
+        doc.close()
+    return text, first_page_img, page_count, pages_read
+
+
+def extract_pdf_data(uploaded_file, max_edge=DEFAULT_MAX_EDGE, budget=None):
+    """Returnerer (tekst, bilde av første side) for en PDF (fil-objekt eller bytes)."""
+    text, first_page_img, _, _ = extract_pdf(_read_bytes(uploaded_file), max_edge, budget=budget)
+    return text, first_page_img
+
+
+def render_first_page(data: bytes, max_edge=DEFAULT_MAX_EDGE, budget=None):
+    with _fitz_lock, span("pdf_pixmap"):
+        doc = _fitz().open(stream=data, filetype="pdf")
+        try:
+            return _render_page(doc, 0, max_edge, budget) if len(doc) else None
+        finally:
+            doc.close()
+
+
+def load_image(data: bytes, max_edge=DEFAULT_MAX_EDGE, budget=None):
+    with span("image_decode", bytes=len(data)):
+        img = Image.open(io.BytesIO(data))
+        source = image_bytes(img)  # full oppløsning, før draft
+        # JPEG kan dekodes rett i 1/2, 1/4 eller 1/8 oppløsning; vi skalerer uansett ned til max_edge
+        longest = max(img.size)
+        if max_edge and longest > max_edge:
+            scale = max_edge / longest
+            img.draft(None, (int(img.width * scale) + 1, int(img.height * scale) + 1))
+        reserved = image_bytes(img)
+        if budget:
+            budget.reserve(reserved, "bilde")
+        # Image.open er lat – tving dekoding her, inne i arbeidstråden
+        img.load()
+    img.info[SOURCE_BYTES_KEY] = source
+    img.info[_RESERVED_KEY] = reserved if budget else 0
+    return img
+
+
+def ingest_file(name: str, mime_type: str, data: bytes, render_pdf=True, budget=None) -> IngestedFile:
+    if mime_type == PDF_MIME:
+        text, img, pages, pages_read = extract_pdf(data, render=render_pdf, budget=budget)
+        return IngestedFile(name=name, is_pdf=True, text=text, images=[img] if img else [],
+                            pages=pages, pages_read=pages_read, source=None if render_pdf else data)
+    return IngestedFile(name=name, images=[load_image(data, budget=budget)])
+
+
+def ingest_documents(files, max_workers=None, render_pdf=True, budget=None) -> list:
+    """Leser inn `files` ([(navn, mime-type, bytes), ...]).
+
+    Bilder dekodes parallelt i trådpoolen mens PDF-ene leses én og én i
+    kallerens tråd. Returnerer én IngestedFile per fil, i samme rekkefølge som
+    opplastingen. Med `render_pdf=False` rendres ingen PDF-sider; bruk
+    `render_pdf_pages` etterpå.
+    """
+    files = list(files)
+    if not files:
+        return []
+    ingest = lambda f: ingest_file(*f, render_pdf=render_pdf, budget=budget)
+    images = [i for i, f in enumerate(files) if f[1] != PDF_MIME]
+    results = [None] * len(files)
+    workers = max(1, min(max_workers or DEFAULT_MAX_WORKERS, len(images)))
+    if workers == 1 or not images:
+        return [ingest(f) for f in files]
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="ingest") as pool:
+        futures = {i: pool.submit(ingest, files[i]) for i in images}
+        for i, f in enumerate(files):
+            if i not in futures:
+                results[i] = ingest(f)
+        for i, future in futures.items():
+            results[i] = future.result()
+    return results
+
+
+def render_pdf_pages(documents, budget=None):
+    """Rendrer første side for PDF-ene i `documents` som ennå ikke har et sidebilde (serielt)."""
+    for d in documents:
+        if d.is_pdf and d.source is not None:
+            img = render_first_page(d.source, budget=budget)
+            d.images = [img] if img else []
+            d.source = None
+
+
+def release_documents(documents, budget=None):
+    """Lukker dekodede bilder og slipper PDF-bytes så minnet kan frigjøres med en gang."""
+    for d in documents:
+        for img in d.images:
+            if budget:
+                budget.release(img.info.get(_RESERVED_KEY, 0))
+            img.close()
+        d.images = []
+        d.source = None
@@ -0,0 +1,176 @@
+"""Inkrementell parser for JSON-objektet modellen strømmer tilbake.
+
+Parseren leser ett tegn om gangen og holder styr på toppnivåfeltene i
+objektet, slik at f.eks. `selskapsnavn_funnet` kan brukes før hele svaret
+er mottatt, og `brødtekst` kan vises mens den skrives.
+"""
+import json
+
+_ESCAPES = {'"': '"', "\\": "\\", "/": "/", "b": "\b", "f": "\f", "n": "\n", "r": "\r", "t": "\t"}
+
+# Tilstander
+_START = "start"            # venter på første '{' (hopper over ```json o.l.)
+_KEY_OR_END = "key_or_end"  # venter på '"' (nøkkel) eller '}'
+_KEY = "key"                # inne i nøkkelstreng
+_COLON = "colon"
+_VALUE = "value"            # venter på start av verdi
+_STRING = "string"          # inne i strengverdi
+_RAW = "raw"                # tall, true/false/null eller nøstet objekt/liste
+_COMMA_OR_END = "comma_or_end"
+_DONE = "done"
+
+
+class IncrementalJSONParser:
+    """Mater inn biter av et JSON-objekt og plukker ut ferdige toppnivåfelter.
+
+    `feed()` returnerer navnene på feltene som ble ferdige i denne biten.
+    `fields` holder alle ferdige felter, og `partial(navn)` gir den
+    uferdige strengverdien til feltet som strømmes akkurat nå.
+    """
+
+    def __init__(self):
+        self.fields = {}
+        self.current_key = None
+        self._state = _START
+        self._buf = []
+        self._escape = None      # None, "" (etter '\\') eller "uXXXX"-prefiks
+        self._raw_depth = 0
+        self._raw_in_string = False
+        self._raw_escape = False
+
+    @property
+    def done(self) -> bool:
+        return self._state == _DONE
+
+    def partial(self, key):
+        """Uferdig strengverdi for `key` hvis den strømmes nå, ellers ferdig verdi."""
+        if key in self.fields:
+            return self.fields[key]
+        if self.current_key == key and self._state == _STRING:
+            return "".join(self._buf)
+        return None
+
+    def feed(self, chunk: str) -> list:
+        completed = []
+        for ch in chunk:
+            key = self._step(ch)
+            if key is not None:
+                completed.append(key)
+            if self._state == _DONE:
+                break
+        return completed
+
+    # --- Tilstandsmaskin ---
+
+    def _step(self, ch):
+        state = self._state
+        if state == _START:
+            if ch == "{":
+                self._state = _KEY_OR_END
+        elif state == _KEY_OR_END:
+            if ch == '"':
+                self._buf = []
+                self._state = _KEY
+            elif ch == "}":
+                self._state = _DONE
+        elif state == _KEY:
+            value = self._read_string_char(ch)
+            if value is not None:
+                self.current_key = value
+                self._state = _COLON
+        elif state == _COLON:
+            if ch == ":":
+                self._state = _VALUE
+        elif state == _VALUE:
+            if ch == '"':
+                self._buf = []
+                self._state = _STRING
+            elif not ch.isspace():
+                self._buf = [ch]
+                self._raw_depth = 1 if ch in "{[" else 0
+                self._raw_in_string = False
+                self._raw_escape = False
+                self._state = _RAW
+        elif state == _STRING:
+            value = self._read_string_char(ch)
+            if value is not None:
+                return self._finish(value)
+        elif state == _RAW:
+            return self._read_raw_char(ch)
+        elif state == _COMMA_OR_END:
+            if ch == ",":
+                self._state = _KEY_OR_END
+            elif ch == "}":
+                self._state = _DONE
+        return None
+
+    def _finish(self, value):
+        key = self.current_key
+        self.fields[key] = value
+        self.current_key = None
+        self._buf = []
+        self._state = _COMMA_OR_END
+        return key
+
+    def _read_string_char(self, ch):
+        """Legger `ch` til gjeldende streng. Returnerer strengen når den er lukket."""
+        if self._escape is not None:
+            if self._escape == "":
+                if ch == "u":
+                    self._escape = "u"
+                else:
+                    self._buf.append(_ESCAPES.get(ch, ch))
+                    self._escape = None
+            else:
+                self._escape += ch
+                if len(self._escape) == 5:
+                    try:
+                        self._buf.append(chr(int(self._escape[1:], 16)))
+                    except ValueError:
+                        pass
+                    self._escape = None
+            return None
+        if ch == "\\":
+            self._escape = ""
+            return None
+        if ch == '"':
+            # Slå sammen surrogatpar fra \\uXXXX-escapes
+            text = "".join(self._buf).encode("utf-16", "surrogatepass").decode("utf-16", "replace")
+            self._buf = []
+            return text
+        self._buf.append(ch)
+        return None
+
+    def _read_raw_char(self, ch):
+        if self._raw_in_string:
+            self._buf.append(ch)
+            if self._raw_escape:
+                self._raw_escape = False
+            elif ch == "\\":
+                self._raw_escape = True
+            elif ch == '"':
+                self._raw_in_string = False
+            return None
+        if self._raw_depth == 0 and (ch in ",}" or ch.isspace()):
+            value = self._decode_raw()
+            key = self._finish(value)
+            if ch == ",":
+                self._state = _KEY_OR_END
+            elif ch == "}":
+                self._state = _DONE
+            return key
+        self._buf.append(ch)
+        if ch == '"':
+            self._raw_in_string = True
+        elif ch in "{[":
+            self._raw_depth += 1
+        elif ch in "}]":
+            self._raw_depth -= 1
+        return None
+
+    def _decode_raw(self):
+        raw = "".join(self._buf)
+        try:
+            return json.loads(raw)
+        except ValueError:
+            return raw
@@ -0,0 +1,335 @@
+"""Kall mot Gemini med gjenbrukte klienter, tidsavbrudd per forsøk og hedging.
+
+Uten hedging prøves primærmodellen først og fallback-modellen etterpå, som
+før. Med `hedge_after` satt startes fallback-modellen parallelt hvis
+primærmodellen ikke har svart innen terskelen, og det første gyldige svaret
+vinner. Hvert kall gir et `Generation`-objekt som forteller hvilken modell
+som svarte og hvor lang tid hvert forsøk tok.
+"""
+import json
+import logging
+import math
+import os
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from dataclasses import dataclass, field
+
+from klagehjelpen.metrics import inc, observe, span
+from klagehjelpen.response import FACTS_SCHEMA, LETTER_SCHEMA, RESPONSE_SCHEMA, clean_json_text, parse_complaint
+
+logger = logging.getLogger(__name__)
+
+PRIMARY_MODEL = os.getenv("KLAGE_MODEL", "gemini-2.0-flash")
+FALLBACK_MODEL = os.getenv("KLAGE_FALLBACK_MODEL", "gemini-1.5-flash")
+ATTEMPT_TIMEOUT = float(os.getenv("KLAGE_ATTEMPT_TIMEOUT", "60"))
+# Sekunder før fallback-modellen startes parallelt. Tom = av (seriell fallback). Gjelder ikke strømming.
+HEDGE_AFTER = float(os.getenv("KLAGE_HEDGE_AFTER")) if os.getenv("KLAGE_HEDGE_AFTER") else None
+
+JSON_CONFIG = {"response_mime_type": "application/json"}
+# Skjemaet låser feltene; KLAGE_RESPONSE_SCHEMA=0 slår det av (f.eks. for modeller uten støtte)
+if os.getenv("KLAGE_RESPONSE_SCHEMA", "1") != "0":
+    JSON_CONFIG["response_schema"] = RESPONSE_SCHEMA
+# To-stegs-løypa: fakta fra dokumentene og selve brevet har hvert sitt skjema
+FACTS_CONFIG = {**JSON_CONFIG, "response_schema": FACTS_SCHEMA} if "response_schema" in JSON_CONFIG else JSON_CONFIG
+LETTER_CONFIG = {**JSON_CONFIG, "response_schema": LETTER_SCHEMA} if "response_schema" in JSON_CONFIG else JSON_CONFIG
+
+
+def _hedge_workers() -> int:
+    """Tråder til hedging: like mange som kvoten kan ha modellkall i gang samtidig.
+
+    Et forlatt forsøk kan ikke avbrytes, men holder tråden høyst ATTEMPT_TIMEOUT.
+    Kvoten (KLAGE_MODEL_RPM + KLAGE_FALLBACK_RPM, pluss burst per modell) slipper
+    ikke flere kall i gang innenfor det vinduet, så nye forsøk står aldri i kø
+    bak forlatte. KLAGE_HEDGE_WORKERS overstyrer.
+    """
+    if os.getenv("KLAGE_HEDGE_WORKERS"):
+        return max(2, int(os.getenv("KLAGE_HEDGE_WORKERS")))
+    rpm = float(os.getenv("KLAGE_MODEL_RPM", "15")) + float(os.getenv("KLAGE_FALLBACK_RPM", "15"))
+    burst = int(os.getenv("KLAGE_MODEL_BURST", "3"))
+    return max(2, math.ceil(rpm * ATTEMPT_TIMEOUT / 60) + 2 * burst)
+
+
+_models = {}
+_models_lock = threading.Lock()
+_hedge_pool = ThreadPoolExecutor(max_workers=_hedge_workers(), thread_name_prefix="gemini")
+
+
+@dataclass
+class Attempt:
+    model: str
+    seconds: float = 0.0
+    ok: bool = False
+    error: str = ""
+    hedged: bool = False
+    prompt_tokens: int = 0
+    output_tokens: int = 0
+    repaired: bool = False
+    problems: list = field(default_factory=list)
+
+
+@dataclass
+class Generation:
+    data: dict = None
+    model: str = ""
+    attempts: list = field(default_factory=list)
+    seconds: float = 0.0  # total ventetid for brukeren
+
+    @property
+    def prompt_tokens(self) -> int:
+        return next((a.prompt_tokens for a in self.attempts if a.ok), 0)
+
+    @property
+    def problems(self) -> list:
+        """Det som ble reparert lokalt i svaret som ble brukt."""
+        return next((a.problems for a in self.attempts if a.ok), [])
+
+    @property
+    def repaired(self) -> bool:
+        """True hvis JSON-en i svaret som ble brukt, måtte repareres (f.eks. avkortet)."""
+        return next((a.repaired for a in self.attempts if a.ok), False)
+
+
+class GenerationError(RuntimeError):
+    """Alle forsøk feilet. `attempts` beskriver hvert forsøk."""
+
+    def __init__(self, attempts, cause=None):
+        self.attempts = attempts
+        details = "; ".join(f"{a.model}: {a.error}" for a in attempts)
+        super().__init__(f"Ingen modell ga gyldig svar ({details})")
+        self.__cause__ = cause
+
+
+def build_model_inputs(prompt: str, images=None) -> list:
+    inputs = [prompt]
+    if images:
+        if isinstance(images, list):
+            inputs.extend(images)
+        else:
+            inputs.append(images)
+    return inputs
+
+
+def get_model(model_name: str, generation_config=None):
+    """Gjenbrukt GenerativeModel per (modell, konfig) i hele prosessen."""
+    generation_config = generation_config or JSON_CONFIG
+    key = (model_name, json.dumps(generation_config, sort_keys=True, default=str))
+    model = _models.get(key)
+    if model is None:
+        with _models_lock:
+            model = _models.get(key)
+            if model is None:
+                import google.generativeai as genai  # tung import, kun når en modell faktisk trengs
+                model = genai.GenerativeModel(model_name, generation_config=generation_config)
+                _models[key] = model
+    return model
+
+
+def _record_usage(attempt, usage):
+    if usage is None:
+        return
+    attempt.prompt_tokens = getattr(usage, "prompt_token_count", 0) or 0
+    attempt.output_tokens = getattr(usage, "candidates_token_count", 0) or 0
+    observe("klage_prompt_tokens", attempt.prompt_tokens, model=attempt.model)
+    observe("klage_output_tokens", attempt.output_tokens, model=attempt.model)
+
+
+def _attempt(model_name, inputs, timeout, hedged=False, parse=parse_complaint, generation_config=None):
+    """Ett forsøk mot én modell. Returnerer (data eller None, Attempt, exception)."""
+    attempt = Attempt(model=model_name, hedged=hedged)
+    start = time.perf_counter()
+    try:
+        with span("gemini_attempt", model=model_name, hedged=hedged):
+            response = get_model(model_name, generation_config).generate_content(
+                inputs, request_options={"timeout": timeout}
+            )
+        _record_usage(attempt, getattr(response, "usage_metadata", None))
+        # Avkortet eller litt ugyldig JSON repareres her i stedet for et nytt modellkall
+        with span("json_parse", model=model_name):
+            parsed = parse(response.text, model=model_name)
+        attempt.repaired, attempt.problems = parsed.repaired, parsed.problems
+        attempt.ok = True
+        return parsed.data, attempt, None
+    except Exception as e:
+        inc("klage_attempt_failures_total", model=model_name)
+        attempt.error = f"{type(e).__name__}: {e}"
+        return None, attempt, e
+    finally:
+        attempt.seconds = time.perf_counter() - start
+        logger.info(
+            "gemini attempt model=%s ok=%s hedged=%s seconds=%.2f %s",
+            model_name, attempt.ok, hedged, attempt.seconds, attempt.error,
+        )
+
+
+def run_generation(prompt: str, images=None, models=None, timeout=ATTEMPT_TIMEOUT,
+                   hedge_after=HEDGE_AFTER, parse=parse_complaint, generation_config=None,
+                   allow=None) -> Generation:
+    """Kjører prompten mot `models` i rekkefølge (eller hedget).
+
+    `parse(tekst, model=...)` gjør svaret om til data (standard: klagebrevet),
+    og `generation_config` overstyrer JSON_CONFIG, f.eks. med et annet skjema.
+    `allow(modell)` spørres før hver fallback-modell (f.eks. Admission.allow,
+    som tar et token fra modellens kvote); False hopper over modellen.
+    """
+    models = list(models or (PRIMARY_MODEL, FALLBACK_MODEL))
+    inputs = build_model_inputs(prompt, images)
+    call = lambda model_name, hedged=False: _attempt(model_name, inputs, timeout, hedged, parse, generation_config)
+    start = time.perf_counter()
+    try:
+        if hedge_after is None or len(models) < 2:
+            generation = _run_serial(models, call, allow)
+        else:
+            generation = _run_hedged(models[0], models[1], call, hedge_after, allow)
+    except GenerationError:
+        inc("klage_generation_failures_total")
+        raise
+    generation.seconds = time.perf_counter() - start
+    inc("klage_generations_total", model=generation.model)
+    if generation.model != models[0]:
+        inc("klage_fallbacks_total", model=generation.model)
+    observe("klage_generation_seconds", generation.seconds)
+    logger.info("gemini served model=%s seconds=%.2f attempts=%d",
+                generation.model, generation.seconds, len(generation.attempts))
+    return generation
+
+
+_NO_QUOTA = "hoppet over (ingen ledig kvote)"
+
+
+def _run_serial(models, call, allow=None):
+    generation = Generation()
+    first_error = None
+    for n, model_name in enumerate(models):
+        if n and allow and not allow(model_name):
+            generation.attempts.append(Attempt(model=model_name, error=_NO_QUOTA))
+            continue
+        data, attempt, error = call(model_name)
+        generation.attempts.append(attempt)
+        if data is not None:
+            generation.data = data
+            generation.model = model_name
+            return generation
+        first_error = first_error or error
+    raise GenerationError(generation.attempts, first_error)
+
+
+def _run_hedged(primary, fallback, call, hedge_after, allow=None):
+    generation = Generation()
+    started = {}  # future -> (modell, starttid, hedged)
+
+    def submit(model_name, hedged):
+        future = _hedge_pool.submit(call, model_name, hedged)
+        started[future] = (model_name, time.perf_counter(), hedged)
+        return future
+
+    pending = {submit(primary, False)}
+    fallback_started = False
+    first_error = None
+
+    while pending:
+        wait_for = hedge_after if not fallback_started else None
+        done, pending = wait(pending, timeout=wait_for, return_when=FIRST_COMPLETED)
+        for future in done:
+            data, attempt, error = future.result()
+            generation.attempts.append(attempt)
+            if data is not None:
+                generation.data = data
+                generation.model = attempt.model
+                # Et forsøk som ikke har startet, avlyses; et som kjører, får fullføre i bakgrunnen
+                # (begrenset av tidsavbruddet) og svaret ignoreres
+                for other in pending:
+                    model_name, start, hedged = started[other]
+                    other.cancel()
+                    inc("klage_hedge_abandoned_total", model=model_name)
+                    generation.attempts.append(Attempt(
+                        model=model_name, seconds=time.perf_counter() - start,
+                        error="forlatt (annen modell svarte først)", hedged=hedged,
+                    ))
+                return generation
+            first_error = first_error or error
+        if not fallback_started and (not done or not pending):
+            # Primær er treg (terskel nådd) eller feilet: start fallback nå, hvis kvoten tillater det
+            fallback_started = True
+            if allow is None or allow(fallback):
+                pending.add(submit(fallback, not done))
+            else:
+                generation.attempts.append(Attempt(model=fallback, error=_NO_QUOTA, hedged=not done))
+    raise GenerationError(generation.attempts, first_error)
+
+
+def _chunk_text(chunk) -> str:
+    # Siste bit i en strøm kan mangle tekst (kun finish_reason)
+    try:
+        return chunk.text
+    except ValueError:
+        return ""
+
+
+def generate_complaint_stream(prompt: str, images=None, models=None, timeout=ATTEMPT_TIMEOUT,
+                              generation_config=None, allow=None):
+    """Strømmer rå JSON-tekst fra modellen. Bytter til fallback kun hvis ingenting er mottatt.
+
+    Måles som run_generation (forsøk, tokens, fallback, total tid), pluss tid til
+    første tekstbit. Hedging (KLAGE_HEDGE_AFTER) gjelder ikke her: brukeren ser
+    teksten fra første modell med en gang, så to parallelle strømmer kan ikke
+    byttes om underveis. Fallback startes bare når primærmodellen feiler før
+    første tekstbit.
+    """
+    models = list(models or (PRIMARY_MODEL, FALLBACK_MODEL))
+    inputs = build_model_inputs(prompt, images)
+
+    attempts = []
+    first_error = None
+    total_start = time.perf_counter()
+    for n, model_name in enumerate(models):
+        if n and allow and not allow(model_name):
+            attempts.append(Attempt(model=model_name, error=_NO_QUOTA))
+            continue
+        started = False
+        attempt = Attempt(model=model_name)
+        attempts.append(attempt)
+        start = time.perf_counter()
+        try:
+            with span("gemini_attempt", model=model_name, hedged=False, stream=True) as fields:
+                response = get_model(model_name, generation_config).generate_content(
+                    inputs, stream=True, request_options={"timeout": timeout}
+                )
+                usage = None
+                for chunk in response:
+                    # Forbruket kommer med (de siste) bitene i strømmen
+                    usage = getattr(chunk, "usage_metadata", None) or usage
+                    text = _chunk_text(chunk)
+                    if text:
+                        if not started:
+                            first = time.perf_counter() - start
+                            fields["first_chunk_ms"] = round(first * 1000, 1)
+                            observe("klage_stream_first_chunk_seconds", first, model=model_name)
+                        started = True
+                        yield text
+            _record_usage(attempt, usage)
+            attempt.ok = True
+            seconds = time.perf_counter() - total_start
+            inc("klage_generations_total", model=model_name)
+            if model_name != models[0]:
+                inc("klage_fallbacks_total", model=model_name)
+            observe("klage_generation_seconds", seconds)
+            logger.info("gemini served model=%s seconds=%.2f attempts=%d stream=True",
+                        model_name, seconds, len(attempts))
+            return
+        except Exception as e:
+            inc("klage_attempt_failures_total", model=model_name)
+            attempt.error = f"{type(e).__name__}: {e}"
+            if started:
+                # Strømmen brøt etter at teksten ble vist: ingen fallback, kalleren redder det som kom
+                inc("klage_generation_failures_total")
+                raise
+            first_error = first_error or e
+        finally:
+            attempt.seconds = time.perf_counter() - start
+            logger.info(
+                "gemini stream model=%s ok=%s seconds=%.2f %s",
+                model_name, attempt.ok, attempt.seconds, attempt.error,
+            )
+    inc("klage_generation_failures_total")
+    raise GenerationError(attempts, first_error)
@@ -0,0 +1,236 @@
+"""Oppslag av selskapsnavn fra AI-en mot kontaktdatabasen.
+
+Tre steg, i prioritert rekkefølge:
+
+1. Eksakt treff på hele det normaliserte navnet (alias-indeks).
+2. Aho-Corasick over navnet der et alias bare teller hvis det starter og
+   slutter på en ordgrense ("Service AS" gir ikke "ice"). Lengste treff vinner,
+   slik at "Air France KLM" gir Air France og ikke KLM.
+3. Fuzzy-treff for feilstavinger ("Elkjøpp", "Zalndo") via en
+   slette-indeks (SymSpell-prinsippet med én sletting på hver side, som
+   finner alle treff med én feil og de fleste med to) og
+   Damerau-Levenshtein-avstand.
+
+Indeksen bygges én gang, og oppslag er uavhengig av hvor mange selskaper
+databasen har (bortsett fra antall fuzzy-kandidater).
+"""
+import re
+import unicodedata
+from collections import deque
+from dataclasses import dataclass
+
+# Fuzzy-treff krever minst så mange tegn, ellers blir "tower" til "power"
+FUZZY_MIN_LENGTH = 6
+# Aliaser på minst så mange tegn tåler to feil, kortere bare én
+FUZZY_TWO_EDITS_LENGTH = 9
+
+_TRANSLITERATE = str.maketrans({"ø": "o", "æ": "ae", "å": "a", "ß": "ss"})
+
+
+def normalize_name(text) -> str:
+    """Små bokstaver, æøå foldet til ascii, '&' i ord fjernet og tegnsetting til mellomrom."""
+    if not text:
+        return ""
+    text = text.lower().translate(_TRANSLITERATE)
+    text = unicodedata.normalize("NFKD", text)
+    text = "".join(ch for ch in text if not unicodedata.combining(ch))
+    text = re.sub(r"(?<=\w)&(?=\w)", "", text)  # "h&m" -> "hm"
+    text = re.sub(r"[^a-z0-9]+", " ", text)
+    return text.strip()
+
+
+@dataclass
+class Match:
+    alias: str
+    info: dict
+    kind: str  # "exact", "boundary" eller "fuzzy"
+    distance: int = 0
+
+
+def edit_distance(a: str, b: str, limit: int) -> int:
+    """Damerau-Levenshtein (OSA) med tidlig avbrudd; returnerer limit+1 hvis større."""
+    if abs(len(a) - len(b)) > limit:
+        return limit + 1
+    # Felles start og slutt endrer ikke avstanden; "firma42handel" mot "firma12handel" blir "4" mot "1"
+    start = 0
+    while start < len(a) and start < len(b) and a[start] == b[start]:
+        start += 1
+    end = 0
+    while end < len(a) - start and end < len(b) - start and a[-1 - end] == b[-1 - end]:
+        end += 1
+    a, b = a[start:len(a) - end], b[start:len(b) - end]
+    prev2 = None
+    prev = list(range(len(b) + 1))
+    for i in range(1, len(a) + 1):
+        cur = [i] + [0] * len(b)
+        row_min = cur[0]
+        for j in range(1, len(b) + 1):
+            cost = 0 if a[i - 1] == b[j - 1] else 1
+            cur[j] = min(prev[j] + 1, cur[j - 1] + 1, prev[j - 1] + cost)
+            if i > 1 and j > 1 and a[i - 1] == b[j - 2] and a[i - 2] == b[j - 1]:
+                cur[j] = min(cur[j], prev2[j - 2] + 1)
+            row_min = min(row_min, cur[j])
+        if row_min > limit:
+            return limit + 1
+        prev2, prev = prev, cur
+    return prev[-1] if prev[-1] <= limit else limit + 1
+
+
+def _deletes(word: str, depth: int) -> set:
+    result = {word}
+    frontier = {word}
+    for _ in range(depth):
+        frontier = {w[:i] + w[i + 1:] for w in frontier for i in range(len(w))}
+        result |= frontier
+    return result
+
+
+def _max_edits(length: int) -> int:
+    if length < FUZZY_MIN_LENGTH:
+        return 0
+    return 2 if length >= FUZZY_TWO_EDITS_LENGTH else 1
+
+
+class _AhoCorasick:
+    """Minimal Aho-Corasick-automat over tegn."""
+
+    def __init__(self, patterns):
+        self._goto = [{}]
+        self._fail = [0]
+        self._out = [[]]  # liste med (mønster-id, lengde) per tilstand
+        for pid, pattern in enumerate(patterns):
+            state = 0
+            for ch in pattern:
+                nxt = self._goto[state].get(ch)
+                if nxt is None:
+                    nxt = len(self._goto)
+                    self._goto[state][ch] = nxt
+                    self._goto.append({})
+                    self._fail.append(0)
+                    self._out.append([])
+                state = nxt
+            self._out[state].append((pid, len(pattern)))
+
+        # Barn av roten har fail=0; resten settes bredde-først
+        queue = deque(self._goto[0].values())
+        while queue:
+            state = queue.popleft()
+            for ch, nxt in self._goto[state].items():
+                queue.append(nxt)
+                f = self._fail[state]
+                while f and ch not in self._goto[f]:
+                    f = self._fail[f]
+                self._fail[nxt] = self._goto[f].get(ch, 0)
+                self._out[nxt] = self._out[nxt] + self._out[self._fail[nxt]]
+
+    def iter_matches(self, text):
+        """Gir (startindeks, mønster-id) for alle forekomster."""
+        state = 0
+        for i, ch in enumerate(text):
+            while state and ch not in self._goto[state]:
+                state = self._fail[state]
+            state = self._goto[state].get(ch, 0)
+            for pid, length in self._out[state]:
+                yield i - length + 1, pid
+
+
+class ContactMatcher:
+    """Forhåndsbygd matcher for `{alias: kontaktinfo}`."""
+
+    def __init__(self, contacts: dict):
+        self._aliases = []   # normaliserte alias, indeksert som i automaten
+        self._infos = []
+        self._exact = {}     # normalisert alias -> indeks
+        self._fuzzy = {}     # slettevariant -> sett med indekser
+        for alias, info in contacts.items():
+            norm = normalize_name(alias)
+            if not norm or norm in self._exact:
+                continue
+            idx = len(self._aliases)
+            self._aliases.append(norm)
+            self._infos.append(info)
+            self._exact[norm] = idx
+            compact = norm.replace(" ", "")
+            for variant in _deletes(compact, min(1, _max_edits(len(compact)))):
+                self._fuzzy.setdefault(variant, set()).add(idx)
+        self._automaton = _AhoCorasick(self._aliases)
+
+    def __len__(self):
+        return len(self._aliases)
+
+    def match(self, company_name):
+        """Kontaktinfo for beste treff, eller None."""
+        found = self.find(company_name)
+        return found.info if found else None
+
+    def find(self, company_name):
+        text = normalize_name(company_name)
+        if not text:
+            return None
+
+        idx = self._exact.get(text)
+        if idx is not None:
+            return Match(self._aliases[idx], self._infos[idx], "exact")
+
+        best = None
+        for start, idx in self._boundary_matches(text):
+            # Lengste alias vinner; ved likhet det som står først
+            key = (-len(self._aliases[idx]), start)
+            if best is None or key < best[0]:
+                best = (key, idx)
+        if best is not None:
+            idx = best[1]
+            return Match(self._aliases[idx], self._infos[idx], "boundary")
+
+        return self._find_fuzzy(text)
+
+    def scan(self, text):
+        """Alle ordgrense-treff i en lengre tekst (f.eks. en kvittering), uten fuzzy.
+
+        Returnerer [(posisjon i normalisert tekst, Match), ...] sortert på posisjon.
+        """
+        text = normalize_name(text)
+        found = [
+            (start, Match(self._aliases[idx], self._infos[idx], "boundary"))
+            for start, idx in self._boundary_matches(text)
+        ]
+        return sorted(found, key=lambda item: item[0])
+
+    def _boundary_matches(self, text):
+        for start, idx in self._automaton.iter_matches(text):
+            end = start + len(self._aliases[idx])
+            if start > 0 and text[start - 1] != " ":
+                continue
+            if end < len(text) and text[end] != " ":
+                continue
+            yield start, idx
+
+    def _find_fuzzy(self, text):
+        tokens = text.split()
+        # Enkeltord og to ord slått sammen ("clas ohlsen" -> "clasohlsen")
+        candidates = set(tokens)
+        candidates.update(a + b for a, b in zip(tokens, tokens[1:]))
+
+        best = None
+        for word in candidates:
+            edits = _max_edits(len(word))
+            if not edits:
+                continue
+            seen = set()
+            for variant in _deletes(word, 1):
+                for idx in self._fuzzy.get(variant, ()):
+                    if idx in seen:
+                        continue
+                    seen.add(idx)
+                    compact = self._aliases[idx].replace(" ", "")
+                    limit = min(edits, _max_edits(len(compact)))
+                    distance = edit_distance(word, compact, limit)
+                    if distance > limit:
+                        continue
+                    key = (distance, -len(compact), self._aliases[idx])
+                    if best is None or key < best[0]:
+                        best = (key, idx)
+        if best is None:
+            return None
+        idx = best[1]
+        return Match(self._aliases[idx], self._infos[idx], "fuzzy", distance=best[0][0])
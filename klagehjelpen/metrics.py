@@ -0,0 +1,189 @@
+"""Tidsmåling per steg, tellere og eksport som strukturerte logger og Prometheus.
+
+    with span("pdf_text", file=name):
+        ...
+    inc("klage_parse_failures_total", model=model_name)
+    observe("klage_prompt_tokens", tokens)
+
+Alle målinger havner i ett prosessglobalt register. `render_prometheus()` gir
+tekstformatet Prometheus forventer (summaries med p50/p95/p99), og
+`start_metrics_server()` eksponerer det på /metrics.
+"""
+import json
+import logging
+import os
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+logger = logging.getLogger("klagehjelpen.metrics")
+
+QUANTILES = (0.5, 0.95, 0.99)
+# Antall siste målinger per serie som brukes til kvantiler
+RESERVOIR_SIZE = int(os.getenv("KLAGE_METRICS_RESERVOIR", "2048"))
+
+STAGE_SECONDS = "klage_stage_seconds"
+
+
+def _label_key(labels: dict) -> tuple:
+    return tuple(sorted((k, str(v)) for k, v in labels.items() if v is not None))
+
+
+class _Summary:
+    __slots__ = ("count", "total", "samples")
+
+    def __init__(self):
+        self.count = 0
+        self.total = 0.0
+        self.samples = deque(maxlen=RESERVOIR_SIZE)
+
+    def add(self, value):
+        self.count += 1
+        self.total += value
+        self.samples.append(value)
+
+    def quantiles(self):
+        ordered = sorted(self.samples)
+        if not ordered:
+            return {q: 0.0 for q in QUANTILES}
+        return {q: ordered[min(len(ordered) - 1, int(q * len(ordered)))] for q in QUANTILES}
+
+
+class MetricsRegistry:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._counters = {}   # (navn, labels) -> verdi
+        self._summaries = {}  # (navn, labels) -> _Summary
+
+    def inc(self, name, value=1, **labels):
+        key = (name, _label_key(labels))
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + value
+
+    def observe(self, name, value, **labels):
+        key = (name, _label_key(labels))
+        with self._lock:
+            summary = self._summaries.get(key)
+            if summary is None:
+                summary = self._summaries[key] = _Summary()
+            summary.add(value)
+
+    def reset(self):
+        with self._lock:
+            self._counters.clear()
+            self._summaries.clear()
+
+    def snapshot(self) -> dict:
+        """Maskinlesbart øyeblikksbilde (brukes av benchmarkene og i logger)."""
+        with self._lock:
+            counters = dict(self._counters)
+            summaries = {k: (s.count, s.total, s.quantiles()) for k, s in self._summaries.items()}
+        result = {"counters": {}, "summaries": {}}
+        for (name, labels), value in counters.items():
+            result["counters"][_series_name(name, labels)] = value
+        for (name, labels), (count, total, qs) in summaries.items():
+            result["summaries"][_series_name(name, labels)] = {
+                "count": count, "sum": round(total, 6),
+                **{f"p{int(q * 100)}": round(v, 6) for q, v in qs.items()},
+            }
+        return result
+
+    def render_prometheus(self) -> str:
+        with self._lock:
+            counters = sorted(self._counters.items())
+            summaries = sorted((k, (s.count, s.total, s.quantiles())) for k, s in self._summaries.items())
+        lines = []
+        seen_types = set()
+        for (name, labels), value in counters:
+            if name not in seen_types:
+                lines.append(f"# TYPE {name} counter")
+                seen_types.add(name)
+            lines.append(f"{_series_name(name, labels)} {value}")
+        for (name, labels), (count, total, qs) in summaries:
+            if name not in seen_types:
+                lines.append(f"# TYPE {name} summary")
+                seen_types.add(name)
+            for q, v in qs.items():
+                lines.append(f"{_series_name(name, labels + (('quantile', str(q)),))} {v:.6f}")
+            lines.append(f"{_series_name(name + '_sum', labels)} {total:.6f}")
+            lines.append(f"{_series_name(name + '_count', labels)} {count}")
+        return "\n".join(lines) + "\n"
+
+
+def _series_name(name, labels) -> str:
+    if not labels:
+        return name
+    rendered = ",".join(f'{k}="{_escape(v)}"' for k, v in labels)
+    return f"{name}{{{rendered}}}"
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+REGISTRY = MetricsRegistry()
+
+
+def inc(name, value=1, **labels):
+    REGISTRY.inc(name, value, **labels)
+
+
+def observe(name, value, **labels):
+    REGISTRY.observe(name, value, **labels)
+
+
+def log_event(event: str, **fields):
+    """Strukturert logglinje (én JSON per linje)."""
+    if logger.isEnabledFor(logging.INFO):
+        logger.info(json.dumps({"event": event, **fields}, ensure_ascii=False, default=str))
+
+
+@contextmanager
+def span(stage: str, **fields):
+    """Måler tiden for et steg. Ekstra felter logges, men blir ikke Prometheus-labels.
+
+    Unntaket er `model`, som også blir label slik at hver modell får egne kvantiler.
+    """
+    start = time.perf_counter()
+    ok = True
+    try:
+        yield fields
+    except BaseException:
+        ok = False
+        raise
+    finally:
+        seconds = time.perf_counter() - start
+        observe(STAGE_SECONDS, seconds, stage=stage, model=fields.get("model"))
+        if not ok:
+            inc("klage_stage_errors_total", stage=stage)
+        log_event("span", stage=stage, ms=round(seconds * 1000, 2), ok=ok, **fields)
+
+
+# ==========================================
+# /metrics-ENDEPUNKT
+# ==========================================
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.split("?")[0] not in ("/metrics", "/"):
+            self.send_error(404)
+            return
+        body = REGISTRY.render_prometheus().encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass  # ikke spam loggen med hver scrape
+
+
+def start_metrics_server(port: int, host: str = "0.0.0.0"):
+    """Starter /metrics i en bakgrunnstråd. Returnerer serveren."""
+    server = ThreadingHTTPServer((host, port), _MetricsHandler)
+    threading.Thread(target=server.serve_forever, name="metrics", daemon=True).start()
+    logger.info("Metrics tilgjengelig på http://%s:%d/metrics", host, port)
+    return server
@@ -0,0 +1,278 @@
+"""Lokal, deterministisk uthenting av kvitteringsfelter fra PDF-tekst.
+
+Digitale kvitteringer har som regel et godt tekstlag. Da kan selskap,
+org.nr, beløp, kjøpsdato og kjøpers navn hentes ut med regex og
+kontaktdatabasen, uten å vente på modellen. Når resultatet er sikkert nok,
+trenger vi ikke sende sidebildet av kvitteringen til Gemini.
+"""
+import re
+from dataclasses import dataclass, field
+from datetime import date
+
+# Samlet vekt (se ReceiptFields.confidence) for at en kvittering regnes som sikker
+CONFIDENT_THRESHOLD = 0.75
+
+_MONTHS = {
+    "jan": 1, "feb": 2, "mar": 3, "apr": 4, "mai": 5, "may": 5, "jun": 6, "jul": 7,
+    "aug": 8, "sep": 9, "okt": 10, "oct": 10, "nov": 11, "des": 12, "dec": 12,
+}
+
+_ORG_RE = re.compile(r"(?<!\d)(\d{3})[ .]?(\d{3})[ .]?(\d{3})(?!\d)")
+_ORG_LABEL_RE = re.compile(r"(?i)(org\.?\s*(nr|nummer)|foretaksregisteret|\bmva\b|\bno\s*\d{3})")
+_AMOUNT_RE = re.compile(
+    r"(?i)(?:kr\.?|nok)?\s*(?<![\d,.])(\d{1,3}(?:[ .\u00a0]\d{3})+|\d+)(?:,(\d{2})|(,-)|\.(\d{2}))?\s*(kr|nok|,-)?"
+)
+_TOTAL_LABEL_RE = re.compile(r"(?i)\b(total[t]?|sum|å betale|a betale|beløp|belop|betalt|amount due|grand total)\b")
+_DATE_LABEL_RE = re.compile(r"(?i)\b(kjøpsdato|kjopsdato|ordredato|fakturadato|dato|date|kjøpt|purchased)\b")
+_DMY_RE = re.compile(r"(?<!\d)(\d{1,2})[./-](\d{1,2})[./-](\d{4}|\d{2})(?!\d)")
+_ISO_RE = re.compile(r"(?<!\d)(\d{4})-(\d{2})-(\d{2})(?!\d)")
+_TEXT_DATE_RE = re.compile(r"(?i)(?<!\d)(\d{1,2})\.?\s+([a-zæøå]{3,})\.?\s+(\d{4})")
+_BUYER_LABEL_RE = re.compile(
+    r"(?i)^\s*(kunde(navn)?|navn|kjøper|kjoper|levert til|leveringsadresse|faktureres til|"
+    r"bill to|ship to|customer|passasjer)\s*:?\s*(.*)$"
+)
+# "KID: 1234", "KID-nummer" o.l. er betalingsreferanser, ikke selskapsnavn
+_LABEL_AFTER_RE = r"\s*[:#-]?\s*(\d|nummer|nr\b|no\b)"
+_NAME_RE = re.compile(r"^[A-ZÆØÅ][a-zæøåéèüö'-]+(?:\s+[A-ZÆØÅ][a-zæøåéèüö'-]+){1,3}$")
+
+
+@dataclass
+class ReceiptFields:
+    company: str = ""
+    contact_info: dict = None
+    org_number: str = ""
+    amount: float = None
+    purchase_date: date = None
+    buyer_name: str = ""
+    signals: list = field(default_factory=list)
+
+    @property
+    def confidence(self) -> float:
+        score = 0.0
+        if self.company:
+            score += 0.35
+        if self.amount is not None:
+            score += 0.25
+        if self.purchase_date is not None:
+            score += 0.25
+        if self.buyer_name:
+            score += 0.1
+        if self.org_number:
+            score += 0.05
+        return round(score, 2)
+
+    @property
+    def is_confident(self) -> bool:
+        return self.confidence >= CONFIDENT_THRESHOLD
+
+    def as_prompt_lines(self) -> str:
+        lines = []
+        if self.company:
+            lines.append(f"- SELSKAP: {self.company}")
+        if self.org_number:
+            lines.append(f"- ORG.NR: {self.org_number}")
+        if self.purchase_date:
+            lines.append(f"- KJØPSDATO: {self.purchase_date.isoformat()}")
+        if self.amount is not None:
+            lines.append(f"- BELØP: {self.amount:.2f} kr")
+        if self.buyer_name:
+            lines.append(f"- NAVN PÅ KVITTERING: {self.buyer_name}")
+        return "\n".join(lines)
+
+
+def valid_org_number(digits: str) -> bool:
+    """Kontrollsiffer (MOD11) for norske organisasjonsnummer."""
+    if len(digits) != 9 or not digits.isdigit() or digits[0] not in "89":
+        return False
+    weights = (3, 2, 7, 6, 5, 4, 3, 2)
+    remainder = sum(int(d) * w for d, w in zip(digits, weights)) % 11
+    check = 0 if remainder == 0 else 11 - remainder
+    return check != 10 and check == int(digits[8])
+
+
+def find_org_number(lines) -> str:
+    fallback = ""
+    for line in lines:
+        for m in _ORG_RE.finditer(line):
+            digits = "".join(m.groups())
+            if not valid_org_number(digits):
+                continue
+            if _ORG_LABEL_RE.search(line):
+                return digits
+            fallback = fallback or digits
+    return fallback
+
+
+def parse_amount(match) -> float:
+    whole = re.sub(r"[ .\u00a0]", "", match.group(1))
+    cents = match.group(2) or match.group(4) or "00"
+    return float(f"{whole}.{cents}")
+
+
+def _date_spans(line):
+    return [m.span() for regex in (_ISO_RE, _DMY_RE, _TEXT_DATE_RE) for m in regex.finditer(line)]
+
+
+def _amounts_in(line):
+    dates = _date_spans(line)
+    for m in _AMOUNT_RE.finditer(line):
+        # "05.06.2024" er en dato, ikke 5,06 kr
+        start, end = m.span(1)
+        if any(start < d_end and d_start < end for d_start, d_end in dates):
+            continue
+        # "5990,-" er den vanligste norske prisformen: ",-" regnes som valutamerke
+        has_currency = bool(m.group(3) or m.group(5)) or bool(re.match(r"(?i)\s*(kr|nok)", m.group(0)))
+        has_cents = bool(m.group(2) or m.group(4))
+        # Rene heltall uten valuta er oftere antall, år eller varenummer
+        if not (has_currency or has_cents):
+            continue
+        yield parse_amount(m)
+
+
+def find_amount(lines):
+    """Beløp på en "Total/Sum/Å betale"-linje, ellers største beløp i teksten."""
+    labelled = []
+    others = []
+    for i, line in enumerate(lines):
+        amounts = list(_amounts_in(line))
+        if _TOTAL_LABEL_RE.search(line):
+            # Beløpet står ofte på linjen under etiketten
+            if not amounts and i + 1 < len(lines):
+                amounts = list(_amounts_in(lines[i + 1]))
+            labelled.extend(amounts)
+        else:
+            others.extend(amounts)
+    if labelled:
+        return labelled[-1]
+    return max(others) if others else None
+
+
+def _to_date(year, month, day):
+    if year < 100:
+        year += 2000
+    try:
+        found = date(year, month, day)
+    except ValueError:
+        return None
+    if found > date.today() or found.year < 2000:
+        return None
+    return found
+
+
+def dates_in(line):
+    for m in _ISO_RE.finditer(line):
+        d = _to_date(int(m.group(1)), int(m.group(2)), int(m.group(3)))
+        if d:
+            yield d
+    for m in _DMY_RE.finditer(line):
+        d = _to_date(int(m.group(3)), int(m.group(2)), int(m.group(1)))
+        if d:
+            yield d
+    for m in _TEXT_DATE_RE.finditer(line):
+        month = _MONTHS.get(m.group(2).lower()[:3])
+        if month:
+            d = _to_date(int(m.group(3)), month, int(m.group(1)))
+            if d:
+                yield d
+
+
+def find_purchase_date(lines):
+    first = None
+    for i, line in enumerate(lines):
+        found = list(dates_in(line))
+        if _DATE_LABEL_RE.search(line):
+            if not found and i + 1 < len(lines):
+                found = list(dates_in(lines[i + 1]))
+            if found:
+                return found[0]
+        if found and first is None:
+            first = found[0]
+    return first
+
+
+def find_buyer_name(lines) -> str:
+    for i, line in enumerate(lines):
+        m = _BUYER_LABEL_RE.match(line)
+        if not m:
+            continue
+        candidates = [m.group(3).strip()]
+        if i + 1 < len(lines):
+            candidates.append(lines[i + 1].strip())
+        for candidate in candidates:
+            if _NAME_RE.match(candidate):
+                return candidate
+    return ""
+
+
+def _is_item_line(line) -> bool:
+    # Varelinjer har et beløp, men er ikke sum-/totallinjen
+    return not _TOTAL_LABEL_RE.search(line) and any(True for _ in _amounts_in(line))
+
+
+def _org_line_indexes(lines):
+    """Linjen med org.nr. og linjen over (der selgerens navn gjerne står)."""
+    indexes = set()
+    for i, line in enumerate(lines):
+        if _ORG_LABEL_RE.search(line) or any(valid_org_number("".join(m.groups())) for m in _ORG_RE.finditer(line)):
+            indexes.update((i - 1, i))
+    return indexes
+
+
+def find_company(text, lines, matcher, header_lines=5):
+    """Selgeren, slått opp i kontaktdatabasen.
+
+    Selgeren står i toppen eller ved org.nr.; merkenavn i varelinjene
+    ("Apple iPhone 15 ... 9 990,00") er produsenten, ikke den man klager til.
+    Alias i toppen eller ved org.nr. vinner derfor (tidligst først). Ellers
+    velges aliaset med flest treff utenfor varelinjene, deretter tidligst.
+
+    Korte alias (f.eks. "kid", "ice") teller bare i toppen av dokumentet,
+    og ikke som etikett foran et nummer, ellers blir "KID: 1234" på en
+    faktura til Kid Interiør.
+    """
+    if matcher is None:
+        return None
+    org_lines = _org_line_indexes(lines)
+    preferred = None
+    header_aliases = set()
+    counts = {}
+    for i, line in enumerate(lines):
+        in_header = i < header_lines
+        for pos, match in matcher.scan(line):
+            item = _is_item_line(line)
+            labelled = re.search(rf"(?i)\b{re.escape(match.alias)}{_LABEL_AFTER_RE}", line)
+            if in_header and not labelled:
+                header_aliases.add(match.alias)
+            if (in_header or i in org_lines) and not (labelled or item):
+                preferred = preferred or match
+            if item:
+                continue
+            if len(match.alias) <= 3 and match.alias not in header_aliases:
+                continue
+            first, count, _ = counts.get(match.alias, ((i, pos), 0, match))
+            counts[match.alias] = (first, count + 1, match)
+    if preferred is not None:
+        return preferred
+    if not counts:
+        return None
+    _, _, best = min(counts.values(), key=lambda item: (-item[1], item[0]))
+    return best
+
+
+def extract_receipt_fields(text: str, matcher=None) -> ReceiptFields:
+    """Henter ut kvitteringsfelter fra tekst. `matcher` er en ContactMatcher."""
+    fields = ReceiptFields()
+    if not text or not text.strip():
+        return fields
+    lines = [line.strip() for line in text.splitlines() if line.strip()]
+
+    company = find_company(text, lines, matcher)
+    if company:
+        fields.company = company.info.get("navn", company.alias)
+        fields.contact_info = company.info
+        fields.signals.append(f"selskap:{company.alias}")
+    fields.org_number = find_org_number(lines)
+    fields.amount = find_amount(lines)
+    fields.purchase_date = find_purchase_date(lines)
+    fields.buyer_name = find_buyer_name(lines)
+    return fields
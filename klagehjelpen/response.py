@@ -0,0 +1,206 @@
+"""Svarformatet fra modellen: skjema, tolerant parsing og validering per felt.
+
+Gemini får `RESPONSE_SCHEMA` som `response_schema`, så svaret normalt er
+gyldig JSON med de fem feltene. Er det likevel avkortet eller litt ugyldig
+(komma til slutt, linjeskift rett i strenger, code fences), reddes det lokalt
+med `parse_complaint` i stedet for et nytt kall mot modellen. Bare svar uten
+brødtekst regnes som tapt.
+
+    parsed = parse_complaint(response.text, model="gemini-2.0-flash")
+    parsed.data       # alltid de fem feltene, i fast rekkefølge
+    parsed.repaired   # True hvis JSON-en måtte repareres
+    parsed.problems   # hva som ble rettet, til visning og logg
+"""
+import json
+import re
+from dataclasses import dataclass, field
+
+from klagehjelpen.json_stream import IncrementalJSONParser
+from klagehjelpen.metrics import inc
+
+FIELDS = ("selskapsnavn_funnet", "navn_paa_kvittering", "emne", "mottaker_epost_gjetning", "brødtekst")
+
+RESPONSE_SCHEMA = {
+    "type": "object",
+    "properties": {
+        "selskapsnavn_funnet": {"type": "string"},
+        "navn_paa_kvittering": {"type": "string", "nullable": True},
+        "emne": {"type": "string"},
+        "mottaker_epost_gjetning": {"type": "string"},
+        "brødtekst": {"type": "string"},
+    },
+    "required": ["selskapsnavn_funnet", "emne", "mottaker_epost_gjetning", "brødtekst"],
+}
+
+# To-stegs-løypa: fakta fra dokumentene (med bilder), deretter brevet (kun tekst)
+FACT_FIELDS = (
+    "selskapsnavn_funnet", "navn_paa_kvittering", "mottaker_epost_gjetning", "kjopsdato",
+    "belop", "vare", "ordrenummer", "skadebevis", "dokumentoversikt",
+)
+FACTS_SCHEMA = {
+    "type": "object",
+    "properties": {name: {"type": "string", "nullable": True} for name in FACT_FIELDS},
+    "required": ["selskapsnavn_funnet", "skadebevis", "dokumentoversikt"],
+}
+LETTER_SCHEMA = {
+    "type": "object",
+    "properties": {"emne": {"type": "string"}, "brødtekst": {"type": "string"}},
+    "required": ["emne", "brødtekst"],
+}
+
+DEFAULT_SUBJECT = "Reklamasjon"
+
+# Nøkler modellen av og til bruker i stedet for de riktige
+_KEY_ALIASES = {
+    "brodtekst": "brødtekst",
+    "brÃ¸dtekst": "brødtekst",
+    "selskapsnavn": "selskapsnavn_funnet",
+    "navn_pa_kvittering": "navn_paa_kvittering",
+    "mottaker_epost": "mottaker_epost_gjetning",
+}
+_NULL_STRINGS = {"", "null", "none", "ukjent", "n/a", "-"}
+_EMAIL_RE = re.compile(r"[\w.+-]+@[\w-]+(\.[\w-]+)+")
+
+
+class ResponseError(ValueError):
+    """Svaret kunne ikke reddes (ikke et objekt, eller mangler brødtekst)."""
+
+
+@dataclass
+class ParsedResponse:
+    data: dict
+    repaired: bool = False
+    problems: list = field(default_factory=list)
+
+
+def clean_json_text(text):
+    """Fjerner markdown code blocks hvis AI legger det til."""
+    text = text.strip()
+    if text.startswith("```json"):
+        text = text[7:]
+    if text.startswith("```"):
+        text = text[3:]
+    if text.endswith("```"):
+        text = text[:-3]
+    return text.strip()
+
+
+def repair_json(text: str):
+    """Henter ut det som kan reddes fra avkortet eller litt ugyldig JSON.
+
+    Returnerer (felter, avkortet). En streng som ble kuttet midt i, tas med
+    slik den står.
+    """
+    parser = IncrementalJSONParser()
+    parser.feed(text)
+    data = dict(parser.fields)
+    truncated = not parser.done
+    if truncated and parser.current_key:
+        partial = parser.partial(parser.current_key)
+        if partial:
+            data[parser.current_key] = partial.rstrip()
+    return data, truncated
+
+
+def _as_text(value):
+    if value is None or isinstance(value, str):
+        return value
+    if isinstance(value, list):
+        return "\n\n".join(str(v) for v in value if v is not None)
+    if isinstance(value, dict):
+        return None
+    return str(value)
+
+
+def validate_fields(data: dict):
+    """Normaliserer feltene. Returnerer (data, problemer); kaster ResponseError uten brødtekst."""
+    problems = []
+    raw = {}
+    for key, value in data.items():
+        name = _KEY_ALIASES.get(str(key).strip().lower(), str(key).strip())
+        if name in FIELDS and name not in raw:
+            raw[name] = value
+
+    result = {}
+    for name in FIELDS:
+        value = _as_text(raw.get(name))
+        if raw.get(name) is not None and value is None:
+            problems.append(f"{name} hadde ugyldig type")
+        result[name] = value.strip() if isinstance(value, str) else value
+
+    if not result["brødtekst"]:
+        raise ResponseError("Svaret mangler brødtekst")
+    if not result["emne"]:
+        result["emne"] = DEFAULT_SUBJECT
+        problems.append("emne manglet")
+    if result["selskapsnavn_funnet"] is None:
+        result["selskapsnavn_funnet"] = ""
+        problems.append("selskapsnavn manglet")
+    if result["navn_paa_kvittering"] is not None and result["navn_paa_kvittering"].lower() in _NULL_STRINGS:
+        result["navn_paa_kvittering"] = None
+
+    email = result["mottaker_epost_gjetning"] or ""
+    match = _EMAIL_RE.search(email)
+    if match:
+        result["mottaker_epost_gjetning"] = match.group(0)
+    else:
+        if email:
+            problems.append("ugyldig e-postadresse fjernet")
+        result["mottaker_epost_gjetning"] = ""
+    return result, problems
+
+
+def _load_object(text: str):
+    """JSON-objektet i `text`, reparert om nødvendig. Returnerer (data, reparert, problemer)."""
+    cleaned = clean_json_text(text or "")
+    try:
+        # strict=False godtar linjeskift og tabulator rett i strengene
+        data = json.loads(cleaned, strict=False)
+        return data, False, []
+    except ValueError:
+        data, truncated = repair_json(cleaned)
+        return data, True, ["svaret var avkortet"] if truncated else []
+
+
+def parse_complaint(text: str, model: str = None, defaults: dict = None) -> ParsedResponse:
+    """Parser og validerer modellsvaret. Teller forsøk, reparasjoner og feil per modell.
+
+    `defaults` fyller felter svaret ikke har (brukes når brevet skrives ut fra
+    ferdige fakta og modellen bare returnerer emne og brødtekst).
+    """
+    inc("klage_parses_total", model=model)
+    data, repaired, problems = _load_object(text)
+    try:
+        if not isinstance(data, dict) or not data:
+            raise ResponseError("Svaret er ikke et JSON-objekt")
+        if defaults:
+            data = {**{k: v for k, v in defaults.items() if k in FIELDS}, **data}
+        data, field_problems = validate_fields(data)
+    except ResponseError:
+        inc("klage_parse_failures_total", model=model)
+        raise
+    problems.extend(field_problems)
+    if repaired:
+        inc("klage_parse_repairs_total", model=model)
+    for problem in field_problems:
+        inc("klage_field_fixes_total", model=model, problem=problem)
+    return ParsedResponse(data, repaired, problems)
+
+
+def parse_facts(text: str, model: str = None) -> ParsedResponse:
+    """Parser faktasvaret fra dokumentanalysen. Alle felter er valgfrie strenger."""
+    inc("klage_parses_total", model=model, stage="fakta")
+    data, repaired, problems = _load_object(text)
+    if not isinstance(data, dict) or not data:
+        inc("klage_parse_failures_total", model=model, stage="fakta")
+        raise ResponseError("Faktasvaret er ikke et JSON-objekt")
+    facts = {}
+    for name in FACT_FIELDS:
+        value = _as_text(data.get(name))
+        value = value.strip() if isinstance(value, str) else None
+        facts[name] = None if value is None or value.lower() in _NULL_STRINGS else value
+    match = _EMAIL_RE.search(facts["mottaker_epost_gjetning"] or "")
+    facts["mottaker_epost_gjetning"] = match.group(0) if match else None
+    if repaired:
+        inc("klage_parse_repairs_total", model=model, stage="fakta")
+    return ParsedResponse(facts, repaired, problems)
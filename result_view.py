@@ -0,0 +1,128 @@
+"""Seksjon 6 i app.py: visning av ferdig klageutkast.
+
+Kjøres som et isolert `st.fragment`, så avkrysning i sjekklisten og redigering
+av emne og brevtekst bare kjører denne funksjonen på nytt – ikke hele app.py.
+Ligger i egen fil slik at rerun-kostnaden kan måles alene (bench/bench_rerun.py).
+"""
+import urllib.parse
+
+import streamlit as st
+
+from klagehjelpen.core import check_name_similarity
+
+
+def _contact_for(detected_name, find_contact):
+    # Oppslaget gjøres én gang per resultat, ikke ved hver omkjøring av fragmentet
+    cached = st.session_state.get("_result_contact")
+    if cached is None or cached[0] != detected_name:
+        cached = (detected_name, find_contact(detected_name))
+        st.session_state["_result_contact"] = cached
+    return cached[1]
+
+
+def render_result_view(data, detected_name, mitt_navn, uploaded_filenames, find_contact):
+    if not isinstance(data, dict):
+        st.error("Kunne ikke lese svaret fra AI. Prøv å trykke på knappen en gang til.")
+        return
+
+    doc_name = data.get("navn_paa_kvittering")
+    if doc_name and mitt_navn:
+        if not check_name_similarity(doc_name, mitt_navn):
+            st.error(
+                f"⚠️ **Navnevarsel:** Dokumentet ser ut til å tilhøre **{doc_name}**, "
+                f"men du har registrert navnet ditt som **{mitt_navn}**. "
+                "Sjekk at du bruker ditt eget dokument.",
+                icon="🚫"
+            )
+
+    contact_info = _contact_for(detected_name, find_contact)
+
+    st.markdown("---")
+    st.subheader("📍 Mottaker & Sendingsmetode")
+
+    final_email = ""
+    web_link = ""
+
+    if contact_info:
+        st.success(f"✅ Identifisert selskap: **{contact_info.get('navn', detected_name)}**")
+
+        if "advarsel" in contact_info:
+            st.warning(f"⚠️ **OBS:** {contact_info['advarsel']}")
+
+        if "web" in contact_info:
+            web_link = contact_info["web"]
+            st.info(f"🌐 Dette selskapet bruker primært webskjema/portal.")
+            st.link_button(f"Gå til {contact_info['navn']} sitt klageskjema ↗️", web_link)
+
+            st.caption("👇 1. Kopier teksten under.")
+            st.caption("👉 2. Trykk på knappen over for å lime det inn i skjemaet deres.")
+
+            if "email" in contact_info:
+                final_email = contact_info["email"]
+                st.markdown(f"*(Alternativ e-post funnet: `{final_email}` - men webskjema anbefales)*")
+        else:
+            final_email = contact_info.get("email", "")
+
+    else:
+        st.warning(f"⚠️ Fant ikke '{detected_name}' i vår verifiserte database. Sjekk at e-posten under er riktig.")
+        final_email = data.get("mottaker_epost_gjetning", "")
+
+    if not web_link:
+        col_rec_ui, col_subj_ui = st.columns([1, 1])
+        with col_rec_ui:
+            user_email = st.text_input("Mottaker e-post (kan endres):", value=final_email)
+        with col_subj_ui:
+            user_subject = st.text_input("Emnefelt:", value=data.get("emne", ""))
+    else:
+        user_subject = st.text_input("Emnefelt (til skjemaet):", value=data.get("emne", ""))
+        user_email = final_email
+
+    st.markdown("### 📝 Klagebrev")
+    user_body = st.text_area("Innhold (Redigerbar):", value=data.get("brødtekst", ""), height=400)
+
+    st.markdown("---")
+
+    st.subheader("✅ Sjekkliste før sending")
+
+    c1, c2 = st.columns(2)
+    check_rec = c1.checkbox("Mottaker/Skjema er korrekt")
+    check_txt = c2.checkbox("Mine detaljer stemmer")
+
+    # Knappen er alltid synlig, men 'disabled' til sjekklisten er ok
+    is_ready = check_rec and check_txt
+
+    st.markdown("---")
+
+    if web_link:
+        st.info("👈 Kopier teksten til høyre, og bruk 'Gå til klageskjema'-knappen lenger opp.")
+    elif user_email and "@" in user_email:
+
+        # VIS PÅMINNELSE OM VEDLEGG ALLTID
+        if uploaded_filenames:
+            files_str = ", ".join(uploaded_filenames)
+            st.info(f"📎 **Husk:** Legg ved disse filene manuelt i e-posten: **{files_str}**", icon="⚠️")
+        else:
+            st.info("📎 **Husk:** Du må legge ved eventuelle bilder/kvitteringer manuelt.", icon="⚠️")
+
+        # Hele brevet URL-kodes bare når knappen faktisk kan brukes
+        mailto = f"mailto:{user_email}"
+        if is_ready:
+            safe_s = urllib.parse.quote(user_subject)
+            safe_b = urllib.parse.quote(user_body)
+            mailto = f"mailto:{user_email}?subject={safe_s}&body={safe_b}"
+
+        st.link_button(
+            "📧 Åpne i E-postprogram",
+            mailto,
+            type="primary",
+            use_container_width=True,
+            disabled=not is_ready
+        )
+
+        if not is_ready:
+            st.caption("🛑 Du må huke av sjekkpunktene over for å aktivere knappen.")
+    else:
+        st.warning("Mangler e-postadresse.")
+
+
+show_result_view = st.fragment(render_result_view)
@@ -0,0 +1,159 @@
+import threading
+import time
+
+import pytest
+
+from klagehjelpen.admission import (
+    AdmissionController, FileBucket, FlightAbandoned, LocalBucket, QueueTimeout, SingleFlight,
+)
+from klagehjelpen.llm import Attempt, GenerationError, _run_serial
+
+SLOW = 0.001  # tokens per sekund: i praksis tom bucket under testen
+
+
+def controller(primary_rate=100.0, fallback_rate=100.0, capacity=1, **kwargs):
+    return AdmissionController(
+        primary="p", fallback="f",
+        primary_bucket=LocalBucket(primary_rate, capacity),
+        fallback_bucket=LocalBucket(fallback_rate, capacity),
+        **kwargs,
+    )
+
+
+def test_local_bucket_burst_then_refill():
+    bucket = LocalBucket(rate=20.0, capacity=2)
+    assert bucket.take() == 0
+    assert bucket.take() == 0
+    wait = bucket.take()
+    assert 0 < wait <= 0.05 + 1e-6
+    time.sleep(wait + 0.01)
+    assert bucket.take() == 0
+
+
+def test_local_bucket_pause_blocks_refill():
+    bucket = LocalBucket(rate=1000.0, capacity=1)
+    bucket.pause(0.2)
+    assert bucket.take() > 0.1
+    time.sleep(0.25)
+    assert bucket.take() == 0
+
+
+def test_unlimited_bucket():
+    bucket = LocalBucket(rate=0)
+    assert all(bucket.take() == 0 for _ in range(100))
+
+
+def test_file_bucket_is_shared_between_instances(tmp_path):
+    path = str(tmp_path / "kvote.json")
+    a = FileBucket(path, "p", rate=SLOW, capacity=2)
+    b = FileBucket(path, "p", rate=SLOW, capacity=2)
+    assert a.take() == 0
+    assert b.take() == 0
+    assert a.take() > 0
+    assert FileBucket(path, "f", rate=SLOW, capacity=1).take() == 0
+
+
+def test_fifo_order():
+    ctrl = AdmissionController(primary="p", fallback=None, primary_bucket=LocalBucket(20.0, 1))
+    ctrl.admit()  # tøm burst, så de neste må vente på tur
+    order = []
+
+    def worker(n):
+        ctrl.admit(timeout=5)
+        order.append(n)
+
+    threads = []
+    for n in range(4):
+        t = threading.Thread(target=worker, args=(n,))
+        t.start()
+        threads.append(t)
+        time.sleep(0.01)
+    for t in threads:
+        t.join()
+    assert order == [0, 1, 2, 3]
+
+
+def test_queue_timeout():
+    ctrl = controller(primary_rate=SLOW, fallback_rate=SLOW, fallback_depth=99)
+    ctrl.admit()
+    with pytest.raises(QueueTimeout):
+        ctrl.admit(timeout=0.2)
+    assert ctrl.depth == 0
+
+
+def test_primary_admission_includes_fallback():
+    admission = controller().admit()
+    assert admission.models == ["p", "f"]
+
+
+def test_routes_to_fallback_when_queue_is_deep():
+    ctrl = controller(primary_rate=SLOW, fallback_depth=1)
+    ctrl.admit()  # primærkvoten er brukt opp
+    admission = ctrl.admit(timeout=1)
+    assert admission.models == ["f"]
+
+
+def test_no_fallback_routing_below_depth():
+    ctrl = controller(primary_rate=SLOW, fallback_depth=2)
+    ctrl.admit()
+    with pytest.raises(QueueTimeout):
+        ctrl.admit(timeout=0.2)
+
+
+def test_fallback_call_takes_fallback_token():
+    ctrl = controller(fallback_rate=SLOW)
+    first = ctrl.admit()
+    assert first.allow("p")
+    assert first.allow("f")
+    second = ctrl.admit()
+    assert not second.allow("f")  # fallback-kvoten er brukt opp
+
+
+def test_serial_generation_skips_fallback_without_quota():
+    calls = []
+
+    def call(model_name, hedged=False):
+        calls.append(model_name)
+        return None, Attempt(model=model_name, error="429"), RuntimeError("429")
+
+    with pytest.raises(GenerationError) as excinfo:
+        _run_serial(["p", "f"], call, allow=lambda model: False)
+    assert calls == ["p"]
+    assert [a.model for a in excinfo.value.attempts] == ["p", "f"]
+
+
+def test_report_failure_pauses_bucket():
+    ctrl = controller(primary_rate=1000.0)
+    error = GenerationError([Attempt(model="p", error="ResourceExhausted: 429 quota")])
+    ctrl.report_failure(error)
+    assert ctrl.buckets["p"].take() > 0
+    assert ctrl.buckets["f"].take() == 0
+
+
+def test_single_flight_leader_and_follower():
+    flights = SingleFlight()
+    leader = flights.join("k")
+    follower = flights.join("k")
+    assert leader.leader and not follower.leader
+    flights.finish("k", {"ok": True})
+    assert follower.future.result(timeout=1) == {"ok": True}
+    assert flights.join("k").leader  # ferdig: neste starter på nytt
+
+
+def test_single_flight_shares_errors():
+    flights = SingleFlight()
+    flights.join("k")
+    follower = flights.join("k")
+    flights.finish("k", error=ValueError("feil"))
+    with pytest.raises(ValueError):
+        follower.future.result(timeout=1)
+
+
+def test_single_flight_abandon_on_control_flow_exception():
+    flights = SingleFlight()
+    flights.join("k")
+    follower = flights.join("k")
+    flights.finish("k", error=KeyboardInterrupt())
+    with pytest.raises(FlightAbandoned):
+        follower.future.result(timeout=1)
+    assert flights.join("k").leader
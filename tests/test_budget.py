@@ -0,0 +1,45 @@
+from bench.corpus import BOILERPLATE, RECEIPT_LINES
+from klagehjelpen.budget import estimate_tokens, score_line, select_document_text
+
+
+def test_boilerplate_is_never_selected():
+    assert score_line(BOILERPLATE) == 0
+    text, report = select_document_text([("vilkar.pdf", "\n".join([BOILERPLATE] * 50))])
+    assert report.lines_out == 0
+    assert "vilkår" not in text
+
+
+def test_output_stays_within_budget_including_markers():
+    receipt = "\n".join(RECEIPT_LINES)
+    noise = "\n".join(f"Linje {i} med litt tekst om produktet, modell {i}" for i in range(400))
+    documents = [("kvittering.pdf", receipt), ("manual.pdf", noise), ("vilkar.pdf", BOILERPLATE * 30)]
+    for budget in (100, 300, 1500):
+        text, report = select_document_text(documents, token_budget=budget)
+        assert report.tokens_out <= budget
+        assert estimate_tokens(text) <= budget
+
+
+def test_receipt_lines_are_kept():
+    text, _ = select_document_text([("kvittering.pdf", "\n".join(RECEIPT_LINES + [BOILERPLATE]))])
+    assert "Totalt å betale" in text
+    assert "Kjøpsdato: 12.03.2024" in text
+
+
+def test_lines_with_urls_keep_their_signals():
+    lines = [
+        "Kjøpsdato 12.03.2024 · www.elkjop.no",
+        "Org.nr 912 345 678 MVA · www.power.no",
+        "Les mer: https://www.example.no/ordre Ordrenummer 123456",
+    ]
+    for line in lines:
+        assert score_line(line) > 1
+    assert score_line("https://www.elkjop.no/vilkar") == 0
+    text, report = select_document_text([("kvittering.pdf", "\n".join(lines))])
+    assert report.lines_out == 3
+
+
+def test_selected_line_tokens_never_exceed_input():
+    documents = [("kvittering.pdf", "\n".join(RECEIPT_LINES)), ("vilkar.pdf", "\n".join(["x"] * 5 + [BOILERPLATE]))]
+    for budget in (60, 1500):
+        _, report = select_document_text(documents, token_budget=budget)
+        assert report.line_tokens_out <= report.tokens_in
@@ -0,0 +1,84 @@
+import json
+import os
+import time
+from datetime import date
+
+from klagehjelpen.cache import ResultCache, make_cache_key
+from klagehjelpen.metrics import REGISTRY
+
+
+def test_cache_key_normalizes_inputs():
+    a = make_cache_key([b"fil"], feil_beskrivelse="TV-en  er\nødelagt", dato=date(2024, 3, 12))
+    b = make_cache_key([b"fil"], feil_beskrivelse="TV-en er ødelagt", dato="2024-03-12")
+    assert a == b
+    assert a != make_cache_key([b"annen fil"], feil_beskrivelse="TV-en er ødelagt", dato="2024-03-12")
+
+
+def test_lru_eviction():
+    cache = ResultCache(max_entries=2)
+    cache.put("a", 1)
+    cache.put("b", 2)
+    assert cache.get("a") == 1  # a er nå sist brukt
+    cache.put("c", 3)
+    assert cache.get("b") is None
+    assert cache.get("a") == 1
+    assert cache.get("c") == 3
+    assert cache.stats()["evictions"] == 1
+
+
+def test_ttl_expiry():
+    cache = ResultCache(ttl_seconds=0.05)
+    cache.put("a", {"x": 1})
+    assert cache.get("a") == {"x": 1}
+    time.sleep(0.08)
+    assert cache.get("a") is None
+    assert cache.stats()["expired"] == 1
+
+
+def test_disk_round_trip(tmp_path):
+    ResultCache(disk_dir=str(tmp_path)).put("k", {"brødtekst": "Hei"})
+    fresh = ResultCache(disk_dir=str(tmp_path))  # ny prosess: tomt minne
+    assert fresh.get("k") == {"brødtekst": "Hei"}
+    assert fresh.stats()["disk_hits"] == 1
+    assert fresh.get("k") == {"brødtekst": "Hei"}
+    assert fresh.stats()["disk_hits"] == 1  # andre treff kommer fra minnet
+
+
+def test_disk_hit_keeps_remaining_ttl(tmp_path):
+    ResultCache(ttl_seconds=3600, disk_dir=str(tmp_path)).put("k", "v")
+    path = os.path.join(str(tmp_path), "k.json")
+    with open(path, encoding="utf-8") as f:
+        record = json.load(f)
+    record["expires_at"] = time.time() + 0.05  # nesten utløpt på disk
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(record, f)
+
+    cache = ResultCache(ttl_seconds=3600, disk_dir=str(tmp_path))
+    assert cache.get("k") == "v"  # flyttes til minnet
+    time.sleep(0.08)
+    assert cache.get("k") is None  # full TTL i minnet ville gitt treff her
+
+
+def test_expired_disk_entry_is_removed(tmp_path):
+    ResultCache(ttl_seconds=0.01, disk_dir=str(tmp_path)).put("k", "v")
+    time.sleep(0.03)
+    assert ResultCache(disk_dir=str(tmp_path)).get("k") is None
+    assert not os.listdir(str(tmp_path))
+
+
+def test_disk_is_pruned(tmp_path):
+    cache = ResultCache(disk_dir=str(tmp_path), max_disk_entries=2)
+    for key in ("a", "b", "c"):
+        cache.put(key, key)
+        time.sleep(0.01)
+    assert sorted(os.listdir(str(tmp_path))) == ["b.json", "c.json"]
+
+
+def test_lookups_are_exported_per_stage():
+    cache = ResultCache()
+    cache.put("k", "v")
+    cache.get("k", stage="fakta")
+    cache.get("mangler", stage="fakta")
+    text = REGISTRY.render_prometheus()
+    assert 'klage_cache_lookups_total{result="hit",stage="fakta"}' in text
+    assert 'klage_cache_lookups_total{result="miss",stage="fakta"}' in text
@@ -0,0 +1,55 @@
+import io
+
+import fitz  # PyMuPDF
+from PIL import Image
+
+from bench.corpus import phone_photo
+from klagehjelpen.images import optimize_images
+from klagehjelpen.ingest import load_image, render_first_page
+
+RECEIPTS = {
+    "Elkjøp": ["Elkjøp Norge AS", "Kjøpsdato: 12.03.2024", "Samsung TV   7 999,00", "Totalt 7 999,00 kr"],
+    "Power": ["POWER Norge AS", "Dato 05.06.2024", "Vaskemaskin 5990,-", "Sum 5990,-"],
+    "Telenor": ["Telenor Norge AS", "Faktura 2024-02-01", "iPhone 15 nedbetaling 499,00", "Å betale 499,00 kr"],
+}
+
+
+def _receipt_pdf(lines) -> bytes:
+    doc = fitz.open()
+    page = doc.new_page()
+    page.insert_textbox(fitz.Rect(40, 40, 555, 800), "\n".join(lines), fontsize=9)
+    data = doc.tobytes()
+    doc.close()
+    return data
+
+
+def test_different_receipt_pages_are_kept():
+    pages = [render_first_page(_receipt_pdf(lines)) for lines in RECEIPTS.values()]
+    blobs, report = optimize_images(pages)
+    assert report.duplicates_dropped == 0
+    assert len(blobs) == report.images_out == 3
+
+
+def test_identical_receipt_pages_are_deduplicated():
+    data = _receipt_pdf(RECEIPTS["Power"])
+    blobs, report = optimize_images([render_first_page(data), render_first_page(data)])
+    assert report.duplicates_dropped == 1
+    assert len(blobs) == 1
+
+
+def test_near_duplicate_photos_are_deduplicated():
+    photo = load_image(phone_photo(800, 600, orientation=1))
+    buf = io.BytesIO()
+    photo.save(buf, format="JPEG", quality=60)  # samme motiv, annen koding
+    recompressed = Image.open(io.BytesIO(buf.getvalue()))
+    _, report = optimize_images([photo, recompressed])
+    assert report.duplicates_dropped == 1
+
+
+def test_bytes_before_is_raw_pixels_for_photos_and_pages():
+    # Et stort foto dekodes i redusert oppløsning, men telles i full oppløsning
+    photo = load_image(phone_photo(4000, 3000, orientation=1), max_edge=1600)
+    assert max(photo.size) < 4000
+    page = render_first_page(_receipt_pdf(RECEIPTS["Elkjøp"]))
+    _, report = optimize_images([photo, page])
+    assert report.bytes_before == 4000 * 3000 * 3 + page.width * page.height * 3
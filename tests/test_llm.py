@@ -0,0 +1,53 @@
+import threading
+
+import pytest
+
+from klagehjelpen.llm import Attempt, GenerationError, _run_hedged, _run_serial
+
+
+def fake_call(results, release=None):
+    """call(modell, hedged) som i run_generation; `release` holder primærmodellen igjen."""
+    def call(model_name, hedged=False):
+        if release is not None and model_name == "primær":
+            release.wait(5)
+        data = results[model_name]
+        attempt = Attempt(model=model_name, hedged=hedged, ok=data is not None,
+                          error="" if data is not None else "feil")
+        return data, attempt, None if data is not None else RuntimeError("feil")
+    return call
+
+
+def test_serial_falls_back_when_primary_fails():
+    generation = _run_serial(["primær", "fallback"], fake_call({"primær": None, "fallback": {"ok": 1}}))
+    assert generation.model == "fallback"
+    assert [a.model for a in generation.attempts] == ["primær", "fallback"]
+
+
+def test_serial_skips_fallback_without_quota():
+    with pytest.raises(GenerationError) as info:
+        _run_serial(["primær", "fallback"], fake_call({"primær": None, "fallback": {"ok": 1}}),
+                    allow=lambda model: False)
+    assert [a.ok for a in info.value.attempts] == [False, False]
+    assert "kvote" in info.value.attempts[1].error
+
+
+def test_hedged_fallback_wins_and_primary_is_abandoned():
+    release = threading.Event()
+    try:
+        generation = _run_hedged("primær", "fallback", fake_call({"primær": {"ok": 0}, "fallback": {"ok": 1}},
+                                                                 release), hedge_after=0.01)
+    finally:
+        release.set()
+    assert generation.model == "fallback"
+    assert generation.data == {"ok": 1}
+    abandoned = [a for a in generation.attempts if a.model == "primær"]
+    assert abandoned and abandoned[0].error.startswith("forlatt")
+
+
+def test_hedged_does_not_start_fallback_without_quota():
+    release = threading.Event()
+    threading.Timer(0.1, release.set).start()
+    generation = _run_hedged("primær", "fallback", fake_call({"primær": {"ok": 0}, "fallback": {"ok": 1}}, release),
+                             hedge_after=0.01, allow=lambda model: False)
+    assert generation.model == "primær"
+    assert [(a.model, a.ok) for a in generation.attempts] == [("fallback", False), ("primær", True)]
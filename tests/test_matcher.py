@@ -0,0 +1,83 @@
+import pytest
+
+from klagehjelpen.contacts import load_contacts
+from klagehjelpen.matcher import ContactMatcher, edit_distance, normalize_name
+
+
+@pytest.fixture(scope="module")
+def matcher():
+    return ContactMatcher(load_contacts())
+
+
+# (navn fra AI-en, forventet "navn" i kontaktinfo eller None)
+@pytest.mark.parametrize("name, expected", [
+    ("Elkjøp Norge AS", "Elkjøp"),
+    ("ELKJOP ASA", "Elkjøp"),
+    ("Elkjop ASA", "Elkjøp"),
+    ("Elkjøpp", "Elkjøp"),
+    ("Service AS", None),
+    ("Nice Shoes AS", None),
+    ("Kidsbutikken AS", None),
+    ("Kid Interiør AS", "Kid Interiør"),
+    ("Powerhouse Events", None),
+    ("Tower AS", None),
+    ("POWER Norge AS", "Power"),
+    ("H&M Hennes & Mauritz AS", "H&M"),
+    ("HM Norge", "H&M"),
+    ("Clas Ohlson AS", "Clas Ohlson"),
+    ("Clasohlson", "Clas Ohlson"),
+    ("Komplet.no", "Komplett.no"),
+    ("Zalndo SE", "Zalando"),
+    ("Norwegian Air Shuttle ASA", "Norwegian"),
+    ("Fjord Line AS", "Fjord Line"),
+    ("Air France KLM", "Air France"),
+    ("Scandinavian Airlines (SAS)", "SAS"),
+    ("Europark AS", "Apcoa / EuroPark"),
+    ("Widerøe's Flyveselskap", "Widerøe"),
+    ("Møbelringen Sandvika", "Møbelringen"),
+    ("Intersport Oslo City", "Intersport"),
+    ("Sport 1 Trysil", "Sport 1"),
+    ("Rema 1000 Grünerløkka", "Rema 1000"),
+    ("Ice Communication Norge AS", "Ice"),
+    ("Vy Buss", "Vy"),
+    ("Vyer", None),
+    ("Apple Store", "Apple Store"),
+    ("Pineapple AS", None),
+    ("", None),
+    (None, None),
+])
+def test_match(matcher, name, expected):
+    info = matcher.match(name)
+    assert (info["navn"] if info else None) == expected
+
+
+@pytest.mark.parametrize("text, expected", [
+    ("H&M Hennes & Mauritz AS", "hm hennes mauritz as"),
+    ("Widerøe's Flyveselskap", "wideroe s flyveselskap"),
+    ("Grünerløkka", "grunerlokka"),
+    (None, ""),
+])
+def test_normalize_name(text, expected):
+    assert normalize_name(text) == expected
+
+
+@pytest.mark.parametrize("a, b, limit, expected", [
+    ("elkjop", "elkjop", 1, 0),
+    ("elkjopp", "elkjop", 1, 1),
+    ("zalndo", "zalando", 1, 1),
+    ("clasohlsen", "clasohlson", 2, 1),
+    ("firma42handel", "firma12handel", 2, 1),
+    ("abcdef", "badcfe", 3, 3),  # tre ombyttinger
+    ("komplet", "komplett", 1, 1),
+    ("power", "tower", 1, 1),
+    ("power", "shower", 1, 2),  # over grensen: limit + 1
+    ("abc", "abcdef", 1, 2),
+])
+def test_edit_distance(a, b, limit, expected):
+    assert edit_distance(a, b, limit) == expected
+    assert edit_distance(b, a, limit) == expected
+
+
+def test_scan_finds_aliases_in_running_text(matcher):
+    found = [match.info["navn"] for _, match in matcher.scan("Takk for handelen hos Elkjøp, betalt med Vipps")]
+    assert "Elkjøp" in found
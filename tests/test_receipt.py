@@ -0,0 +1,76 @@
+from datetime import date
+
+import pytest
+
+from bench.corpus import RECEIPT_LINES
+from klagehjelpen.contacts import ContactDirectory
+from klagehjelpen.receipt import extract_receipt_fields, find_amount, find_purchase_date
+
+
+@pytest.mark.parametrize("lines, expected", [
+    (["Vaskemaskin 5990,-"], 5990.0),
+    (["Sum 12 490,-"], 12490.0),
+    (["Totalt å betale            8 098,00 kr"], 8098.0),
+    (["kr 499"], 499.0),
+    (["Beløp 1.299,50"], 1299.5),
+    (["Å betale:", "349,00"], 349.0),
+    (["Dato 05.06.2024"], None),
+    (["Faktura 2024-02-01"], None),
+    (["Kjøpt 5. juni 2024"], None),
+    (["Antall 2", "Varenr 123456"], None),
+])
+def test_find_amount(lines, expected):
+    assert find_amount(lines) == expected
+
+
+def test_date_is_not_read_as_amount():
+    assert find_amount(["Dato 05.06.2024", "Vaskemaskin 5990,-"]) == 5990.0
+
+
+@pytest.mark.parametrize("lines, expected", [
+    (["Kjøpsdato: 12.03.2024"], date(2024, 3, 12)),
+    (["Ordredato", "2024-02-01"], date(2024, 2, 1)),
+    (["Levert 3. mars 2024"], date(2024, 3, 3)),
+])
+def test_find_purchase_date(lines, expected):
+    assert find_purchase_date(lines) == expected
+
+
+def test_power_receipt_with_dash_price():
+    fields = extract_receipt_fields("Power\nDato 05.06.2024\nVaskemaskin 5990,-", ContactDirectory().matcher())
+    assert fields.amount == 5990.0
+    assert fields.purchase_date == date(2024, 6, 5)
+
+
+def test_corpus_receipt():
+    fields = extract_receipt_fields("\n".join(RECEIPT_LINES), ContactDirectory().matcher())
+    assert fields.company
+    assert fields.amount == 8098.0
+    assert fields.purchase_date == date(2024, 3, 12)
+    assert fields.buyer_name == "Ola Nordmann"
+    assert fields.is_confident
+
+
+def test_seller_wins_over_brand_in_item_lines():
+    text = "\n".join([
+        "Elkjøp Norge AS",
+        "Org.nr 983 479 383 MVA",
+        "Kjøpsdato: 12.03.2024",
+        "Apple iPhone 15 128GB   1 stk   9 990,00",
+        "Apple AirPods Pro       1 stk   2 990,00",
+        "Apple USB-C lader       1 stk     249,00",
+        "Totalt å betale        13 229,00 kr",
+    ])
+    fields = extract_receipt_fields(text, ContactDirectory().matcher())
+    assert fields.company == "Elkjøp"
+
+
+def test_brand_only_in_item_lines_is_not_the_seller():
+    text = "Kvittering\nKjøpsdato: 12.03.2024\nApple iPhone 15   9 990,00\nApple lader   249,00\nSum 10 239,00 kr"
+    fields = extract_receipt_fields(text, ContactDirectory().matcher())
+    assert fields.company == ""
+    assert not fields.is_confident
+
+
+def test_nbsp_thousands_separator():
+    assert find_amount(["Totalt 12\u00a0490,00 kr"]) == 12490.0
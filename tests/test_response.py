@@ -0,0 +1,118 @@
+import pytest
+
+from klagehjelpen.response import (
+    DEFAULT_SUBJECT, FACT_FIELDS, FIELDS, ResponseError, clean_json_text, parse_complaint, parse_facts, repair_json,
+    validate_fields,
+)
+
+FULL = (
+    '{"selskapsnavn_funnet": "Elkjøp", "navn_paa_kvittering": "Ola Nordmann", "emne": "Reklamasjon på TV", '
+    '"mottaker_epost_gjetning": "hello@elkjop.no", "brødtekst": "Hei,\\n\\nTV-en er defekt."}'
+)
+
+
+@pytest.mark.parametrize("text, expected", [
+    ('```json\n{"a": 1}\n```', '{"a": 1}'),
+    ('```\n{"a": 1}```', '{"a": 1}'),
+    ('  {"a": 1}  ', '{"a": 1}'),
+])
+def test_clean_json_text(text, expected):
+    assert clean_json_text(text) == expected
+
+
+@pytest.mark.parametrize("text, data, truncated", [
+    ('{"emne": "Hei", "brødtekst": "Kort"}', {"emne": "Hei", "brødtekst": "Kort"}, False),
+    ('{"emne": "Hei", "brødtekst": "Avkor', {"emne": "Hei", "brødtekst": "Avkor"}, True),
+    ('{"emne": "Hei",', {"emne": "Hei"}, True),
+    ('{"emne": "Hei", "brødtekst": "Tekst",}', {"emne": "Hei", "brødtekst": "Tekst"}, False),
+])
+def test_repair_json(text, data, truncated):
+    repaired, was_truncated = repair_json(text)
+    assert repaired == data
+    assert was_truncated == truncated
+
+
+def test_parse_complete_response():
+    parsed = parse_complaint(FULL)
+    assert list(parsed.data) == list(FIELDS)
+    assert parsed.data["selskapsnavn_funnet"] == "Elkjøp"
+    assert not parsed.repaired
+    assert parsed.problems == []
+
+
+@pytest.mark.parametrize("text, repaired, problem", [
+    ("```json\n" + FULL + "\n```", False, None),
+    (FULL[:-1] + ",}", True, None),  # komma til slutt
+    (FULL.replace("\\n", "\n"), False, None),  # linjeskift rett i strengen
+    (FULL[:FULL.index("defekt")], True, "svaret var avkortet"),
+])
+def test_parse_repairs_malformed_json(text, repaired, problem):
+    parsed = parse_complaint(text)
+    assert parsed.repaired == repaired
+    assert parsed.data["brødtekst"].startswith("Hei,")
+    if problem:
+        assert problem in parsed.problems
+
+
+@pytest.mark.parametrize("data, field, value, problem", [
+    ({"brødtekst": "Tekst"}, "emne", DEFAULT_SUBJECT, "emne manglet"),
+    ({"brødtekst": "Tekst"}, "selskapsnavn_funnet", "", "selskapsnavn manglet"),
+    ({"brødtekst": "Tekst", "emne": "E", "selskapsnavn_funnet": "X", "mottaker_epost_gjetning": "ukjent"},
+     "mottaker_epost_gjetning", "", "ugyldig e-postadresse fjernet"),
+    ({"brødtekst": "Tekst", "emne": "E", "selskapsnavn_funnet": "X", "mottaker_epost_gjetning": "Skriv til a@b.no"},
+     "mottaker_epost_gjetning", "a@b.no", None),
+    ({"brødtekst": ["Avsnitt 1", "Avsnitt 2"], "emne": "E", "selskapsnavn_funnet": "X"},
+     "brødtekst", "Avsnitt 1\n\nAvsnitt 2", None),
+    ({"brødtekst": "T", "emne": {"tekst": "E"}, "selskapsnavn_funnet": "X"}, "emne", DEFAULT_SUBJECT,
+     "emne hadde ugyldig type"),
+    ({"brødtekst": "T", "emne": "E", "selskapsnavn_funnet": 42}, "selskapsnavn_funnet", "42", None),
+    ({"brødtekst": "T", "emne": "E", "selskapsnavn_funnet": "X", "navn_paa_kvittering": "null"},
+     "navn_paa_kvittering", None, None),
+    ({"brodtekst": "Alias", "emne": "E", "selskapsnavn": "X"}, "brødtekst", "Alias", None),
+])
+def test_validate_fields(data, field, value, problem):
+    result, problems = validate_fields(data)
+    assert list(result) == list(FIELDS)
+    assert result[field] == value
+    if problem:
+        assert problem in problems
+
+
+def test_extra_fields_are_dropped():
+    result, _ = validate_fields({"brødtekst": "T", "emne": "E", "ekstra": "x"})
+    assert "ekstra" not in result
+
+
+@pytest.mark.parametrize("text", ['{"emne": "Uten brødtekst"}', "[1, 2]", "ikke json", "", '{"brødtekst": ""}'])
+def test_unrecoverable_responses_raise(text):
+    with pytest.raises(ResponseError):
+        parse_complaint(text)
+
+
+def test_defaults_fill_missing_letter_fields():
+    facts = {"selskapsnavn_funnet": "Power", "mottaker_epost_gjetning": "kundeservice@power.no", "vare": "TV"}
+    parsed = parse_complaint('{"emne": "Reklamasjon", "brødtekst": "Hei"}', defaults=facts)
+    assert parsed.data["selskapsnavn_funnet"] == "Power"
+    assert parsed.data["mottaker_epost_gjetning"] == "kundeservice@power.no"
+    assert "vare" not in parsed.data
+
+
+def test_parse_facts_normalizes_values():
+    parsed = parse_facts(
+        '{"selskapsnavn_funnet": " Elkjøp ", "navn_paa_kvittering": "ukjent", '
+        '"mottaker_epost_gjetning": "Send til hello@elkjop.no", "belop": 8098, "skadebevis": "Sprukket skjerm"}'
+    )
+    assert list(parsed.data) == list(FACT_FIELDS)
+    assert parsed.data["selskapsnavn_funnet"] == "Elkjøp"
+    assert parsed.data["navn_paa_kvittering"] is None
+    assert parsed.data["mottaker_epost_gjetning"] == "hello@elkjop.no"
+    assert parsed.data["belop"] == "8098"
+    assert parsed.data["vare"] is None
+
+
+def test_parse_facts_truncated_and_invalid():
+    parsed = parse_facts('{"selskapsnavn_funnet": "Power", "skadebevis": "Lekker va')
+    assert parsed.repaired
+    assert parsed.data["skadebevis"] == "Lekker va"
+    with pytest.raises(ResponseError):
+        parse_facts("[]")